@@ -0,0 +1,73 @@
+# analysis_cache.py
+
+# In-process cache of the analysis page. The analysis files only change when
+# /run-analysis writes them, so the decoded analysis and the rendered HTML are
+# kept in memory keyed by the generations of the files they were built from.
+# Within the TTL an entry is served without touching the bucket at all; after
+# that the file generations are checked (metadata only) and the entry is
+# reused if they haven't changed. /run-analysis invalidates the entry in its
+# own process straight away; other instances pick the new files up once their
+# TTL runs out
+import os
+import threading
+import time
+
+class AnalysisCache:
+    def __init__(self, ttl, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.invalidations = 0
+        self._entry = None
+        self._lock = threading.Lock()
+
+    # Return the cached entry if it is within its TTL, or None. Counts a hit
+    # when it returns an entry
+    def fresh_entry(self):
+        with self._lock:
+            entry = self._entry
+            if entry is None or self.clock() - entry['CheckedAt'] >= self.ttl:
+                return None
+            self.hits += 1
+            return entry
+
+    # Return the cached entry if it was built from these file generations,
+    # starting its TTL again, or None. Counts a hit (and a revalidation) or a
+    # miss
+    def entry_for(self, generations):
+        with self._lock:
+            entry = self._entry
+            if entry is None or entry['Generations'] != generations:
+                self.misses += 1
+                return None
+            entry['CheckedAt'] = self.clock()
+            self.hits += 1
+            self.revalidations += 1
+            return entry
+
+    def store(self, generations, analysis, html):
+        entry = {
+            'Generations': generations,
+            'Analysis': analysis,
+            'HTML': html,
+            'CheckedAt': self.clock()
+        }
+        with self._lock:
+            self._entry = entry
+        return entry
+
+    def invalidate(self):
+        with self._lock:
+            self._entry = None
+            self.invalidations += 1
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'revalidations': self.revalidations,
+                'invalidations': self.invalidations}
+
+# Build a cache with the TTL (in seconds) configured in the environment. With
+# a TTL of 0 every view checks the file generations
+def analysis_cache_from_environment():
+    return AnalysisCache(float(os.environ.get('ANALYSIS_CACHE_TTL', 60)))
@@ -0,0 +1,215 @@
+# benchmark.py
+
+# Offline parser benchmarks over the saved pages in test_data. Each entry
+# point is run over every page of its kind, reporting throughput, the time
+# spent in each stage of the parse and the peak memory allocated, and the
+# results are compared against a stored baseline. Nothing is fetched.
+#
+# Throughput depends on the machine, so every run also times a fixed
+# calibration workload that doesn't touch the parsers, and the baseline's
+# throughput is scaled by how much faster or slower this machine ran it.
+# That only corrects for raw CPU speed: the corpus is 3 pages and runs on
+# other hardware still vary by a few percent, so the default tolerance
+# is kept wide (25%). For a tighter check, record a baseline on the machine
+# you compare on with --save-baseline. Peak memory doesn't depend on the
+# machine and isn't scaled.
+#
+# Usage: python benchmark.py [--repeat N] [--tolerance FRACTION]
+#                            [--baseline FILE] [--save-baseline]
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+import main
+
+corpus_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data')
+baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+
+# Slower or larger than the baseline by more than this fraction is a regression
+default_tolerance = 0.25
+
+# Helper function to load the corpus, split into match reports and schedule
+# pages by the tables they contain
+def load_corpus(directory=corpus_directory):
+    corpus = {'match_report': [], 'schedule': []}
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith('.html'):
+            continue
+        with open(os.path.join(directory, file_name)) as page_file:
+            page = page_file.read()
+        if main.page_has_tables(main.unwrap_commented_tables(page), main.schedule_tables):
+            corpus['schedule'].append(page)
+        else:
+            corpus['match_report'].append(page)
+    return corpus
+
+# Parse a match report the way collect_match_json does, timing each stage
+def run_match_report(page, timings):
+    start = time.perf_counter()
+    page_content = main.unwrap_commented_tables(page)
+    timings['unwrap'] += time.perf_counter() - start
+
+    start = time.perf_counter()
+    soup = main.make_soup(page_content)
+    timings['make_soup'] += time.perf_counter() - start
+
+    match = main.build_empty_json_obj()
+    for stage, parse in [('parse_header', main.parse_header), ('parse_players', main.parse_players),
+                         ('parse_keepers', main.parse_keepers)]:
+        start = time.perf_counter()
+        match = parse(soup, match)
+        timings[stage] += time.perf_counter() - start
+    return match
+
+# Parse a schedule page the way find_new_matches does, timing each stage
+def run_schedule(page, timings):
+    start = time.perf_counter()
+    page_content = main.unwrap_commented_tables(page)
+    timings['unwrap'] += time.perf_counter() - start
+
+    start = time.perf_counter()
+    fixtures = main.parse_schedule(page_content)
+    timings['parse_schedule'] += time.perf_counter() - start
+    return fixtures
+
+entry_points = {
+    'match_report': (run_match_report, ['unwrap', 'make_soup', 'parse_header', 'parse_players', 'parse_keepers']),
+    'schedule': (run_schedule, ['unwrap', 'parse_schedule']),
+}
+
+# Benchmark one entry point over its pages. Every page is parsed once to warm
+# up, then repeat timed passes are made over all the pages (the median pass
+# is reported), then one pass under tracemalloc measures the peak memory of
+# the largest page
+def benchmark_entry_point(name, pages, repeat):
+    run, stages = entry_points[name]
+    for page in pages:
+        run(page, dict.fromkeys(stages, 0.0))
+
+    passes = []
+    for i in range(repeat):
+        timings = dict.fromkeys(stages, 0.0)
+        start = time.perf_counter()
+        for page in pages:
+            run(page, timings)
+        passes.append((time.perf_counter() - start, timings))
+    passes.sort(key=lambda timed_pass: timed_pass[0])
+    elapsed, timings = passes[len(passes) // 2]
+
+    peak = 0
+    tracemalloc.start()
+    try:
+        for page in pages:
+            tracemalloc.reset_peak()
+            run(page, dict.fromkeys(stages, 0.0))
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+
+    result = {}
+    result['Pages'] = len(pages)
+    result['PagesPerSecond'] = len(pages) / elapsed
+    result['StageMs'] = {stage: timings[stage] / len(pages) * 1000 for stage in stages}
+    result['PeakMB'] = peak / 1e6
+    return result
+
+# Time a fixed pure Python workload (encoding, decoding and scanning JSON,
+# like the parsers' string handling) and return how many runs it makes per
+# second, the median of repeat timed passes
+def calibrate(repeat=5):
+    payload = [{'Name': 'Player %d' % i, 'Min': i % 90, 'xG': i / 100, 'Pos': ['FW', 'MF', 'DF'][i % 3]} for i in range(2000)]
+    rates = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        for run in range(5):
+            text = json.dumps(payload)
+            decoded = json.loads(text)
+            re.findall(r'"Pos": "(\w+)"', text)
+            sorted(decoded, key=lambda player: player['xG'])
+        rates.append(5 / (time.perf_counter() - start))
+    rates.sort()
+    return rates[len(rates) // 2]
+
+def run_benchmarks(corpus, repeat=5):
+    results = {}
+    for name in entry_points:
+        if corpus[name]:
+            results[name] = benchmark_entry_point(name, corpus[name], repeat)
+    return results
+
+# How much faster this machine is than the one the baseline was recorded on,
+# from their calibration rates (1 if either is unknown)
+def machine_scale(baseline, calibration=None):
+    if calibration is None or 'Calibration' not in baseline:
+        return 1.0
+    return calibration / baseline['Calibration']['RunsPerSecond']
+
+# Compare results against a baseline. Returns a description of every entry
+# point whose throughput dropped (relative to the baseline scaled to this
+# machine), or whose peak memory grew, by more than the tolerance
+def compare_to_baseline(results, baseline, tolerance=default_tolerance, calibration=None):
+    scale = machine_scale(baseline, calibration)
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]
+        expected_rate = expected['PagesPerSecond'] * scale
+        if result['PagesPerSecond'] < expected_rate * (1 - tolerance):
+            regressions.append('%s: %.1f pages/s, baseline %.1f pages/s on this machine' % (name, result['PagesPerSecond'], expected_rate))
+        if result['PeakMB'] > expected['PeakMB'] * (1 + tolerance):
+            regressions.append('%s: %.2f MB peak, baseline %.2f MB peak' % (name, result['PeakMB'], expected['PeakMB']))
+    return regressions
+
+def print_results(results, baseline=None, calibration=None):
+    print('Parser benchmarks (' + main.html_parser + '):')
+    if calibration is not None:
+        line = '   calibration: %.1f runs/s' % calibration
+        if baseline and 'Calibration' in baseline:
+            line += ' (baseline %.1f runs/s)' % baseline['Calibration']['RunsPerSecond']
+        print(line)
+    scale = machine_scale(baseline, calibration) if baseline else 1.0
+    for name, result in results.items():
+        line = '   %s: %d pages, %.1f pages/s, %.2f MB peak' % (name, result['Pages'], result['PagesPerSecond'], result['PeakMB'])
+        if baseline and name in baseline:
+            line += ' (baseline %.1f pages/s on this machine, %.2f MB peak)' % (baseline[name]['PagesPerSecond'] * scale, baseline[name]['PeakMB'])
+        print(line)
+        for stage, stage_ms in result['StageMs'].items():
+            print('      %s: %.2f ms/page' % (stage, stage_ms))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the parsers on the saved pages in test_data')
+    parser.add_argument('--repeat', type=int, default=5, help='timed passes over the corpus')
+    parser.add_argument('--tolerance', type=float, default=default_tolerance, help='allowed slowdown or memory growth (fraction)')
+    parser.add_argument('--baseline', default=baseline_path)
+    parser.add_argument('--save-baseline', action='store_true', help='record these results as the new baseline')
+    args = parser.parse_args()
+
+    calibration = calibrate(args.repeat)
+    results = run_benchmarks(load_corpus(), repeat=args.repeat)
+
+    if args.save_baseline:
+        print_results(results, calibration=calibration)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(dict(results, Calibration={'RunsPerSecond': calibration}), baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print('Saved baseline to', args.baseline)
+        sys.exit(0)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline, calibration)
+    if baseline is None:
+        print('No baseline at', args.baseline, '- run with --save-baseline to record one')
+        sys.exit(0)
+
+    regressions = compare_to_baseline(results, baseline, args.tolerance, calibration)
+    for regression in regressions:
+        print('REGRESSION', regression)
+    sys.exit(1 if regressions else 0)
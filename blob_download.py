@@ -0,0 +1,96 @@
+# blob_download.py
+
+# Concurrent download stage for stored objects. Each worker downloads one
+# object and decodes it straight away, so decoding overlaps with the downloads
+# still in flight. All workers share the caller's storage backend (and so its
+# client and HTTP connection pool)
+import concurrent.futures
+import json
+import os
+import time
+
+from metrics import stage_seconds
+from storage_backend import PreconditionFailed
+
+download_workers = int(os.environ.get('DOWNLOAD_WORKERS', 8))
+
+# Download and decode objects from a storage backend. objects is a list of
+# (name, generation) pairs; a generation of None means the latest version.
+# When a cache is given, objects are read through it by generation.
+# An object that has been rewritten since its generation was recorded (ex. a
+# stale manifest entry) is read at its latest generation instead, and
+# on_stale, if given, is called once with a dict from each such name to the
+# StoredObject it was read from and its decoded contents, so the caller can
+# refresh what it recorded.
+# Returns two dicts keyed by object name: the decoded contents (None for
+# objects that don't exist) and the seconds each download took
+def download_blobs(bucket, objects, cache=None, decode=json.loads, max_workers=None, on_stale=None):
+    stale = {}
+
+    def download_latest(name):
+        data, stored = bucket.get_object(name)
+        if stored is None:
+            return None
+        if cache is not None:
+            cache.put(name, stored.generation, data)
+        content = decode(data)
+        stale[name] = (stored, content)
+        return content
+
+    def download(name, generation):
+        start = time.perf_counter()
+        if generation is None:
+            if cache is None:
+                data = bucket.get(name)
+                return name, None if data is None else decode(data), time.perf_counter() - start
+            stored = bucket.stat(name)
+            if stored is None:
+                return name, None, time.perf_counter() - start
+            generation = stored.generation
+
+        try:
+            if cache is not None:
+                data = cache.get_or_load(name, generation, lambda: bucket.get(name, generation))
+            else:
+                data = bucket.get(name, generation)
+        except PreconditionFailed:
+            return name, download_latest(name), time.perf_counter() - start
+        return name, None if data is None else decode(data), time.perf_counter() - start
+
+    # Each object is only downloaded once, however many times it is requested
+    unique_objects = {}
+    for name, generation in objects:
+        unique_objects.setdefault(name, generation)
+
+    contents = {}
+    latencies = {}
+    if not unique_objects:
+        return contents, latencies
+
+    start = time.perf_counter()
+    workers = min(max_workers or download_workers, len(unique_objects))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        jobs = [executor.submit(download, name, generation) for name, generation in unique_objects.items()]
+        for job in concurrent.futures.as_completed(jobs):
+            name, content, latency = job.result()
+            contents[name] = content
+            latencies[name] = latency
+            stage_seconds.observe(latency, stage='download')
+
+    print_download_statistics(latencies, time.perf_counter() - start)
+    if stale:
+        print('Read', len(stale), 'rewritten objects at their latest generation')
+        if on_stale is not None:
+            on_stale(stale)
+    return contents, latencies
+
+# Helper method to print a summary of the latencies from download_blobs
+def print_download_statistics(latencies, elapsed):
+    if not latencies:
+        return
+    slowest = max(latencies, key=latencies.get)
+    print('Download statistics:')
+    print('   Files: ', len(latencies))
+    print('   Elapsed: ', '%.3fs' % elapsed)
+    print('   Mean per file: ', '%.3fs' % (sum(latencies.values()) / len(latencies)))
+    print('   Slowest: ', slowest, '%.3fs' % latencies[slowest])
@@ -0,0 +1,261 @@
+# browser_pool.py
+
+# A long-lived headless Chrome shared by every page fetch. Launching Chrome
+# costs far more than rendering a single fbref page, so the browser and a
+# bounded set of tabs are kept alive between requests and recycled once they
+# have served too many pages or grown too large.
+import asyncio
+import os
+import threading
+import time
+
+import pyppeteer
+
+from event_loop import EventLoop
+from metrics import timed_stage
+
+launch_options = {
+    'executablePath': 'google-chrome-unstable',
+    'ignoreHTTPSErrors': True,
+    'dumpio': True,
+    'headless': True,
+    'handleSIGINT': False,
+    'handleSIGTERM': False,
+    'handleSIGHUP': False
+}
+
+# Seconds between CDP round trips used to check that the browser still responds
+HEALTH_CHECK_INTERVAL = 30
+HEALTH_CHECK_TIMEOUT = 5
+NAVIGATION_TIMEOUT_MS = 60000
+
+# Helper function to read the resident set size (in MB) of a process and all
+# of its children. Chrome keeps most of its memory in renderer processes, so
+# only looking at the browser process would hide the growth we care about.
+# Returns 0 if the process information can't be read
+def read_process_tree_rss_mb(pid):
+    total_kb = 0
+    pending = [pid]
+    seen = set()
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        try:
+            with open('/proc/%d/status' % current) as status_file:
+                for line in status_file:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+                        break
+        except (OSError, ValueError, TypeError):
+            continue
+        try:
+            with open('/proc/%d/task/%d/children' % (current, current)) as children_file:
+                pending.extend(int(child) for child in children_file.read().split())
+        except (OSError, ValueError):
+            pass
+    return total_kb / 1024
+
+# Helper function to decide whether a browser should be replaced, based on how
+# many pages it has rendered and how much memory it is holding on to
+def should_recycle(pages_served, rss_mb, max_pages, max_rss_mb):
+    if max_pages and pages_served >= max_pages:
+        return True
+    if max_rss_mb and rss_mb >= max_rss_mb:
+        return True
+    return False
+
+class BrowserPool:
+    # The browser is bound to the event loop it was launched on. Pass the
+    # process's shared loop to render pages alongside other work on it; a pool
+    # without one runs its own loop and stops it when closed
+    def __init__(self, max_tabs=2, max_pages=200, max_rss_mb=1024, options=None, event_loop=None):
+        self.max_tabs = max_tabs
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.options = options if options is not None else launch_options
+
+        # Statistics, mostly useful when tuning the limits above
+        self.pages_served = 0
+        self.launches = 0
+        self.recycles = 0
+
+        self._owns_loop = event_loop is None
+        self.event_loop = event_loop if event_loop is not None else EventLoop('browser-pool')
+        self._close_lock = threading.Lock()
+        self._closed = False
+
+        # Only touched from the pool's event loop
+        self._browser = None
+        self._browser_pages = 0
+        self._last_health_check = 0
+        self._idle_tabs = []
+        self._tabs_in_use = {}
+        self._retired = []
+        self._tab_semaphore = None
+        self._browser_lock = None
+
+    # Render a page and return its HTML. Safe to call from any thread other
+    # than the loop's; coroutines on the loop await fetch instead
+    def get_page(self, url, timeout=None):
+        if self._closed:
+            raise RuntimeError('Browser pool has been shut down')
+        return self.event_loop.run(self.fetch(url), timeout)
+
+    # Must run on the pool's event loop
+    async def fetch(self, url):
+        if self._closed:
+            raise RuntimeError('Browser pool has been shut down')
+        if self._tab_semaphore is None:
+            self._tab_semaphore = asyncio.Semaphore(self.max_tabs)
+            self._browser_lock = asyncio.Lock()
+
+        async with self._tab_semaphore:
+            browser, tab = await self._acquire_tab()
+            healthy = False
+            try:
+                with timed_stage('navigate'):
+                    await tab.goto(url, {'waitUntil': 'load', 'timeout': NAVIGATION_TIMEOUT_MS})
+                print("Rendered page...")
+                with timed_stage('render'):
+                    content = await tab.content()
+                healthy = True
+            finally:
+                await self._release_tab(browser, tab, healthy)
+
+        self.pages_served += 1
+        return content
+
+    async def _launch(self):
+        print("Launching browser...")
+        with timed_stage('launch'):
+            browser = await pyppeteer.launch(self.options)
+        print("Launched browser...")
+        self.launches += 1
+        self._browser_pages = 0
+        self._last_health_check = time.monotonic()
+        self._tabs_in_use[browser] = 0
+        return browser
+
+    async def _browser_is_healthy(self, browser):
+        process = browser.process
+        if process is not None and process.poll() is not None:
+            return False
+        if time.monotonic() - self._last_health_check < HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            await asyncio.wait_for(browser.version(), HEALTH_CHECK_TIMEOUT)
+        except Exception:
+            return False
+        self._last_health_check = time.monotonic()
+        return True
+
+    def _browser_rss_mb(self, browser):
+        process = browser.process
+        if process is None:
+            return 0
+        return read_process_tree_rss_mb(process.pid)
+
+    # Stop handing out tabs from the current browser. It is closed as soon as
+    # the tabs it still has in flight are released
+    async def _retire_browser(self):
+        browser = self._browser
+        self._browser = None
+        for tab in self._idle_tabs:
+            try:
+                await tab.close()
+            except Exception:
+                pass
+        self._idle_tabs = []
+        if browser is None:
+            return
+        if self._tabs_in_use.get(browser, 0) == 0:
+            await self._close_browser(browser)
+        else:
+            self._retired.append(browser)
+
+    async def _close_browser(self, browser):
+        self._tabs_in_use.pop(browser, None)
+        try:
+            await browser.close()
+        except Exception:
+            pass
+
+    async def _acquire_tab(self):
+        async with self._browser_lock:
+            if self._browser is not None:
+                if not await self._browser_is_healthy(self._browser):
+                    print("Browser stopped responding, relaunching...")
+                    await self._retire_browser()
+                elif should_recycle(self._browser_pages, self._browser_rss_mb(self._browser),
+                                    self.max_pages, self.max_rss_mb):
+                    print("Recycling browser...")
+                    self.recycles += 1
+                    await self._retire_browser()
+
+            if self._browser is None:
+                self._browser = await self._launch()
+
+            browser = self._browser
+            tab = None
+            while self._idle_tabs:
+                candidate = self._idle_tabs.pop()
+                if not candidate.isClosed():
+                    tab = candidate
+                    break
+            if tab is None:
+                tab = await browser.newPage()
+
+            self._browser_pages += 1
+            self._tabs_in_use[browser] = self._tabs_in_use.get(browser, 0) + 1
+            return browser, tab
+
+    async def _release_tab(self, browser, tab, healthy):
+        async with self._browser_lock:
+            self._tabs_in_use[browser] = self._tabs_in_use.get(browser, 1) - 1
+            if healthy and browser is self._browser and not tab.isClosed():
+                self._idle_tabs.append(tab)
+            else:
+                try:
+                    await tab.close()
+                except Exception:
+                    pass
+
+            if browser in self._retired and self._tabs_in_use.get(browser, 0) == 0:
+                self._retired.remove(browser)
+                await self._close_browser(browser)
+
+    async def _shutdown(self):
+        if self._browser_lock is None:
+            return
+        async with self._browser_lock:
+            await self._retire_browser()
+            for browser in self._retired:
+                await self._close_browser(browser)
+            self._retired = []
+
+    # Close every browser, and stop the loop if the pool owns it. Called at
+    # interpreter exit and from the gunicorn worker_exit hook
+    def close(self, timeout=10):
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self.event_loop.started:
+            try:
+                self.event_loop.run(self._shutdown(), timeout)
+            except Exception as e:
+                print('Error shutting down browser pool:', e)
+        if self._owns_loop:
+            self.event_loop.close(timeout)
+
+# Build a pool using the limits configured in the environment, rendering on
+# event_loop
+def pool_from_environment(event_loop=None):
+    return BrowserPool(
+        max_tabs=int(os.environ.get('BROWSER_POOL_TABS', 2)),
+        max_pages=int(os.environ.get('BROWSER_POOL_MAX_PAGES', 200)),
+        max_rss_mb=int(os.environ.get('BROWSER_POOL_MAX_RSS_MB', 1024)),
+        event_loop=event_loop
+    )
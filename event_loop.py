@@ -0,0 +1,82 @@
+# event_loop.py
+
+# One asyncio event loop per process, running in a background thread for the
+# life of the process. Flask handlers run in gunicorn's threads and submit
+# coroutines to it with run(), so fetches from every request share one loop
+# (and the browser bound to it) instead of each paying for a loop of its own.
+# Blocking calls (storage, requests, parsing) are awaited with
+# asyncio.to_thread, on the loop's executor of blocking_workers threads
+import asyncio
+import concurrent.futures
+import os
+import threading
+
+class EventLoop:
+    def __init__(self, name='event-loop', blocking_workers=16):
+        self.name = name
+        self.blocking_workers = blocking_workers
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._closed = False
+
+    # Whether the loop has been started (it starts on first use)
+    @property
+    def started(self):
+        return self._loop is not None
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Event loop has been shut down')
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.blocking_workers, thread_name_prefix=self.name + '-blocking'))
+                self._thread = threading.Thread(target=self._loop.run_forever, name=self.name, daemon=True)
+                self._thread.start()
+            return self._loop
+
+    # Schedule a coroutine on the loop and return a concurrent.futures.Future
+    # for its result. Safe to call from any thread
+    def submit(self, coroutine):
+        try:
+            loop = self._ensure_loop()
+        except RuntimeError:
+            coroutine.close()
+            raise
+        return asyncio.run_coroutine_threadsafe(coroutine, loop)
+
+    # Schedule a plain callback on the loop. Safe to call from any thread
+    def call_soon(self, callback, *args):
+        self._ensure_loop().call_soon_threadsafe(callback, *args)
+
+    # Run a coroutine on the loop and wait for its result. Code already
+    # running on the loop has to await the coroutine instead, or it would wait
+    # on itself forever
+    def run(self, coroutine, timeout=None):
+        if self._thread is not None and threading.current_thread() is self._thread:
+            coroutine.close()
+            raise RuntimeError('EventLoop.run called from the event loop thread')
+        return self.submit(coroutine).result(timeout)
+
+    # Stop the loop and its blocking executor. Called at interpreter exit and
+    # from the gunicorn worker_exit hook, after anything using the loop (ex.
+    # the browser pool) has shut down
+    def close(self, timeout=10):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            loop = self._loop
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout)
+        if not loop.is_running():
+            loop.run_until_complete(loop.shutdown_default_executor())
+            loop.close()
+
+# Build a loop with the number of blocking workers configured in the environment
+def event_loop_from_environment():
+    return EventLoop(blocking_workers=int(os.environ.get('EVENT_LOOP_WORKERS', 16)))
@@ -0,0 +1,10 @@
+# gunicorn.conf.py
+# Picked up automatically by gunicorn when started from the app directory
+
+# Close the shared headless Chrome before a worker exits, so browsers aren't
+# left behind when gunicorn restarts or scales down workers, then stop the
+# event loop it ran on
+def worker_exit(server, worker):
+    import main
+    main.browser_pool.close()
+    main.event_loop.close()
@@ -0,0 +1,225 @@
+# jobs.py
+
+# Background jobs for the endpoints that do too much work to finish inside a
+# request (the /findmatches crawl and /run-analysis). A job runs as a task on
+# the shared event loop and reports progress in a dictionary the endpoint at
+# /jobs/<id> serves while it runs. Jobs started with the same key never run at
+# the same time: submitting one while another with its key is queued or
+# running returns the existing job. Jobs are kept in memory, so they are per
+# process (the service runs one gunicorn worker) and lost on restart.
+#
+# Jobs await blocking calls with to_thread below rather than
+# asyncio.to_thread, so a cancelled job waits for the calls it started in
+# other threads before it counts as finished. A job submitted with a profile
+# session (from a profiled request) runs those calls under the profiler, and
+# writes the profile when it ends
+import asyncio
+import contextvars
+import threading
+import time
+import uuid
+
+# Finished jobs kept for polling, on top of the ones still running
+default_finished_jobs_kept = 50
+
+# The job whose task (or a task it started) is running
+current_job = contextvars.ContextVar('current_job', default=None)
+
+# Run a blocking call in the event loop's executor. Inside a job the call is
+# tracked, and keeps running if the job is cancelled while awaiting it, so
+# the job can wait for it before it finishes
+async def to_thread(function, *args, **kwargs):
+    job = current_job.get()
+    if job is None:
+        return await asyncio.to_thread(function, *args, **kwargs)
+    if job.profile is not None:
+        function, args = job.profiler.profile_call, (job.profile, function) + args
+    return await asyncio.shield(start_call(job, function, *args, **kwargs))
+
+# Wait for the blocking calls a job (by default the current one) started to
+# return, even if the job is cancelled again meanwhile. Work that uses their
+# results after the job stops (ex. saving what was stored so far) waits for
+# them first
+async def wait_for_calls(job=None):
+    job = job or current_job.get()
+    while job is not None and job.threads:
+        try:
+            done, pending = await asyncio.wait(list(job.threads))
+        except asyncio.CancelledError:
+            continue
+        for call in done:
+            if not call.cancelled():
+                call.exception()
+
+# Start a blocking call tracked for a job. Returns its future
+def start_call(job, function, *args, **kwargs):
+    call = asyncio.ensure_future(asyncio.to_thread(function, *args, **kwargs))
+    job.threads.add(call)
+    call.add_done_callback(job.threads.discard)
+    return call
+
+class Job:
+    def __init__(self, kind, key=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.status = 'queued'
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.future = None
+        self.task = None
+        self.threads = set()
+        self.profile = None
+        self.profiler = None
+        self.profile_name = None
+
+    @property
+    def done(self):
+        return self.status in ['succeeded', 'failed', 'cancelled']
+
+    def describe(self):
+        return {
+            'Id': self.id,
+            'Kind': self.kind,
+            'Status': self.status,
+            'Progress': dict(self.progress),
+            'Result': self.result,
+            'Error': self.error,
+            'Created': self.created,
+            'Started': self.started,
+            'Finished': self.finished,
+            'Profile': self.profile_name
+        }
+
+class JobQueue:
+    def __init__(self, event_loop, finished_jobs_kept=default_finished_jobs_kept, profiler=None):
+        self.event_loop = event_loop
+        self.profiler = profiler
+        self.finished_jobs_kept = finished_jobs_kept
+        self._jobs = {}
+        self._active = {}
+        self._lock = threading.Lock()
+
+    # Start a job. run is called with the job and returns the coroutine that
+    # does the work; it can report progress by updating job.progress, and
+    # what it returns becomes the job's result. Returns the job and whether
+    # it was created (False if a job with the same key was already running).
+    # profile is a session from the queue's profiler, started by the calling
+    # thread: a job that is created and scheduled (when the queue has a
+    # profiler) takes it over and sets job.profile; otherwise the caller
+    # still has to finish it
+    def submit(self, kind, run, key=None, profile=None):
+        with self._lock:
+            if key is not None and key in self._active:
+                return self._active[key], False
+            job = Job(kind, key)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._active[key] = job
+            self._prune()
+
+        if profile is not None and self.profiler is not None:
+            self.profiler.hand_off(profile)
+            job.profile = profile
+            job.profiler = self.profiler
+        try:
+            job.future = self.event_loop.submit(self._run(job, run))
+        except Exception as e:
+            job.profile = None
+            self._finish(job, 'failed', error=str(e) or type(e).__name__)
+            raise
+        return job, True
+
+    async def _run(self, job, run):
+        with self._lock:
+            if job.status == 'cancelling':
+                cancelled_before_start = True
+            else:
+                cancelled_before_start = False
+                job.status = 'running'
+                job.started = time.time()
+                job.task = asyncio.current_task()
+        if cancelled_before_start:
+            if job.profile is not None:
+                await self._write_profile(job)
+            self._finish(job, 'cancelled')
+            raise asyncio.CancelledError()
+
+        current_job.set(job)
+        status, result, error = 'failed', None, None
+        try:
+            result = await run(job)
+            status = 'succeeded'
+            return result
+        except asyncio.CancelledError:
+            status = 'cancelled'
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            raise
+        finally:
+            await wait_for_calls(job)
+            if job.profile is not None:
+                await self._write_profile(job)
+            self._finish(job, status, result, error)
+
+    # Write a job's profile in the executor, and wait for it even if the job
+    # is cancelled meanwhile
+    async def _write_profile(self, job):
+        call = start_call(job, self._finish_profile, job)
+        await wait_for_calls(job)
+        job.profile_name = call.result()
+
+    # Returns the profile's name, or None if it couldn't be written (which
+    # doesn't fail the job)
+    def _finish_profile(self, job):
+        try:
+            return self.profiler.finish(job.profile)
+        except Exception as e:
+            print('Error writing profile', e)
+            return None
+
+    # Record how a job ended, and let another job with its key start
+    def _finish(self, job, status, result=None, error=None):
+        with self._lock:
+            job.status = status
+            job.result = result
+            job.error = error
+            job.finished = time.time()
+            if job.key is not None and self._active.get(job.key) is job:
+                del self._active[job.key]
+        if status == 'failed':
+            print('Job', job.kind, job.id, 'failed:', error)
+
+    # Drop the oldest finished jobs beyond finished_jobs_kept. Called with the
+    # lock held
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.done]
+        for job in finished[:max(0, len(finished) - self.finished_jobs_kept)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    # Ask a job to stop. It is cancelled at its next await, and shows as
+    # cancelling until the calls it started in other threads (ex. a write to
+    # storage) have returned; only then can another job with its key start.
+    # Returns False if the job doesn't exist or has already finished
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in ['queued', 'running']:
+                return False
+            job.status = 'cancelling'
+        self.event_loop.call_soon(self._cancel_task, job)
+        return True
+
+    # Runs on the loop. A job that hasn't started yet sees it is cancelling
+    # when it starts
+    def _cancel_task(self, job):
+        if job.task is not None:
+            job.task.cancel()
@@ -2,58 +2,204 @@
 
 # Imports for web server
 import os
-from flask import Flask, render_template, json, jsonify
+from flask import Flask, render_template, json, jsonify, request, g
 
 # Imports for web scraping
-from requests_html import AsyncHTMLSession
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, FeatureNotFound
 import asyncio
-import pyppeteer
+import atexit
+import gzip
+import html
 import re
+import requests
 import time
-
-# Imports for Google Cloud Storage
-from google.cloud import storage
+from browser_pool import pool_from_environment
+from event_loop import event_loop_from_environment
+from jobs import JobQueue, to_thread, wait_for_calls
+from rate_limit import HostRateLimiter, TokenBucket
+from analysis_cache import analysis_cache_from_environment
+from blob_download import download_blobs
+from match_cache import cache_from_environment
+from metrics import registry, request_seconds, timed_stage
+from page_cache import page_cache_from_environment
+from profiling import profiler_from_environment
+from match_manifest import (build_manifest_entry, build_team_index, load_manifest,
+                            refresh_stale_entries, sorted_entries, update_manifest)
+from scoring import score_analysis
+from season_store import update_season_store
+from storage_backend import PreconditionFailed, backend_from_environment
 import datetime
 
 app = Flask(__name__)
 
-# Configure this environment variable via app.yaml
-bucket_name = os.environ.get('CLOUD_STORAGE_BUCKET')
+# Where matches, archives and analysis files are stored: the bucket named by
+# CLOUD_STORAGE_BUCKET (configure this environment variable via app.yaml), or
+# a local directory with STORAGE_BACKEND=local (see storage_backend.py)
+storage_backend = backend_from_environment()
+
+# Opt-in profiling of sampled or signed requests (see profiling.py)
+request_profiler = profiler_from_environment(storage_backend)
 
 analysis_file_names = ["todays_analysis.json", "tomorrows_analysis.json"]
 
+# Analysis for every day in the horizon, keyed by date (YYYYMMDD)
+upcoming_analysis_file_name = "upcoming_analysis.json"
+
+# Number of days (starting today) covered by /run-analysis, unless the request
+# asks for a different number with ?days= (between 2 and max_analysis_days)
+analysis_days = int(os.environ.get('ANALYSIS_DAYS', 2))
+max_analysis_days = int(os.environ.get('MAX_ANALYSIS_DAYS', 14))
+
+# Number of past matches included for each team in an analysis
+past_matches_per_team = 10
+
+# How pages are fetched. 'static' does a plain HTTP GET and only falls back to
+# rendering in the browser when the tables we need are missing from the
+# response, 'browser' always renders
+fetch_mode = os.environ.get('FETCH_MODE', 'static')
+
+# BeautifulSoup tree builder used for every page. 'lxml' is C-accelerated and
+# much faster on large pages; 'html.parser' needs no extra packages
+html_parser = os.environ.get('HTML_PARSER', 'lxml')
+
+# Table ids (as regular expressions) a page must contain to be parsed
+match_report_tables = [r'stats_(.+)_summary', r'stats_(.+)_misc', r'stats_(.+)_passing\b', r'keeper_stats_(.+)']
+schedule_tables = [r'sched_(.+)']
+
+# Requests to fbref are limited to fbref_requests_per_minute across every
+# thread (bursts of up to fbref_request_burst), and up to collect_workers
+# matches are collected at once
+fbref_requests_per_minute = float(os.environ.get('FBREF_REQUESTS_PER_MINUTE', 10))
+fbref_request_burst = int(os.environ.get('FBREF_REQUEST_BURST', 1))
+collect_workers = int(os.environ.get('COLLECT_WORKERS', 3))
+host_rate_limiter = HostRateLimiter({
+    'fbref.com': TokenBucket(fbref_requests_per_minute / 60, fbref_request_burst)
+})
+
 # Helper function to avoid calling methods on empty objects
 def ASSIGN_OR_RAISE(expr):
     if expr is None:
         raise ValueError('Error parsing page')
     return expr
 
-async def get_page(url):
-    new_loop=asyncio.new_event_loop()
-    asyncio.set_event_loop(new_loop)
-    session = AsyncHTMLSession()
-    print("Launching browser...")
-    browser = await pyppeteer.launch({
-        'executablePath': 'google-chrome-unstable',
-        'ignoreHTTPSErrors':True,
-        'dumpio':True,
-        'headless':True,
-        'handleSIGINT':False,
-        'handleSIGTERM':False,
-        'handleSIGHUP':False
-    })
-    print("Launched browser...")
-    session._browser = browser
-    resp_page = await session.get(url)
-    print("Got response from page...")
-    await resp_page.html.arender()
-    print("Rendered page...")
-    content = resp_page.content
+# Local disk cache of match files, keyed by name and generation
+match_cache = cache_from_environment()
+
+# Local disk cache of fetched pages, with a TTL per URL
+page_cache = page_cache_from_environment()
 
-    await browser.close()
+# Decoded and rendered analysis page, keyed by the analysis file generations
+analysis_cache = analysis_cache_from_environment()
 
-    return content
+# Event loop shared by every request. Handlers submit the coroutines below to
+# it with event_loop.run, and blocking calls are awaited with jobs.to_thread
+# (asyncio.to_thread, tracked for the job making the call)
+event_loop = event_loop_from_environment()
+atexit.register(event_loop.close)
+
+# Shared headless Chrome used for every page fetch, rendering on event_loop.
+# Shut down at exit (before the loop), and by the worker_exit hook in
+# gunicorn.conf.py when running under gunicorn
+browser_pool = pool_from_environment(event_loop)
+atexit.register(browser_pool.close)
+
+# Crawls and analysis runs started by /findmatches and /run-analysis, running
+# in the background on event_loop. Profiled requests hand their profile to the
+# job they start (see submit_job)
+job_queue = JobQueue(event_loop, profiler=request_profiler)
+
+async def get_page(url):
+    print("Requesting page...")
+    return await browser_pool.fetch(url)
+
+http_session = requests.Session()
+http_session.headers.update({'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) EPL_Parser'})
+
+def fetch_static_page(url, headers=None):
+    resp = http_session.get(url, headers=headers, timeout=30)
+    resp.raise_for_status()
+    return resp
+
+# fbref ships most secondary stat tables inside HTML comments and uncomments
+# them with JavaScript. Strip the comment markers around any comment holding a
+# table so they can be parsed without rendering the page
+def unwrap_commented_tables(page_content):
+    def unwrap(comment):
+        body = comment.group(1)
+        return body if '<table' in body else comment.group(0)
+    return re.sub(r'<!--(.*?)-->', unwrap, page_content, flags=re.DOTALL)
+
+# Helper function to check that every table id pattern matches at least one
+# table in the page
+def page_has_tables(page_content, table_patterns):
+    table_ids = re.findall(r'<table[^>]*\sid="([^"]+)"', page_content)
+    for table_pattern in table_patterns:
+        pattern = re.compile(table_pattern)
+        if not any(pattern.match(table_id) for table_id in table_ids):
+            return False
+    return True
+
+# Wait for a turn to request a URL without holding up the event loop
+async def wait_for_rate_limit(url):
+    with timed_stage('rate_limit'):
+        await asyncio.sleep(host_rate_limiter.reserve(url))
+
+# Count a page cache hit or miss in the process totals, and in cache_counts
+# (the totals of one run, ex. a crawl) when given
+def record_page_cache(counter, cache_counts=None):
+    page_cache.record(counter)
+    if cache_counts is not None:
+        cache_counts[counter] = cache_counts.get(counter, 0) + 1
+
+# Fetch a page without running JavaScript when possible, and render it in the
+# browser only if the static response is missing one of the required tables.
+# Pages are served from page_cache while fresh, and stale pages fetched
+# statically are revalidated with a conditional request
+async def get_page_content(url, required_tables, cache_counts=None):
+    cached = await to_thread(page_cache.lookup, url)
+    if cached is not None and page_cache.is_fresh(cached) and page_has_tables(cached['Body'], required_tables):
+        record_page_cache('hits', cache_counts)
+        return cached['Body']
+
+    if fetch_mode == 'static':
+        try:
+            await wait_for_rate_limit(url)
+            with timed_stage('fetch'):
+                resp = await to_thread(fetch_static_page, url, page_cache.conditional_headers(cached))
+            if resp.status_code == 304 and cached is not None:
+                record_page_cache('hits', cache_counts)
+                return (await to_thread(page_cache.revalidated, url, cached))['Body']
+            page_content = unwrap_commented_tables(resp.text)
+            if page_has_tables(page_content, required_tables):
+                record_page_cache('misses', cache_counts)
+                await to_thread(page_cache.store, url, page_content, resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+                return page_content
+            print('Expected tables missing from static page, rendering in browser...')
+        except requests.RequestException as e:
+            print('Static fetch failed, rendering in browser...', e)
+    await wait_for_rate_limit(url)
+    page_content = unwrap_commented_tables(await get_page(url))
+    record_page_cache('misses', cache_counts)
+    if page_has_tables(page_content, required_tables):
+        await to_thread(page_cache.store, url, page_content)
+    return page_content
+
+# Run a blocking call on the event loop's executor, timed as a pipeline stage
+# (the time spent waiting for a free thread isn't counted)
+async def run_stage(stage, function, *args):
+    def timed():
+        with timed_stage(stage):
+            return function(*args)
+    return await to_thread(timed)
+
+# Helper function to build a soup with the configured parser backend, falling
+# back to Python's built-in parser if that backend isn't installed
+def make_soup(page_content, parse_only=None):
+    try:
+        return BeautifulSoup(page_content, html_parser, parse_only=parse_only)
+    except FeatureNotFound:
+        print('HTML parser ' + html_parser + ' not available, using html.parser')
+        return BeautifulSoup(page_content, 'html.parser', parse_only=parse_only)
 
 def build_empty_json_obj():
     match = {}
@@ -126,6 +272,69 @@ def parse_header(soup, match):
 
     return match
 
+# Stats collected for each outfield player. Each entry maps the data-stat of a
+# cell in one of the player tables ('summary', 'misc' or 'passing') to the key
+# stored in the match JSON and the type its text is converted to. Adding a stat
+# only needs a new entry here
+player_columns = [
+    ('summary', 'minutes', 'Min', int),
+    ('summary', 'goals', 'Gls', int),
+    ('summary', 'assists', 'Asts', int),
+    ('summary', 'pens_made', 'PK', int),
+    ('summary', 'pens_att', 'PKatt', int),
+    ('summary', 'shots_total', 'Sh', int),
+    ('summary', 'shots_on_target', 'SoT', int),
+    ('summary', 'cards_yellow', 'CrdY', int),
+    ('summary', 'cards_red', 'CrdR', int),
+    ('misc', 'cards_yellow_red', '2CrdY', int),
+    ('summary', 'touches', 'Touches', int),
+    ('summary', 'interceptions', 'Int', int),
+    ('summary', 'blocks', 'Blk', int),
+    ('summary', 'passes_completed', 'pComp', int),
+    ('summary', 'passes', 'pAtt', int),
+    ('summary', 'xa', 'xA', float),
+    ('summary', 'xg', 'xG', float),
+    ('misc', 'crosses', 'Crs', int),
+    ('misc', 'tackles_won', 'TklW', int),
+    ('misc', 'fouls', 'Fls', int),
+    ('misc', 'fouled', 'Fld', int),
+    ('passing', 'assisted_shots', 'AstShots', int),
+]
+
+# Stats collected for each keeper, all from the keeper table
+keeper_columns = [
+    ('keeper', 'minutes', 'Min', int),
+    ('keeper', 'shots_on_target_against', 'SoTA', int),
+    ('keeper', 'goals_against_gk', 'GA', int),
+    ('keeper', 'psxg_gk', 'PSxG', float),
+]
+
+# Helper function to read every stat cell of a table row in a single pass,
+# keyed by data-stat. Like find(), the first cell wins if a stat is repeated
+def row_cells(row):
+    cells = {}
+    for cell in row.find_all('td'):
+        stat = cell.get('data-stat')
+        if stat is not None and stat not in cells:
+            cells[stat] = cell.text.strip()
+    return cells
+
+# Compile a column spec into a function that fills a player dictionary from
+# the cells of each source table's row (as returned by row_cells). Stats that
+# are missing from the row are left out of the player, as before
+def build_row_extractor(columns):
+    columns = tuple(columns)
+    def extract(cells_by_source, player):
+        for source, stat, key, convert in columns:
+            text = cells_by_source[source].get(stat)
+            if text is not None:
+                player[key] = convert(text)
+        return player
+    return extract
+
+extract_player_stats = build_row_extractor(player_columns)
+extract_keeper_stats = build_row_extractor(keeper_columns)
+
 def parse_players(soup, match):
     summary_tables = soup.findAll('table', {'id': re.compile(r'stats_(.+)_summary')})
     misc_tables = soup.findAll('table', {'id': re.compile(r'stats_(.+)_misc')})
@@ -142,98 +351,17 @@ def parse_players(soup, match):
                 continue
             player['Name'] = name_el.text.strip()
 
-            pos_el = summary_row.find('td', {'data-stat': 'position'})
-            if pos_el is None:
+            summary_cells = row_cells(summary_row)
+            if 'position' not in summary_cells:
                 continue
-            player['Pos'] = pos_el.text.strip()
-
-            min_el = summary_row.find('td', {'data-stat': 'minutes'})
-            if min_el is not None:
-                player['Min'] = int(min_el.text.strip())
-
-            gls_el = summary_row.find('td', {'data-stat': 'goals'})
-            if gls_el is not None:
-                player['Gls'] = int(gls_el.text.strip())
-
-            asts_el = summary_row.find('td', {'data-stat': 'assists'})
-            if asts_el is not None:
-                player['Asts'] = int(asts_el.text.strip())
-
-            pk_el = summary_row.find('td', {'data-stat': 'pens_made'})
-            if pk_el is not None:
-                player['PK'] = int(pk_el.text.strip())
-
-            pkatt_el = summary_row.find('td', {'data-stat': 'pens_att'})
-            if pkatt_el is not None:
-                player['PKatt'] = int(pkatt_el.text.strip())
-
-            shots_el = summary_row.find('td', {'data-stat': 'shots_total'})
-            if shots_el is not None:
-                player['Sh'] = int(shots_el.text.strip())
-
-            sot_el = summary_row.find('td', {'data-stat': 'shots_on_target'})
-            if sot_el is not None:
-                player['SoT'] = int(sot_el.text.strip())
+            player['Pos'] = summary_cells['position']
 
-            crdY_el = summary_row.find('td', {'data-stat': 'cards_yellow'})
-            if crdY_el is not None:
-                player['CrdY'] = int(crdY_el.text.strip())
-
-            crdR_el = summary_row.find('td', {'data-stat': 'cards_red'})
-            if crdR_el is not None:
-                player['CrdR'] = int(crdR_el.text.strip())
-
-            crdYR_el = misc_row.find('td', {'data-stat': 'cards_yellow_red'})
-            if crdYR_el is not None:
-                player['2CrdY'] = int(crdYR_el.text.strip())
-
-            touches_el = summary_row.find('td', {'data-stat': 'touches'})
-            if touches_el is not None:
-                player['Touches'] = int(touches_el.text.strip())
-
-            int_el = summary_row.find('td', {'data-stat': 'interceptions'})
-            if int_el is not None:
-                player['Int'] = int(int_el.text.strip())
-
-            block_el = summary_row.find('td', {'data-stat': 'blocks'})
-            if block_el is not None:
-                player['Blk'] = int(block_el.text.strip())
-
-            pcomp_el = summary_row.find('td', {'data-stat': 'passes_completed'})
-            if pcomp_el is not None:
-                player['pComp'] = int(pcomp_el.text.strip())
-
-            passatt_el = summary_row.find('td', {'data-stat': 'passes'})
-            if passatt_el is not None:
-                player['pAtt'] = int(passatt_el.text.strip())
-
-            xa_el = summary_row.find('td', {'data-stat': 'xa'})
-            if xa_el is not None:
-                player['xA'] = float(xa_el.text.strip())
-
-            xg_el = summary_row.find('td', {'data-stat': 'xg'})
-            if xg_el is not None:
-                player['xG'] = float(xg_el.text.strip())
-
-            crs_el = misc_row.find('td', {'data-stat': 'crosses'})
-            if crs_el is not None:
-                player['Crs'] = int(crs_el.text.strip())
-
-            tklw_el = misc_row.find('td', {'data-stat': 'tackles_won'})
-            if tklw_el is not None:
-                player['TklW'] = int(tklw_el.text.strip())
-
-            fouls_el = misc_row.find('td', {'data-stat': 'fouls'})
-            if fouls_el is not None:
-                player['Fls'] = int(fouls_el.text.strip())
-
-            fouled_el = misc_row.find('td', {'data-stat': 'fouled'})
-            if fouled_el is not None:
-                player['Fld'] = int(fouled_el.text.strip())
-
-            astshots_el = pass_row.find('td', {'data-stat': 'assisted_shots'})
-            if astshots_el is not None:
-                player['AstShots'] = int(astshots_el.text.strip())
+            cells_by_source = {
+                'summary': summary_cells,
+                'misc': row_cells(misc_row),
+                'passing': row_cells(pass_row)
+            }
+            extract_player_stats(cells_by_source, player)
 
             if tbl_num == 1:
                 match['HomePlayers'].append(player)
@@ -254,21 +382,7 @@ def parse_keepers(soup, match):
                 continue
             player['Name'] = name_el.text.strip()
 
-            minutes_el = row.find('td', {'data-stat': 'minutes'})
-            if minutes_el is not None:
-                player['Min'] = int(minutes_el.text.strip())
-
-            sota_el = row.find('td', {'data-stat': 'shots_on_target_against'})
-            if sota_el is not None:
-                player['SoTA'] = int(sota_el.text.strip())
-
-            ga_el = row.find('td', {'data-stat': 'goals_against_gk'})
-            if ga_el is not None:
-                player['GA'] = int(ga_el.text.strip())
-
-            psxg_el = row.find('td', {'data-stat': 'psxg_gk'})
-            if psxg_el is not None:
-                player['PSxG'] = float(psxg_el.text.strip())
+            extract_keeper_stats({'keeper': row_cells(row)}, player)
 
             if tbl_num == 1:
                 match['HomeKeepers'].append(player)
@@ -279,9 +393,12 @@ def parse_keepers(soup, match):
 
 def parse_page_to_json(soup):
     match = build_empty_json_obj()
-    match = parse_header(soup, match)
-    match = parse_players(soup, match)
-    match = parse_keepers(soup, match)
+    with timed_stage('parse_header'):
+        match = parse_header(soup, match)
+    with timed_stage('parse_players'):
+        match = parse_players(soup, match)
+    with timed_stage('parse_keepers'):
+        match = parse_keepers(soup, match)
     return match
 
 # Helper function to construct a JSON filename for a match. Inputs are strings
@@ -302,6 +419,16 @@ def get_match_filename(date, hometeam, awayteam):
         print('Team names must be strings')
         return None
 
+# Raw match pages are archived next to their JSON, with the same name but a
+# .html.gz extension (ex. 05Jan2021_Arsenal_vs_Chelsea.html.gz)
+archive_extension = '.html.gz'
+
+def get_archive_filename(match_file_name):
+    return match_file_name[:-len('.json')] + archive_extension
+
+def get_match_filename_from_archive(archive_file_name):
+    return archive_file_name[:-len(archive_extension)] + '.json'
+
 # Helper function to validate whether a match has proper information. Returns
 # True if the match looks valid, and False if something doesn't look right
 def match_is_valid(match_json):
@@ -373,36 +500,71 @@ def extract_one_match_team(match_json, team):
 
     return new_match_json
 
-def store_match_json(match_json):
-    if not match_is_valid(match_json):
+# Store a match in the bucket and add it to the match manifest. Returns the
+# name of the stored file, or None if the match wasn't valid.
+# known_match_files is an optional set of the match files already in the
+# bucket (ex. the names in the manifest), which is
+# checked first and updated once the match has been written.
+# Rewriting the season store costs as much as the whole store, so a caller
+# storing many matches passes a list as stored_matches, and the stored match
+# is added to it to go into the season store in one update_stored_matches
+# call; otherwise the season store is updated straight away
+def store_match_json(match_json, known_match_files=None, stored_matches=None):
+    with timed_stage('validate'):
+        valid = match_is_valid(match_json)
+    if not valid:
         print('Skipped storing json file because match is not valid')
         return
 
     file_name = get_match_filename(match_json['Date'], match_json['HomeStats']['Team'], match_json['AwayStats']['Team'])
 
-    storage_client = storage.Client()
-    try:
-        bucket = storage_client.get_bucket(bucket_name)
-    except exceptions.NotFound:
-        raise NameError("Bucket does not exist")
+    if file_name is None:
+        raise NameError("Error generating filename from match")
+    if known_match_files is not None and file_name in known_match_files:
+        raise NameError("File for match already exists")
 
-    try:
-        if file_name is None:
-            raise NameError("Error generating filename from match")
-        if storage.Blob(bucket=bucket, name=file_name).exists(storage_client):
-            raise NameError("File for match already exists")
-    except:
-        raise NameError("Error checking if file exists")
+    bucket = storage_backend
 
+    # put_if_absent only creates the file if it doesn't exist yet, so no
+    # separate existence check is needed before uploading
     try:
-        blob = bucket.blob(file_name)
-        blob.upload_from_string(
-            data=json.dumps(match_json),
-            content_type='application/json'
-        )
+        stored = bucket.put_if_absent(file_name, json.dumps(match_json), 'application/json')
+    except PreconditionFailed:
+        # Make sure the existing file is listed in the manifest, so it isn't
+        # collected again
+        existing = bucket.stat(file_name)
+        if existing is not None:
+            update_manifest(bucket, [build_manifest_entry(file_name, match_json, existing.generation, existing.size)])
+        raise NameError("File for match already exists")
     except:
         raise ValueError("Error writing JSON file to bucket")
 
+    update_manifest(bucket, [build_manifest_entry(file_name, match_json, stored.generation, stored.size)])
+
+    if stored_matches is not None:
+        stored_matches.append((file_name, match_json))
+    else:
+        update_stored_matches([(file_name, match_json)])
+
+    if known_match_files is not None:
+        known_match_files.add(file_name)
+
+    return file_name
+
+# Add stored matches (a list of (file name, match JSON) pairs) to the season
+# store. The match files are already stored, so a failed update is only
+# logged; python season_store.py --rebuild catches it up
+def update_stored_matches(stored_matches):
+    try:
+        update_season_store(storage_backend, stored_matches)
+    except Exception as e:
+        print('Error updating season store', e)
+
+# Store the raw HTML of a match page, gzipped, next to the match JSON so the
+# match can be re-parsed later without fetching it again (see reparse.py)
+def archive_match_page(match_file_name, page_content):
+    storage_backend.put(get_archive_filename(match_file_name), gzip.compress(page_content.encode()), 'application/gzip')
+
 # Helper method to print statistics from the find_new_matches function
 def print_run_statistics(run_stats):
     def object_or_empty_string(obj, key):
@@ -417,89 +579,218 @@ def print_run_statistics(run_stats):
     print('   New Matches: ', object_or_empty_string(run_stats, 'new'))
     print('   Old Matches: ', object_or_empty_string(run_stats, 'old'))
     print('   Skipped Matches: ', object_or_empty_string(run_stats, 'skipped'))
+    print('   Page Cache Hits: ', object_or_empty_string(run_stats, 'cache_hits'))
+    print('   Page Cache Misses: ', object_or_empty_string(run_stats, 'cache_misses'))
     print('   --------------------------')
     print('   Bucket should have: ', object_or_empty_string(run_stats, 'bucket'))
 
-def extract_team_names_from_links(parent_el):
-    squad_link_pattern =  '^/en\/squads\/(.+)\/(.+)-Stats'
+squad_link_pattern = r'^/en/squads/(.+)/(.+)-Stats'
+
+# Helper function to convert a squad link (ex. /en/squads/18bb7c10/Arsenal-Stats)
+# into the team name used in match files
+def team_name_from_squad_link(href):
+    squad_match = re.search(squad_link_pattern, ASSIGN_OR_RAISE(href))
+    team = ASSIGN_OR_RAISE(squad_match.group(2) if squad_match is not None else None)
+    return team.replace('-', ' ').replace(' and ', ' & ')
 
+def extract_team_names_from_links(parent_el):
     home_team_td = ASSIGN_OR_RAISE(parent_el.find('td', {'data-stat': 'squad_a'}))
     home_team_a = ASSIGN_OR_RAISE(home_team_td.find('a', href=True))
-    ht = re.search(squad_link_pattern, home_team_a['href'])
-    home_team = ASSIGN_OR_RAISE(ht.group(2))
-    home_name = home_team.replace('-', ' ').replace(' and ', ' & ')
+    home_name = team_name_from_squad_link(home_team_a['href'])
 
     away_team_td = ASSIGN_OR_RAISE(parent_el.find('td', {'data-stat': 'squad_b'}))
     away_team_a = ASSIGN_OR_RAISE(away_team_td.find('a', href=True))
-    at = re.search(squad_link_pattern, away_team_a['href'])
-    away_team = ASSIGN_OR_RAISE(at.group(2))
-    away_name = away_team.replace('-', ' ').replace(' and ', ' & ')
+    away_name = team_name_from_squad_link(away_team_a['href'])
 
     return [home_name, away_name]
 
-def get_matches_for_date(date, storage_client):
-    # Get past match data
-    blobs = storage_client.list_blobs(bucket_name)
+# Scan of the fixtures page with regular expressions. Only the body rows of
+# the fixtures table (the one with a sched_ id) are looked at, and only the
+# four cells parse_schedule reads, keeping the text, csk and first link of
+# each, so the rest of the page is never tokenized and no tree is built
+schedule_table_pattern = re.compile(r'<table\b[^>]*\bid="sched_')
+schedule_row_pattern = re.compile(r'<tr\b([^>]*)>(.*?)</tr>', re.S)
+schedule_cell_pattern = re.compile(r'<td\b([^>]*\bdata-stat="(date|squad_a|squad_b|match_report)"[^>]*)>(.*?)</td>', re.S)
+class_attribute_pattern = re.compile(r'(?:^|\s)class=')
+csk_attribute_pattern = re.compile(r'\bcsk="([^"]*)"')
+first_link_pattern = re.compile(r'<a\b[^>]*?\bhref="([^"]*)"')
+tag_pattern = re.compile(r'<[^>]*>')
+
+# Returns the body rows of the fixtures table, each a dictionary from
+# data-stat to {'text', 'csk', 'href'}. Rows with a class (spacers and
+# repeated headers) are skipped
+def scan_schedule_rows(page_content):
+    table_match = schedule_table_pattern.search(page_content)
+    if table_match is None:
+        raise ValueError('Error parsing page')
+    table_end = page_content.find('</table>', table_match.end())
+    if table_end == -1:
+        table_end = len(page_content)
+    body_start = page_content.find('<tbody', table_match.end(), table_end)
+    if body_start == -1:
+        return []
+
+    rows = []
+    for row_match in schedule_row_pattern.finditer(page_content, body_start, table_end):
+        if class_attribute_pattern.search(row_match.group(1)) is not None:
+            continue
+        row = {}
+        for cell_match in schedule_cell_pattern.finditer(row_match.group(2)):
+            attributes, stat, content = cell_match.groups()
+            if stat in row:
+                continue
+            csk = csk_attribute_pattern.search(attributes)
+            link = first_link_pattern.search(content)
+            row[stat] = {
+                'text': html.unescape(tag_pattern.sub('', content)),
+                'csk': html.unescape(csk.group(1)) if csk is not None else None,
+                'href': html.unescape(link.group(1)) if link is not None else None
+            }
+        rows.append(row)
+    return rows
+
+# Parse the fixtures page into a list of fixture records, one per match row:
+#   {'Date': '2021-01-05', 'Csk': '20210105', 'HomeTeam': 'Arsenal',
+#    'AwayTeam': 'Chelsea', 'ReportUrl': 'http://fbref.com/en/matches/...'}
+# ReportUrl is None for matches without a match report yet
+def parse_schedule(page_content):
+    fixtures = []
+    for row in scan_schedule_rows(page_content):
+        date_cell = ASSIGN_OR_RAISE(row.get('date'))
+        home_cell = ASSIGN_OR_RAISE(row.get('squad_a'))
+        away_cell = ASSIGN_OR_RAISE(row.get('squad_b'))
+        report_cell = ASSIGN_OR_RAISE(row.get('match_report'))
+
+        fixture_date = date_cell['text']
+        fixture = {}
+        fixture['Date'] = fixture_date
+        fixture['Csk'] = date_cell['csk'] if date_cell['csk'] is not None else fixture_date.replace('-', '')
+        fixture['HomeTeam'] = team_name_from_squad_link(home_cell['href'])
+        fixture['AwayTeam'] = team_name_from_squad_link(away_cell['href'])
+        if report_cell['href'] is not None:
+            fixture['ReportUrl'] = 'http://fbref.com' + report_cell['href']
+        else:
+            fixture['ReportUrl'] = None
+        fixtures.append(fixture)
+
+    return fixtures
+
+# Build the matchups for several dates (as YYYYMMDD strings) in one pass. The
+# fixtures page is fetched once, the manifest is read once, and each past
+# match file is downloaded at most once, however many dates and fixtures need
+# it. Returns a dictionary from each date to its list of matchups
+async def get_matches_for_dates(dates, bucket):
+    # Get past match data, while the fixtures page is fetched
+    manifest_job = asyncio.ensure_future(run_stage('list_blobs', load_manifest, bucket))
     url = "http://fbref.com/en/comps/9/schedule/Premier-League-Scores-and-Fixtures"
 
     # First collect the site from the url
     try:
-        page_content = asyncio.run(get_page(url))
-    except:
-        return "Error retrieving fixture content from URL"
-
-    # Then parse the HTML on the site
-    soup = BeautifulSoup(page_content, 'html.parser')
-    match_els = soup.find_all('td', {'csk': date})
-    matches = []
-    for match_el in match_els:
-        parent_el = match_el.parent
-        team_names = extract_team_names_from_links(parent_el)
+        page_content = await get_page_content(url, schedule_tables)
+    except Exception:
+        manifest_job.cancel()
+        return {date: "Error retrieving fixture content from URL" for date in dates}
+
+    # Then parse the fixtures on the site
+    fixtures = await run_stage('parse_schedule', parse_schedule, page_content)
+    manifest = await manifest_job
+    matches_by_date = {date: [] for date in dates}
+    for fixture in fixtures:
+        if fixture['Csk'] not in matches_by_date:
+            continue
 
         match = {}
         match['HomeTeam'] = {}
-        match['HomeTeam']['Name'] = team_names[0]
+        match['HomeTeam']['Name'] = fixture['HomeTeam']
         match['HomeTeam']['PastMatches'] = []
         match['AwayTeam'] = {}
-        match['AwayTeam']['Name'] = team_names[1]
+        match['AwayTeam']['Name'] = fixture['AwayTeam']
         match['AwayTeam']['PastMatches'] = []
         match['History'] = []
 
         # TODO follow link to get match history b/t teams w/ a cutoff date
 
-        matches.append(match)
-
-    # Parse past matches for the teams
-    for blob in blobs:
-        for match in matches:
-            home_pattern = re.compile(r'.*(%s).*'%match['HomeTeam']['Name'].replace(' ', '_'))
-            away_pattern = re.compile(r'.*(%s).*'%match['AwayTeam']['Name'].replace(' ', '_'))
-            if home_pattern.match(blob.name) is not None:
-                match_json_str = blob.download_as_string()
-                match['HomeTeam']['PastMatches'].append(extract_one_match_team(json.loads(match_json_str), match['HomeTeam']['Name']))
-            if away_pattern.match(blob.name) is not None:
-                match_json_str = blob.download_as_string()
-                match['AwayTeam']['PastMatches'].append(extract_one_match_team(json.loads(match_json_str), match['AwayTeam']['Name']))
-
-    # Sort PastMatches by date in reverse order, and keep only 10 most recent
-    for match in matches:
-        match['HomeTeam']['PastMatches'] = sorted(
-            match['HomeTeam']['PastMatches'], key = lambda item: datetime.datetime.strptime(
-                item['Date'], '%A %B %d, %Y'), reverse=True)[0:10]
-        match['AwayTeam']['PastMatches'] = sorted(
-            match['AwayTeam']['PastMatches'], key = lambda item: datetime.datetime.strptime(
-                item['Date'], '%A %B %d, %Y'), reverse=True)[0:10]
+        matches_by_date[fixture['Csk']].append(match)
+
+    all_matches = [match for date in dates for match in matches_by_date[date]]
+
+    # Parse the most recent past matches for the teams. Each match file is
+    # downloaded at most once, even when both teams (or several fixtures) need it
+    team_index = build_team_index(manifest)
+    needed_files = []
+    for match in all_matches:
+        for side in ['HomeTeam', 'AwayTeam']:
+            for entry in team_index.get(match[side]['Name'], [])[0:past_matches_per_team]:
+                needed_files.append((entry['Name'], entry['Generation']))
+
+    match_files, latencies = await to_thread(
+        download_blobs, bucket, needed_files, cache=match_cache,
+        on_stale=lambda stale: refresh_stale_entries(bucket, stale))
+
+    # Matches deleted since the manifest was written are left out
+    for match in all_matches:
+        for side in ['HomeTeam', 'AwayTeam']:
+            team_name = match[side]['Name']
+            for entry in team_index.get(team_name, [])[0:past_matches_per_team]:
+                if match_files[entry['Name']] is not None:
+                    match[side]['PastMatches'].append(extract_one_match_team(match_files[entry['Name']], team_name))
 
     # TODO: Get odds?
 
-    return matches
+    return matches_by_date
+
+async def get_matches_for_date(date, bucket):
+    return (await get_matches_for_dates([date], bucket))[date]
+
+# Time every request by endpoint, for /metrics, and profile the requests
+# request_profiler picks
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.profile = request_profiler.start(request.path, request.args.get('profile'))
+
+@app.after_request
+def record_request_latency(response):
+    start = g.get('request_start')
+    if start is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        request_seconds.observe(time.perf_counter() - start, endpoint=endpoint, method=request.method, status=response.status_code)
+    profile = g.pop('profile', None)
+    if profile is not None:
+        name = finish_profile(profile)
+        if name is not None:
+            response.headers['X-Profile'] = name
+    return response
+
+# Make sure a profile is stopped even if the response was never finished
+@app.teardown_request
+def stop_profile(exception):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        finish_profile(profile)
+
+# A profile that can't be written shouldn't fail the request it profiled
+def finish_profile(profile):
+    try:
+        return request_profiler.finish(profile)
+    except Exception as e:
+        print('Error writing profile', e)
+        return None
 
 @app.route("/")
 def hello_world():
     return render_template('index.html')
 
-# @app.route("/collectmatch/<path:url>")
-def collect_match(url):
+# Parse a match report page into match JSON
+def parse_match_page(page_content):
+    with timed_stage('make_soup'):
+        soup = make_soup(page_content)
+    return parse_page_to_json(soup)
+
+# Fetch, parse and store a single match report. Returns the match JSON, or a
+# string describing the error if the match couldn't be fetched, parsed or
+# stored
+async def collect_match_json(url, known_match_files=None, cache_counts=None, stored_matches=None):
     print("Got request to collect", url)
     # Check URL against fbref pattern
     pattern = re.compile(r'^http:\/\/fbref\.com\/en\/matches\/(.+)Premier\-League')
@@ -508,193 +799,306 @@ def collect_match(url):
 
     # First collect the site from the url
     try:
-        page_content = asyncio.run(get_page(url))
-    except:
+        page_content = await get_page_content(url, match_report_tables, cache_counts)
+    except Exception:
         return "Error retrieving match content from URL"
 
-    # Then parse the HTML on the site
-    soup = BeautifulSoup(page_content, 'html.parser')
-    match_json = parse_page_to_json(soup)
+    # Then parse the HTML on the site. A page that can't be parsed (ex. a
+    # blocked or rate limited response) fails this match only
+    try:
+        match_json = await to_thread(parse_match_page, page_content)
+    except Exception as e:
+        print('Error parsing match page', url, e)
+        return "Error parsing match content from URL"
 
     # Then store the file on Google Cloud Storage
     try:
-        store_match_json(match_json)
-    except:
+        match_file_name = await run_stage('store', store_match_json, match_json, known_match_files, stored_matches)
+    except Exception:
         return "Error storing the json file"
 
+    # Keep the page the match was parsed from
+    if match_file_name is not None:
+        try:
+            await run_stage('archive', archive_match_page, match_file_name, page_content)
+        except Exception as e:
+            print('Error archiving match page', e)
+
+    return match_json
+
+# @app.route("/collectmatch/<path:url>")
+def collect_match(url):
+    match_json = event_loop.run(collect_match_json(url))
+    if isinstance(match_json, str):
+        return match_json
     return jsonify(match_json)
 
+# Start a background job for a request and respond with it. A profiled
+# request that starts the job hands its profile over, so the profile covers
+# the job's work instead of only the enqueue; the job writes it when it ends
+def submit_job(kind, run, key):
+    job, created = job_queue.submit(kind, run, key=key, profile=g.get('profile'))
+    if created and job.profile is not None:
+        g.pop('profile')
+    return job_response(job, created)
+
+# Response for an endpoint that starts a background job: where to poll it,
+# 202 if the job was started by this request or 200 if it was already running
+def job_response(job, created):
+    description = job.describe()
+    description['Url'] = '/jobs/' + job.id
+    return jsonify(description), 202 if created else 200
+
 @app.route("/forcefindmatches", defaults={'force': True})
 @app.route("/findmatches", defaults={'force': False})
 # Force is a boolean that specifies whether to force saving data even if there are
 # more than 100 fixtures to collect. Not forcing, protects the app from automatically
 # storing too many files at once (which would likely be a bug, because there are not
-# hundreds of new matches per day)
+# hundreds of new matches per day).
+# The crawl runs as a background job, and only one runs at a time: while one
+# is running, both routes return it instead of starting another
 def find_new_matches(force):
+    return submit_job('findmatches', lambda job: run_find_matches_job(force, job.progress), key='findmatches')
+
+async def run_find_matches_job(force, progress):
+    run_stats = await collect_new_matches(force, progress)
+    if isinstance(run_stats, str):
+        raise RuntimeError(run_stats)
+    print_run_statistics(run_stats)
+    return run_stats
+
+# Collect every match on the fixtures page that isn't stored yet. Returns the
+# run statistics, or a string describing the error if the fixtures couldn't
+# be fetched. The statistics are kept in run_stats when given, so they can be
+# read while the matches are collected
+async def collect_new_matches(force, run_stats=None):
     url = "http://fbref.com/en/comps/9/schedule/Premier-League-Scores-and-Fixtures"
+    cache_counts = {'hits': 0, 'misses': 0}
+
+    # Load the matches already collected from the manifest once, instead of
+    # checking storage for every fixture, while the fixtures page is fetched.
+    # Timed as list_blobs, the stage the manifest replaced
+    manifest_job = asyncio.ensure_future(run_stage('list_blobs', load_manifest, storage_backend))
 
     # First collect the site from the url
     try:
-        page_content = asyncio.run(get_page(url))
-    except:
+        page_content = await get_page_content(url, schedule_tables, cache_counts)
+    except Exception:
+        manifest_job.cancel()
         return "Error retrieving fixture content from URL"
 
-    # Then parse the HTML on the site
-    soup = BeautifulSoup(page_content, 'html.parser')
-
-    caption_el = ASSIGN_OR_RAISE(soup.find('caption'))
-    match_table = ASSIGN_OR_RAISE(caption_el.parent)
-    match_tbody = ASSIGN_OR_RAISE(match_table.find('tbody'))
-
-    # Setup cloud storage checking
-    storage_client = storage.Client()
-    try:
-        bucket = storage_client.get_bucket(bucket_name)
-    except exceptions.NotFound:
-        raise NameError("Bucket does not exist")
+    # Then parse the fixtures on the site
+    fixtures = await run_stage('parse_schedule', parse_schedule, page_content)
+    known_match_files = set((await manifest_job)['Matches'])
 
     # Collect statistics
-    num_total_matches = 0
-    num_already_collected_matches = 0
-    num_new_matches = 0
-    num_skipped_matches = 0
-
-    # Iterate through each match
-    match_rows = match_tbody.find_all('tr', {'class': None})
-    for row in match_rows:
-        num_total_matches += 1
-        date_td = ASSIGN_OR_RAISE(row.find('td', {'data-stat': 'date'}))
-
-        try:
-            match_date = datetime.datetime.strptime(date_td.text, '%Y-%m-%d').strftime('%A %B %d, %Y')
-        except:
-            raise ValueError('Error parsing page')
-
-        team_names = extract_team_names_from_links(row)
-        match_file_name = get_match_filename(match_date, team_names[0], team_names[1])
-        if match_file_name is None:
-            continue    # Error parsing filename from match info provided
-
-        # Check for file in bucket
-        try:
-            print('Checking bucket for file: ' + match_file_name)
-            if storage.Blob(bucket=bucket, name=match_file_name).exists(storage_client):
-                print("File for match already exists")
-                num_already_collected_matches += 1
+    if run_stats is None:
+        run_stats = {}
+    run_stats.update({'total': 0, 'new': 0, 'old': 0, 'skipped': 0, 'collected': 0, 'failed': 0})
+
+    # Matches stored by this crawl, added to the season store in one update
+    # at the end
+    stored_matches = []
+
+    # At most collect_workers matches are collected at once
+    collect_slots = asyncio.Semaphore(collect_workers)
+    collect_jobs = []
+
+    # A match that fails in an unexpected way counts as failed like any other,
+    # instead of stopping the crawl
+    async def collect(match_url):
+        async with collect_slots:
+            try:
+                match_json = await collect_match_json(match_url, known_match_files, cache_counts, stored_matches)
+            except Exception as e:
+                print('Error collecting match', match_url, e)
+                match_json = "Error collecting match"
+        run_stats['failed' if isinstance(match_json, str) else 'collected'] += 1
+        return match_json
+
+    # If the crawl stops early (a fixture that can't be parsed, or the job
+    # being cancelled), the collections already started are cancelled, and
+    # waited for along with their blocking calls, so nothing is still
+    # fetching or storing once it ends. The matches stored so far go into
+    # the season store either way
+    try:
+        # Iterate through each match
+        for fixture in fixtures:
+            run_stats['total'] += 1
+
+            try:
+                match_date = datetime.datetime.strptime(fixture['Date'], '%Y-%m-%d').strftime('%A %B %d, %Y')
+            except:
+                raise ValueError('Error parsing page')
+
+            match_file_name = get_match_filename(match_date, fixture['HomeTeam'], fixture['AwayTeam'])
+            if match_file_name is None:
+                continue    # Error parsing filename from match info provided
+
+            # Check for file in bucket
+            if match_file_name in known_match_files:
+                run_stats['old'] += 1
                 continue
-        except:
-            raise NameError("Error checking if file exists")
-
-        # Get link for match report
-        match_report_td = ASSIGN_OR_RAISE(row.find('td', {'data-stat': 'match_report'}))
-
-        link = match_report_td.find('a')
-        if link is not None:
-            match_url = 'http://fbref.com' + link['href']
-
-            pattern = re.compile(r'^http:\/\/fbref\.com\/en\/matches\/(.+)Premier\-League')
-            if pattern.match(match_url) is None:
-                print('URL doesnt match pattern... quitting')
-                print(match_url)
-                num_skipped_matches += 1
-                break
-
-            if num_new_matches > 99 and not force:
-                print('Hit an upper limit for number of games per day - this is likely a bug')
-                break
-            collect_match(match_url)
-            time.sleep(15)  # Sleep 15 seconds as to not overload host server
-            num_new_matches += 1
-        else:
-            num_skipped_matches += 1
 
-    run_stats = {}
-    run_stats['total'] = num_total_matches
-    run_stats['new'] = num_new_matches
-    run_stats['old'] = num_already_collected_matches
-    run_stats['skipped'] = num_skipped_matches
-    run_stats['bucket'] = num_total_matches - num_skipped_matches
-
-    return render_template('findmatches.html', stats=run_stats)
+            # Get link for match report
+            match_url = fixture['ReportUrl']
+            if match_url is not None:
+                pattern = re.compile(r'^http:\/\/fbref\.com\/en\/matches\/(.+)Premier\-League')
+                if pattern.match(match_url) is None:
+                    print('URL doesnt match pattern... quitting')
+                    print(match_url)
+                    run_stats['skipped'] += 1
+                    break
+
+                if run_stats['new'] > 99 and not force:
+                    print('Hit an upper limit for number of games per day - this is likely a bug')
+                    break
+                # Requests to fbref are paced by host_rate_limiter, so matches
+                # can be parsed and stored while other fetches wait their turn
+                collect_jobs.append(asyncio.ensure_future(collect(match_url)))
+                run_stats['new'] += 1
+            else:
+                run_stats['skipped'] += 1
+
+        # Wait for every match to be collected before reporting
+        await asyncio.gather(*collect_jobs)
+    finally:
+        for collect_job in collect_jobs:
+            collect_job.cancel()
+        await stop_collect_jobs(collect_jobs)
+        if stored_matches:
+            await run_stage('season_store', update_stored_matches, stored_matches)
+
+    run_stats['bucket'] = run_stats['total'] - run_stats['skipped']
+    run_stats['cache_hits'] = cache_counts['hits']
+    run_stats['cache_misses'] = cache_counts['misses']
+
+    return run_stats
+
+# Wait for cancelled collections to unwind and for the blocking calls they
+# started (ex. a store in progress) to return, even if the crawl is cancelled
+# again meanwhile
+async def stop_collect_jobs(collect_jobs):
+    while not all(collect_job.done() for collect_job in collect_jobs):
+        try:
+            await asyncio.wait(collect_jobs)
+        except asyncio.CancelledError:
+            continue
+    for collect_job in collect_jobs:
+        if not collect_job.cancelled():
+            collect_job.exception()
+    await wait_for_calls()
 
 @app.route("/storage", defaults={'filename': 'file1.json'})
 @app.route("/storage/<string:filename>")
 def see_storage(filename):
-    storage_client = storage.Client()
-    blobs = storage_client.list_blobs(bucket_name)
-
-    bucket_blobs = []
-    for blob in blobs:
-        bucket_blobs.append(blob)
+    manifest = load_manifest(storage_backend)
 
-    return render_template('storage.html', bucket_blobs=bucket_blobs)
+    return render_template('storage.html', matches=sorted_entries(manifest))
 
+# Runs the analysis as a background job, one at a time (see find_new_matches)
 @app.route("/run-analysis")
 def run_analysis():
-    # Get matches for today and tomorrow
-    todays_date = datetime.datetime.today().strftime('%Y%m%d')
-    tomorrows_date = (datetime.datetime.today() + datetime.timedelta(days=1)).strftime('%Y%m%d')
-    storage_client = storage.Client()
-    todays_matches = get_matches_for_date(todays_date, storage_client)
-    tomorrows_matches = get_matches_for_date(tomorrows_date, storage_client)
-
-    # Store analysis JSON in bucket
-    try:
-        bucket = storage_client.get_bucket(bucket_name)
-    except exceptions.NotFound:
-        raise NameError("Bucket does not exist")
-
-    # Delete old analysis files (if they exists)
-    for analysis_file_name in analysis_file_names:
-        blob = bucket.get_blob(analysis_file_name)
-        if blob is not None:
-            blob.delete()
-
-    # Create the new analysis files
+    days = min(max(request.args.get('days', analysis_days, type=int), 2), max_analysis_days)
+    return submit_job('run-analysis', lambda job: run_analysis_job(days, job.progress), key='run-analysis')
+
+# Build the analysis for the next days and replace the analysis files
+async def run_analysis_job(days, progress):
+    # Get matches for every day in the horizon (at least today and tomorrow),
+    # all from one fetch of the fixtures page
+    dates = [(datetime.datetime.today() + datetime.timedelta(days=day)).strftime('%Y%m%d') for day in range(days)]
+    progress['days'] = days
+    matches_by_date = await get_matches_for_dates(dates, storage_backend)
+    matches_by_date = await to_thread(score_analysis, matches_by_date)
+    progress['matches'] = sum(len(matches) for matches in matches_by_date.values() if not isinstance(matches, str))
+    todays_matches = matches_by_date[dates[0]]
+    tomorrows_matches = matches_by_date[dates[1]]
+
+    # Replace the analysis files. Each write swaps the old file for the new
+    # one in place, so they aren't deleted first (which left a window where
+    # /view-analysis found no file). Uploads can't be batched, so the three
+    # are written concurrently
     try:
-        blob = bucket.blob(analysis_file_names[0])
-        blob.upload_from_string(
-            data=json.dumps(todays_matches),
-            content_type='application/json'
-        )
-        blob = bucket.blob(analysis_file_names[1])
-        blob.upload_from_string(
-            data=json.dumps(tomorrows_matches),
-            content_type='application/json'
-        )
-    except:
+        await to_thread(storage_backend.put_many, [
+            (analysis_file_names[0], json.dumps(todays_matches), 'application/json'),
+            (analysis_file_names[1], json.dumps(tomorrows_matches), 'application/json'),
+            (upcoming_analysis_file_name, json.dumps(matches_by_date), 'application/json')
+        ])
+    except Exception:
         raise ValueError("Error writing JSON file to bucket")
 
+    analysis_cache.invalidate()
+
     return "Success running analysis"
 
 @app.route("/view-analysis")
 def view_analysis():
-    storage_client = storage.Client()
-    try:
-        bucket = storage_client.get_bucket(bucket_name)
-    except exceptions.NotFound:
-        raise NameError("Bucket does not exist")
+    # Serve the rendered page from memory while it is fresh
+    entry = analysis_cache.fresh_entry()
+    if entry is not None:
+        return entry['HTML']
 
-    # Check for file in bucket
+    # Check which generations of todays and tomorrows analysis are current,
+    # and only download and render them if they changed
     try:
-        if not storage.Blob(bucket=bucket, name=analysis_file_names[0]).exists(storage_client):
-            return "Todays anaylsis file does not exist"
-        if not storage.Blob(bucket=bucket, name=analysis_file_names[1]).exists(storage_client):
-            return "Tomorrows anaylsis file does not exist"
+        analysis_objects = storage_backend.stat_many(analysis_file_names)
     except:
         raise NameError("Error checking if file exists")
 
-    # Get todays analysis object
-    blob = bucket.get_blob(analysis_file_names[0])
-    json_string = blob.download_as_string()
-    todays_matches = json.loads(json_string)
-
-    # Get todays analysis object
-    blob = bucket.get_blob(analysis_file_names[1])
-    json_string = blob.download_as_string()
-    tomorrows_matches = json.loads(json_string)
+    if analysis_objects[analysis_file_names[0]] is None:
+        return "Todays anaylsis file does not exist"
+    if analysis_objects[analysis_file_names[1]] is None:
+        return "Tomorrows anaylsis file does not exist"
+
+    generations = tuple(analysis_objects[analysis_file_name].generation for analysis_file_name in analysis_file_names)
+    entry = analysis_cache.entry_for(generations)
+    if entry is not None:
+        return entry['HTML']
+
+    analysis_files, latencies = download_blobs(
+        storage_backend, [(stored.name, stored.generation) for stored in analysis_objects.values()], cache=match_cache)
+    todays_matches = analysis_files[analysis_file_names[0]]
+    tomorrows_matches = analysis_files[analysis_file_names[1]]
+
+    # Analysis files written before points were stored need scoring here
+    score_analysis({'today': todays_matches, 'tomorrow': tomorrows_matches}, rescore=False)
+
+    html = render_template('view_analysis.html', todays_matches=todays_matches, tomorrows_matches=tomorrows_matches)
+    analysis_cache.store(generations, {'today': todays_matches, 'tomorrow': tomorrows_matches}, html)
+    return html
+
+# Stage and endpoint latencies in the Prometheus text format
+@app.route("/metrics")
+def metrics():
+    return registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+# Hit and miss counters for the caches in this process
+@app.route("/cache-stats")
+def cache_stats():
+    return jsonify({
+        'analysis': analysis_cache.stats(),
+        'match': match_cache.stats(),
+        'page': page_cache.stats()
+    })
 
-    return render_template('view_analysis.html', todays_matches=todays_matches, tomorrows_matches=tomorrows_matches)
+# Status, progress and result of a background job. Browsers are shown the
+# statistics of a crawl as a table
+@app.route("/jobs/<string:job_id>")
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return "Job not found", 404
+    if job.kind == 'findmatches' and request.accept_mimetypes.best == 'text/html':
+        return render_template('findmatches.html', status=job.status, stats=job.progress)
+    return jsonify(job.describe())
+
+@app.route("/jobs/<string:job_id>/cancel", methods=['POST'])
+def cancel_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return "Job not found", 404
+    job_queue.cancel(job_id)
+    return jsonify(job.describe())
 
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
@@ -0,0 +1,124 @@
+# match_cache.py
+
+# Read-through cache of bucket objects on local disk. A stored object never
+# changes without getting a new generation, so an entry keyed by name and
+# generation never goes stale and can be shared by every gunicorn worker and
+# thread on the instance. Files are written to a temporary name and renamed
+# into place, so readers only ever see complete entries
+import hashlib
+import os
+import tempfile
+import threading
+
+class MatchCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._approx_bytes = None
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return bool(self.directory) and self.max_bytes > 0
+
+    def _path(self, name, generation):
+        key = hashlib.sha256(('%s#%s' % (name, generation)).encode()).hexdigest()
+        return os.path.join(self.directory, key + '.cache')
+
+    # Return the cached bytes for an object generation, or None on a miss
+    def get(self, name, generation):
+        if not self.enabled or generation is None:
+            return None
+        path = self._path(name, generation)
+        try:
+            with open(path, 'rb') as cache_file:
+                data = cache_file.read()
+        except OSError:
+            return None
+        # Touch the entry so eviction drops the least recently used first
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, name, generation, data):
+        if not self.enabled or generation is None:
+            return
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, self._path(name, generation))
+        except OSError:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            if self._approx_bytes is not None:
+                self._approx_bytes += len(data)
+            if self._approx_bytes is None or self._approx_bytes > self.max_bytes:
+                self._evict()
+
+    # Get an object generation, calling loader() to fetch the bytes on a miss.
+    # A loader returning None (the object doesn't exist) isn't cached
+    def get_or_load(self, name, generation, loader):
+        data = self.get(name, generation)
+        with self._lock:
+            if data is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if data is None:
+            data = loader()
+            if data is not None:
+                self.put(name, generation, data)
+        return data
+
+    # Delete the least recently used entries until the cache fits in
+    # max_bytes. Other processes may be evicting at the same time, so entries
+    # that have already disappeared are skipped. Called with _lock held
+    def _evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.cache'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        entries.sort()
+        target = self.max_bytes * 0.9
+        for mtime, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+                self.evictions += 1
+            except OSError:
+                pass
+            total -= size
+        self._approx_bytes = total
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+# Build a cache using the location and size configured in the environment.
+# Setting MATCH_CACHE_MAX_MB to 0 disables it
+def cache_from_environment():
+    return MatchCache(
+        os.environ.get('MATCH_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'epl_match_cache')),
+        int(float(os.environ.get('MATCH_CACHE_MAX_MB', 256)) * 1024 * 1024)
+    )
@@ -0,0 +1,143 @@
+# match_manifest.py
+
+# A single JSON object in storage listing every stored match, so readers can
+# find matches without listing (and pattern matching) every object. Every
+# write is conditional on the generation that was read, so concurrent writers
+# retry instead of dropping each other's entries. Functions take a storage
+# backend (see storage_backend.py)
+import datetime
+import json
+import time
+
+from storage_backend import PreconditionFailed
+
+manifest_file_name = 'match_manifest.json'
+max_update_attempts = 10
+
+# Helper function to split a match filename (ex. 05Jan2021_Arsenal_vs_Chelsea.json)
+# back into an ISO date and the home and away team names. Returns None for
+# files that aren't match files
+def parse_match_filename(file_name):
+    if not file_name.endswith('.json'):
+        return None
+    try:
+        date_part, teams_part = file_name[:-len('.json')].split('_', 1)
+        home_team, away_team = teams_part.split('_vs_')
+        match_date = datetime.datetime.strptime(date_part, '%d%b%Y')
+    except ValueError:
+        return None
+    return [match_date.strftime('%Y-%m-%d'), home_team.replace('_', ' '), away_team.replace('_', ' ')]
+
+# Build the manifest entry for a match that has just been stored
+def build_manifest_entry(file_name, match_json, generation=None, size=None):
+    entry = {}
+    entry['Name'] = file_name
+    entry['Date'] = datetime.datetime.strptime(match_json['Date'], '%A %B %d, %Y').strftime('%Y-%m-%d')
+    entry['HomeTeam'] = match_json['HomeStats']['Team']
+    entry['AwayTeam'] = match_json['AwayStats']['Team']
+    entry['HomeGoals'] = match_json['HomeStats']['Goals']
+    entry['AwayGoals'] = match_json['AwayStats']['Goals']
+    entry['Generation'] = generation
+    entry['Size'] = size
+    return entry
+
+# Build a manifest entry from a listing alone. The score isn't part of the
+# filename, so it is left empty until the match is stored again
+def build_manifest_entry_from_listing(stored):
+    parsed = parse_match_filename(stored.name)
+    if parsed is None:
+        return None
+    entry = {}
+    entry['Name'] = stored.name
+    entry['Date'] = parsed[0]
+    entry['HomeTeam'] = parsed[1]
+    entry['AwayTeam'] = parsed[2]
+    entry['HomeGoals'] = None
+    entry['AwayGoals'] = None
+    entry['Generation'] = stored.generation
+    entry['Size'] = stored.size
+    return entry
+
+def empty_manifest():
+    return {'Matches': {}}
+
+# Read the manifest and the generation it was read at. Returns (None, 0) if it
+# doesn't exist yet; 0 is also the precondition for creating it
+def read_manifest(bucket):
+    data, stored = bucket.get_object(manifest_file_name)
+    if stored is None:
+        return None, 0
+    return json.loads(data), stored.generation
+
+def write_manifest(bucket, manifest, generation):
+    stored = bucket.put(manifest_file_name, json.dumps(manifest), 'application/json', if_generation_match=generation)
+    return stored.generation
+
+# Build a manifest by listing storage. Only used when there is no manifest
+# yet (ex. the first run against an existing bucket)
+def rebuild_manifest(bucket):
+    manifest = empty_manifest()
+    for stored in bucket.list():
+        entry = build_manifest_entry_from_listing(stored)
+        if entry is not None:
+            manifest['Matches'][entry['Name']] = entry
+    return manifest
+
+def retry_delay(attempt):
+    return min(0.1 * 2 ** attempt, 2)
+
+# Load the manifest, creating it from a bucket listing if it doesn't exist
+def load_manifest(bucket):
+    for attempt in range(max_update_attempts):
+        try:
+            manifest, generation = read_manifest(bucket)
+            if manifest is not None:
+                return manifest
+            manifest = rebuild_manifest(bucket)
+            write_manifest(bucket, manifest, 0)
+            return manifest
+        except PreconditionFailed:
+            # Someone else changed the manifest while we were reading it
+            time.sleep(retry_delay(attempt))
+    raise NameError("Error loading match manifest")
+
+# Add (or replace) entries in the manifest. The read-modify-write is retried
+# until it applies on top of the latest generation
+def update_manifest(bucket, entries):
+    for attempt in range(max_update_attempts):
+        try:
+            manifest, generation = read_manifest(bucket)
+            if manifest is None:
+                manifest = rebuild_manifest(bucket)
+            for entry in entries:
+                manifest['Matches'][entry['Name']] = entry
+            write_manifest(bucket, manifest, generation)
+            return manifest
+        except PreconditionFailed:
+            time.sleep(retry_delay(attempt))
+    raise NameError("Error updating match manifest")
+
+# Refresh the entries of matches that were rewritten without updating the
+# manifest. Takes the dict download_blobs passes to on_stale. A failed
+# update is only logged, since the next read falls back to the latest
+# generation again
+def refresh_stale_entries(bucket, stale):
+    entries = [build_manifest_entry(name, match_json, stored.generation, stored.size)
+               for name, (stored, match_json) in stale.items()]
+    try:
+        update_manifest(bucket, entries)
+    except Exception as e:
+        print('Error refreshing manifest entries', e)
+
+# Helper function to get manifest entries sorted by date, most recent first
+def sorted_entries(manifest):
+    return sorted(manifest['Matches'].values(), key=lambda entry: (entry['Date'], entry['Name']), reverse=True)
+
+# Build an index from team name to the team's manifest entries, most recent
+# first, so a team's latest matches can be found without scanning every entry
+def build_team_index(manifest):
+    team_index = {}
+    for entry in sorted_entries(manifest):
+        team_index.setdefault(entry['HomeTeam'], []).append(entry)
+        team_index.setdefault(entry['AwayTeam'], []).append(entry)
+    return team_index
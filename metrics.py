@@ -0,0 +1,137 @@
+# metrics.py
+
+# Counters and histograms for the scraper and analysis pipeline, served at
+# /metrics in the Prometheus text format. Recording a value is a dictionary
+# lookup and a few additions under a lock, so metrics are always on. Values
+# are per process (the service runs one gunicorn worker)
+import bisect
+import contextlib
+import threading
+import time
+
+# Latency buckets (in seconds), from cache hits up to slow browser renders
+default_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Helper function to escape a label value for the text format
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, escape_label_value(value)) for name, value in pairs) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[name]) for name in self.label_names), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name + format_labels(self.label_names, key), value
+
+class Histogram:
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=default_buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (not cumulative), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels):
+        series = self._values.get(tuple(str(labels[name]) for name in self.label_names))
+        return series[2] if series is not None else 0
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(series[0]), series[1], series[2])) for key, series in self._values.items())
+        for key, (bucket_counts, total, count) in values:
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets + (float('inf'),), bucket_counts):
+                cumulative += bucket_count
+                yield self.name + '_bucket' + format_labels(self.label_names, key, ('le', format_value(upper_bound))), cumulative
+            yield self.name + '_sum' + format_labels(self.label_names, key), total
+            yield self.name + '_count' + format_labels(self.label_names, key), count
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, documentation, label_names=()):
+        metric = Counter(name, documentation, label_names)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, label_names=(), buckets=default_buckets):
+        metric = Histogram(name, documentation, label_names, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    # Render every metric in the Prometheus text exposition format
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type_name))
+            for sample_name, value in metric.samples():
+                lines.append('%s %s' % (sample_name, format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    'epl_stage_seconds', 'Time spent in each stage of the scraper and analysis pipeline', ['stage'])
+stage_errors = registry.counter(
+    'epl_stage_errors_total', 'Stages that raised an exception', ['stage'])
+request_seconds = registry.histogram(
+    'epl_request_seconds', 'Latency of each endpoint', ['endpoint', 'method', 'status'])
+
+# Time a pipeline stage, counting it as an error if it raises
+@contextlib.contextmanager
+def timed_stage(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage=stage)
@@ -0,0 +1,271 @@
+# migrate.py
+
+# Bulk migration engine for stored match JSON. Registered transforms are
+# applied to every stored match file: objects are streamed from the
+# listing through a pool of workers, each rewrite is conditional on the
+# generation that was read (so nothing is ever deleted, and concurrent changes
+# aren't overwritten), and finished files are checkpointed so an interrupted
+# run can be resumed. Checkpoints are kept per list of transforms, and
+# removed once a run finishes every file.
+#
+# Usage: python migrate.py TRANSFORM [TRANSFORM ...] [--dry-run]
+#                          [--checkpoint FILE] [--workers N]
+#        python migrate.py --list
+import argparse
+import concurrent.futures
+import copy
+import difflib
+import json
+import os
+import time
+
+from match_manifest import build_manifest_entry, parse_match_filename, update_manifest
+from storage_backend import PreconditionFailed, backend_from_environment
+
+# Transforms by name. Each takes a match JSON object and returns the migrated
+# object (it is given its own copy, so it may modify it in place)
+transforms = {}
+
+def register_transform(name):
+    def register(transform):
+        transforms[name] = transform
+        return transform
+    return register
+
+def convert_player(old_player):
+    new_player = {}
+    new_player['2CrdY'] = int(old_player['2CrdY'])
+    new_player['AstShots'] = int(old_player['AstShots'])
+    new_player['Asts'] = int(old_player['Asts'])
+    new_player['Blk'] = int(old_player['Blk'])
+    new_player['CrdR'] = int(old_player['CrdR'])
+    new_player['CrdY'] = int(old_player['CrdY'])
+    new_player['Crs'] = int(old_player['Crs'])
+    new_player['Fld'] = int(old_player['Fld'])
+    new_player['Fls'] = int(old_player['Fls'])
+    new_player['Gls'] = int(old_player['Gls'])
+    new_player['Int'] = int(old_player['Int'])
+    new_player['Min'] = int(old_player['Min'])
+    new_player['PK'] = int(old_player['PK'])
+    new_player['PKatt'] = int(old_player['PKatt'])
+    new_player['Sh'] = int(old_player['Sh'])
+    new_player['SoT'] = int(old_player['SoT'])
+    new_player['TklW'] = int(old_player['TklW'])
+    new_player['Touches'] = int(old_player['Touches'])
+    new_player['pAtt'] = int(old_player['pAtt'])
+    new_player['pComp'] = int(old_player['pComp'])
+    new_player['xA'] = float(old_player['xA'])
+    new_player['xG'] = float(old_player['xG'])
+    new_player['Name'] = old_player['Name']
+    new_player['Pos'] = old_player['Pos']
+    return new_player
+
+def convert_keeper(old_keeper):
+    new_keeper = {}
+    new_keeper['Name'] = old_keeper['Name']
+    new_keeper['GA'] = int(old_keeper['GA'])
+    new_keeper['Min'] = int(old_keeper['Min'])
+    new_keeper['SoTA'] = int(old_keeper['SoTA'])
+    new_keeper['PSxG'] = float(old_keeper['PSxG'])
+    return new_keeper
+
+# Stats used to be stored as strings; convert them to numbers
+@register_transform('convert-stat-types')
+def convert_stat_types(match_json):
+    for side in ['HomePlayers', 'AwayPlayers']:
+        match_json[side] = [convert_player(player) for player in match_json[side]]
+    for side in ['HomeKeepers', 'AwayKeepers']:
+        match_json[side] = [convert_keeper(keeper) for keeper in match_json[side]]
+    return match_json
+
+# Early scrapes read the away score wrong; recount it from the away players'
+# goals and fix the result to match
+@register_transform('fix-away-goals')
+def fix_away_goals(match_json):
+    away_goals = 0
+    for player in match_json['AwayPlayers']:
+        away_goals += int(player['Gls'])
+    match_json['AwayStats']['Goals'] = away_goals
+
+    home_goals = int(match_json['HomeStats']['Goals'])
+    if home_goals == away_goals:
+        match_json['Result'] = 'Draw'
+    elif home_goals < away_goals:
+        match_json['Result'] = 'Away'
+    else:
+        match_json['Result'] = 'Home'
+    return match_json
+
+def apply_transforms(match_json, transform_names):
+    migrated = copy.deepcopy(match_json)
+    for transform_name in transform_names:
+        migrated = transforms[transform_name](migrated)
+    return migrated
+
+# Helper function to show what a migration changes in one file
+def match_diff(file_name, old_match, new_match):
+    old_lines = json.dumps(old_match, indent=2, sort_keys=True).splitlines(keepends=True)
+    new_lines = json.dumps(new_match, indent=2, sort_keys=True).splitlines(keepends=True)
+    return ''.join(difflib.unified_diff(old_lines, new_lines, fromfile=file_name, tofile=file_name + ' (migrated)'))
+
+# Manifest entries of rewritten files are written in chunks of this many,
+# before the files are checkpointed
+manifest_chunk_size = 50
+
+# Helper function to get the checkpoint key of a list of transforms
+def checkpoint_key(transform_names):
+    return ','.join(transform_names)
+
+# Names of the files finished by earlier runs of the same transforms. Each
+# line is the checkpoint key and a file name, separated by a tab
+def load_checkpoint(checkpoint_path, transform_names):
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return set()
+    key = checkpoint_key(transform_names)
+    done = set()
+    with open(checkpoint_path) as checkpoint_file:
+        for line in checkpoint_file:
+            line_key, _, name = line.rstrip('\n').partition('\t')
+            if line_key == key and name:
+                done.add(name)
+    return done
+
+# Migrate one stored object. Returns the outcome ('unchanged', 'changed' or
+# 'conflict'), the number of bytes read, the manifest entry for a rewritten
+# file and, on dry runs, the diff of the change
+def migrate_object(bucket, listed, transform_names, dry_run=False):
+    try:
+        data = bucket.get(listed.name, listed.generation)
+    except PreconditionFailed:
+        return 'conflict', 0, None, None
+    if data is None:
+        # Deleted since it was listed
+        return 'conflict', 0, None, None
+    match_json = json.loads(data)
+    migrated = apply_transforms(match_json, transform_names)
+    if migrated == match_json:
+        return 'unchanged', len(data), None, None
+    if dry_run:
+        return 'changed', len(data), None, match_diff(listed.name, match_json, migrated)
+
+    try:
+        stored = bucket.put(listed.name, json.dumps(migrated), 'application/json', if_generation_match=listed.generation)
+    except PreconditionFailed:
+        # The file changed since it was listed; leave it for the next run
+        return 'conflict', len(data), None, None
+
+    entry = None
+    if 'Date' in migrated and 'HomeStats' in migrated:
+        entry = build_manifest_entry(listed.name, migrated, stored.generation, stored.size)
+    return 'changed', len(data), entry, None
+
+# Run transforms over every stored match file. At most max_in_flight
+# objects are queued at once, so memory stays flat however large the bucket is.
+# Returns how many files had each outcome
+def run_migration(bucket, transform_names, dry_run=False, checkpoint_path=None,
+                  max_workers=8, max_in_flight=64, report_every=100):
+    for transform_name in transform_names:
+        if transform_name not in transforms:
+            raise ValueError('Unknown transform ' + transform_name)
+
+    key = checkpoint_key(transform_names)
+    done = load_checkpoint(checkpoint_path, transform_names)
+    checkpoint_file = None
+    if checkpoint_path and not dry_run:
+        checkpoint_file = open(checkpoint_path, 'a')
+
+    results = {'unchanged': 0, 'changed': 0, 'conflict': 0, 'failed': 0, 'skipped': len(done)}
+    # Rewritten files only count as done once their manifest entries are
+    # written, so an interrupted run never leaves a checkpointed file with a
+    # stale entry
+    manifest_entries = []
+    finished_names = []
+    bytes_read = 0
+    processed = 0
+    start = time.perf_counter()
+
+    def flush():
+        if manifest_entries:
+            update_manifest(bucket, manifest_entries)
+            manifest_entries.clear()
+        if checkpoint_file is not None:
+            checkpoint_file.writelines(key + '\t' + name + '\n' for name in finished_names)
+            checkpoint_file.flush()
+        finished_names.clear()
+
+    def finish(job, name):
+        nonlocal bytes_read, processed
+        try:
+            outcome, size, entry, diff = job.result()
+        except Exception as e:
+            print('Error migrating', name, e)
+            results['failed'] += 1
+            return
+        results[outcome] += 1
+        bytes_read += size
+        processed += 1
+        if diff:
+            print(diff)
+        if entry is not None:
+            manifest_entries.append(entry)
+        if outcome != 'conflict':
+            finished_names.append(name)
+        if len(manifest_entries) >= manifest_chunk_size or len(finished_names) >= manifest_chunk_size:
+            flush()
+        if processed % report_every == 0:
+            print_throughput(processed, bytes_read, time.perf_counter() - start)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {}
+            for listed in bucket.list():
+                if listed.name in done or parse_match_filename(listed.name) is None:
+                    continue
+                if len(pending) >= max_in_flight:
+                    finished, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for job in finished:
+                        finish(job, pending.pop(job))
+                pending[executor.submit(migrate_object, bucket, listed, transform_names, dry_run)] = listed.name
+            for job in concurrent.futures.as_completed(list(pending)):
+                finish(job, pending.pop(job))
+        flush()
+    except BaseException:
+        # Record what finished before the interruption, so it isn't redone
+        try:
+            flush()
+        except Exception as e:
+            print('Error saving progress', e)
+        raise
+    finally:
+        if checkpoint_file is not None:
+            checkpoint_file.close()
+
+    # Every file is done, so a later run starts from scratch
+    if checkpoint_file is not None and results['conflict'] == 0 and results['failed'] == 0:
+        os.remove(checkpoint_path)
+    print_throughput(processed, bytes_read, time.perf_counter() - start)
+    return results
+
+def print_throughput(processed, bytes_read, elapsed):
+    elapsed = max(elapsed, 1e-9)
+    print('   Migrated %d files, %.1f files/s, %.2f MB/s' % (processed, processed / elapsed, bytes_read / elapsed / 1e6))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Apply registered transforms to every stored match')
+    parser.add_argument('transforms', nargs='*', help='transforms to apply, in order')
+    parser.add_argument('--list', action='store_true', help='list the registered transforms')
+    parser.add_argument('--dry-run', action='store_true', help='print diffs instead of writing files')
+    parser.add_argument('--checkpoint', default='migration.checkpoint', help='file recording finished matches, removed once every file is done')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    if args.list or not args.transforms:
+        for transform_name in sorted(transforms):
+            print(transform_name)
+    else:
+        bucket = backend_from_environment()
+        results = run_migration(bucket, args.transforms, dry_run=args.dry_run,
+                                checkpoint_path=args.checkpoint, max_workers=args.workers)
+        print('Migration statistics:')
+        for outcome in ['unchanged', 'changed', 'conflict', 'failed', 'skipped']:
+            print('   %s: ' % outcome.capitalize(), results[outcome])
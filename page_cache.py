@@ -0,0 +1,174 @@
+# page_cache.py
+
+# Persistent cache of fetched pages. Each entry keeps the page body along with
+# the validators the server sent (ETag / Last-Modified) and a hash of the body.
+# Fresh entries are served without touching the network; stale entries are
+# revalidated with a conditional request, so an unchanged page costs a 304
+# instead of a download and a render. Match reports never expire, so the
+# cache is capped at max_bytes on disk and evicts the least recently used
+# entries, like MatchCache
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+# How long (in seconds) a page stays fresh, by URL pattern. None means the
+# page never expires; the first matching pattern wins
+default_ttls = [
+    (r'^https?://(www\.)?fbref\.com/en/matches/', None),
+    (r'^https?://(www\.)?fbref\.com/en/comps/9/schedule/', 600),
+]
+default_ttl = 300
+
+def content_hash(body):
+    return hashlib.sha256(body.encode()).hexdigest()
+
+class PageCache:
+    def __init__(self, directory, ttls=None, clock=time.time, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in (ttls if ttls is not None else default_ttls)]
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._approx_bytes = None
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return bool(self.directory) and self.max_bytes > 0
+
+    def ttl_for(self, url):
+        for pattern, ttl in self.ttls:
+            if pattern.match(url):
+                return ttl
+        return default_ttl
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest() + '.json')
+
+    # Return the cached entry for a URL (fresh or not), or None
+    def lookup(self, url):
+        if not self.enabled:
+            return None
+        path = self._path(url)
+        try:
+            with open(path) as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+        # Touch the entry so eviction drops the least recently used first
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def is_fresh(self, entry):
+        if entry['TTL'] is None:
+            return True
+        return self.clock() - entry['FetchedAt'] < entry['TTL']
+
+    # Headers that turn a request for a cached page into a conditional one
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get('ETag'):
+            headers['If-None-Match'] = entry['ETag']
+        if entry.get('LastModified'):
+            headers['If-Modified-Since'] = entry['LastModified']
+        return headers
+
+    def store(self, url, body, etag=None, last_modified=None):
+        entry = {
+            'URL': url,
+            'Body': body,
+            'Hash': content_hash(body),
+            'ETag': etag,
+            'LastModified': last_modified,
+            'FetchedAt': self.clock(),
+            'TTL': self.ttl_for(url)
+        }
+        self._write(url, entry)
+        return entry
+
+    # The server confirmed the cached body is still current, so start its TTL again
+    def revalidated(self, url, entry):
+        entry['FetchedAt'] = self.clock()
+        self._write(url, entry)
+        self.record('revalidations')
+        return entry
+
+    def _write(self, url, entry):
+        if not self.enabled:
+            return
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as temp_file:
+                json.dump(entry, temp_file)
+                size = temp_file.tell()
+            os.replace(temp_path, self._path(url))
+        except OSError:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            if self._approx_bytes is not None:
+                self._approx_bytes += size
+            if self._approx_bytes is None or self._approx_bytes > self.max_bytes:
+                self._evict()
+
+    # Delete the least recently used entries until the cache fits in
+    # max_bytes. Called with _lock held
+    def _evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        entries.sort()
+        target = self.max_bytes * 0.9
+        for mtime, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+                self.evictions += 1
+            except OSError:
+                pass
+            total -= size
+        self._approx_bytes = total
+
+    def record(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'revalidations': self.revalidations, 'evictions': self.evictions}
+
+# Build a cache in the directory and with the size configured in the
+# environment. Setting PAGE_CACHE_DIR to an empty string or
+# PAGE_CACHE_MAX_MB to 0 disables it
+def page_cache_from_environment():
+    return PageCache(
+        os.environ.get('PAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'epl_page_cache')),
+        max_bytes=int(float(os.environ.get('PAGE_CACHE_MAX_MB', 256)) * 1024 * 1024)
+    )
@@ -0,0 +1,228 @@
+# profiling.py
+
+# Opt-in profiling of single requests on a live instance. A request is
+# profiled when PROFILE_REQUESTS is set and it falls in the PROFILE_SAMPLE_RATE
+# fraction of requests, or when it carries a signed ?profile= parameter (see
+# sign_profile_request). Only one request is profiled at a time. Each profile
+# is written twice: a pstats file from cProfile (load it with pstats.Stats or
+# snakeviz) and collapsed stacks from a sampling thread (feed them to
+# flamegraph.pl or speedscope). Profiles go to PROFILE_DIR on local disk, or to
+# the storage backend under profiles/ with PROFILE_OUTPUT=storage.
+#
+# Only the thread handling the request is profiled; work it hands to other
+# threads (ex. concurrent downloads) shows up as time spent waiting. A request
+# that starts a background job (/findmatches, /run-analysis) hands its profile
+# to the job instead: the blocking calls the job makes are profiled, and the
+# profile is written when the job ends, under the name in the job's Profile.
+#
+# Usage: python profiling.py PATH [--expires-in SECONDS]
+#        (prints the profile= value for a request to PATH)
+import cProfile
+import datetime
+import hashlib
+import hmac
+import marshal
+import os
+import pstats
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+
+# Seconds between stack samples
+default_sample_interval = 0.005
+
+# Helper function to sign a request path. The signature is only valid for
+# that path and until expires (a Unix timestamp)
+def sign_profile_request(secret, path, expires):
+    signature = hmac.new(secret.encode(), ('%s:%d' % (path, expires)).encode(), hashlib.sha256).hexdigest()
+    return '%d.%s' % (expires, signature)
+
+def verify_profile_request(secret, path, value, now=None):
+    if not secret or not value:
+        return False
+    try:
+        expires = int(value.split('.', 1)[0])
+    except ValueError:
+        return False
+    if expires < (now if now is not None else time.time()):
+        return False
+    return hmac.compare_digest(sign_profile_request(secret, path, expires), value)
+
+def frame_name(frame):
+    code = frame.f_code
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+# Samples the stacks of a set of threads (starting with one) at a fixed
+# interval and counts how often each stack was seen
+class StackSampler:
+    def __init__(self, thread_id, interval=default_sample_interval):
+        self.interval = interval
+        self.counts = {}
+        self._threads = {thread_id: 1}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    # Start or stop sampling a thread. A thread added more than once is sampled
+    # until it has been removed as many times
+    def add_thread(self, thread_id):
+        with self._lock:
+            self._threads[thread_id] = self._threads.get(thread_id, 0) + 1
+
+    def remove_thread(self, thread_id):
+        with self._lock:
+            if self._threads.get(thread_id, 0) > 1:
+                self._threads[thread_id] -= 1
+            else:
+                self._threads.pop(thread_id, None)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.counts
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                thread_ids = list(self._threads)
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_name(frame).replace(';', ':'))
+                    frame = frame.f_back
+                key = ';'.join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+# Render sampled stacks in the collapsed format (one 'outer;inner count' line
+# per stack)
+def collapsed_stacks(counts):
+    return ''.join('%s %d\n' % (stack, count) for stack, count in sorted(counts.items()))
+
+class RequestProfiler:
+    def __init__(self, enabled=False, sample_rate=0.0, secret=None, output='local', directory=None,
+                 storage=None, sample_interval=default_sample_interval, rng=random.random):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.secret = secret
+        self.output = output
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'epl_profiles')
+        self.storage = storage
+        self.sample_interval = sample_interval
+        self.rng = rng
+        self.profiles_written = 0
+        self._lock = threading.Lock()
+
+    # Decide whether to profile a request. A signed parameter always asks for
+    # a profile; otherwise requests are sampled when profiling is enabled
+    def should_profile(self, path, profile_param=None):
+        if profile_param is not None:
+            return verify_profile_request(self.secret, path, profile_param)
+        return self.enabled and self.rng() < self.sample_rate
+
+    # Start profiling the calling thread. Returns a session to pass to finish,
+    # or None if the request isn't profiled (or another profile is running)
+    def start(self, path, profile_param=None):
+        if not self.should_profile(path, profile_param):
+            return None
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            sampler = StackSampler(threading.get_ident(), self.sample_interval)
+            profiler = cProfile.Profile()
+            sampler.start()
+            profiler.enable()
+        except:
+            self._lock.release()
+            raise
+        return {'Path': path, 'Profiler': profiler, 'Sampler': sampler, 'Start': time.perf_counter(),
+                'Calls': [], 'CallLock': threading.Lock()}
+
+    # Stop profiling the thread that started a session, but keep the session
+    # open for work carried on by other threads (see profile_call). Call it
+    # from the thread that started the session; the session can then be
+    # finished from any thread
+    def hand_off(self, session):
+        session['Profiler'].disable()
+        session['Sampler'].remove_thread(threading.get_ident())
+
+    # Run a call on the calling thread as part of a session that was handed
+    # off. Calls are all sampled, but only one at a time is run under cProfile
+    # (others overlapping it show in the sampled stacks only)
+    def profile_call(self, session, function, *args, **kwargs):
+        thread_id = threading.get_ident()
+        session['Sampler'].add_thread(thread_id)
+        profiled = session['CallLock'].acquire(blocking=False)
+        profiler = cProfile.Profile()
+        try:
+            if profiled:
+                profiler.enable()
+            return function(*args, **kwargs)
+        finally:
+            if profiled:
+                profiler.disable()
+                session['Calls'].append(profiler)
+                session['CallLock'].release()
+            session['Sampler'].remove_thread(thread_id)
+
+    # Stop a profile and write it out. Returns the base name it was written as
+    def finish(self, session):
+        try:
+            session['Profiler'].disable()
+            counts = session['Sampler'].stop()
+        finally:
+            self._lock.release()
+
+        stats = pstats.Stats(session['Profiler'])
+        for call_profiler in session['Calls']:
+            stats.add(call_profiler)
+        elapsed_ms = (time.perf_counter() - session['Start']) * 1000
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', session['Path']).strip('-') or 'index'
+        name = '%s_%s_%dms' % (datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S%f'), slug, elapsed_ms)
+        self.write(name + '.pstats', marshal.dumps(stats.stats))
+        self.write(name + '.collapsed', collapsed_stacks(counts).encode())
+        self.profiles_written += 1
+        return name
+
+    def write(self, file_name, data):
+        if self.output == 'storage':
+            self.storage.put('profiles/' + file_name, data, 'application/octet-stream')
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, file_name), 'wb') as profile_file:
+            profile_file.write(data)
+
+# Build a profiler configured by the environment. storage is the backend
+# profiles are written to with PROFILE_OUTPUT=storage
+def profiler_from_environment(storage=None):
+    return RequestProfiler(
+        enabled=os.environ.get('PROFILE_REQUESTS', '') not in ['', '0', 'false'],
+        sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0.01)),
+        secret=os.environ.get('PROFILE_SECRET'),
+        output=os.environ.get('PROFILE_OUTPUT', 'local'),
+        directory=os.environ.get('PROFILE_DIR'),
+        storage=storage,
+        sample_interval=float(os.environ.get('PROFILE_SAMPLE_INTERVAL', default_sample_interval))
+    )
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Sign a request path for profiling (uses PROFILE_SECRET)')
+    parser.add_argument('path', help='request path, ex. /run-analysis')
+    parser.add_argument('--expires-in', type=int, default=600, help='seconds the signature is valid for')
+    args = parser.parse_args()
+
+    secret = os.environ.get('PROFILE_SECRET')
+    if not secret:
+        sys.exit('PROFILE_SECRET is not set')
+    print('profile=' + sign_profile_request(secret, args.path, int(time.time()) + args.expires_in))
@@ -0,0 +1,67 @@
+# rate_limit.py
+
+# Token buckets used to keep requests to each host under a polite rate, no
+# matter how many threads are fetching at once
+import threading
+import time
+from urllib.parse import urlparse
+
+class TokenBucket:
+    # rate is in tokens per second, capacity is the largest burst allowed
+    def __init__(self, rate, capacity=1, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError('Rate must be positive')
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    # Take a token and return how long the caller has to wait before using it.
+    # The balance is allowed to go negative, so callers are served in the order
+    # they reserved without anyone polling
+    def reserve(self):
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    # Block until a token is available. Returns the time spent waiting
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+# Helper function to get the host a URL points at, ignoring a leading www.
+def url_host(url):
+    host = urlparse(url).hostname or ''
+    if host.startswith('www.'):
+        host = host[4:]
+    return host
+
+class HostRateLimiter:
+    # buckets maps host names to the TokenBucket that limits them. Hosts
+    # without a bucket are not limited
+    def __init__(self, buckets=None):
+        self.buckets = dict(buckets or {})
+
+    def acquire(self, url):
+        bucket = self.buckets.get(url_host(url))
+        if bucket is None:
+            return 0
+        return bucket.acquire()
+
+    # Take a token for the URL's host without blocking. Returns how long the
+    # caller has to wait before using it (ex. with asyncio.sleep)
+    def reserve(self, url):
+        bucket = self.buckets.get(url_host(url))
+        if bucket is None:
+            return 0
+        return bucket.reserve()
@@ -0,0 +1,78 @@
+# reparse.py
+
+# Regenerate match JSON from the raw match pages archived next to it, using the
+# current parser. Nothing is fetched from fbref, and only the match files whose
+# parsed output changed are written back.
+#
+# Usage: python reparse.py [--dry-run] [--workers N]
+import argparse
+import concurrent.futures
+import gzip
+import json
+import time
+
+import main
+from match_manifest import build_manifest_entry, update_manifest
+from storage_backend import backend_from_environment
+
+# Re-parse one archived page. Returns the outcome ('unchanged', 'changed',
+# 'invalid') and, for changed files that were written, their manifest entry
+def reparse_match(bucket, archive_name, dry_run=False):
+    file_name = main.get_match_filename_from_archive(archive_name)
+    page_content = main.unwrap_commented_tables(gzip.decompress(bucket.get(archive_name)).decode())
+    match_json = main.parse_page_to_json(main.make_soup(page_content))
+    if not main.match_is_valid(match_json):
+        return 'invalid', None
+
+    current_data, current = bucket.get_object(file_name)
+    if current is not None and json.loads(current_data) == match_json:
+        return 'unchanged', None
+    if dry_run:
+        return 'changed', None
+
+    # Only replace the generation that was compared against
+    stored = bucket.put(file_name, json.dumps(match_json), 'application/json',
+                        if_generation_match=current.generation if current is not None else 0)
+    return 'changed', build_manifest_entry(file_name, match_json, stored.generation, stored.size)
+
+# Re-parse every archived match page in storage. Returns how many files had
+# each outcome
+def reparse_archive(bucket, dry_run=False, max_workers=8):
+    archive_names = [stored.name for stored in bucket.list() if stored.name.endswith(main.archive_extension)]
+
+    results = {'unchanged': 0, 'changed': 0, 'invalid': 0, 'failed': 0}
+    manifest_entries = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        jobs = {executor.submit(reparse_match, bucket, name, dry_run): name for name in archive_names}
+        for job in concurrent.futures.as_completed(jobs):
+            try:
+                outcome, entry = job.result()
+            except Exception as e:
+                print('Error re-parsing', jobs[job], e)
+                results['failed'] += 1
+                continue
+            results[outcome] += 1
+            if outcome == 'changed':
+                print(('Would update ' if dry_run else 'Updated ') + main.get_match_filename_from_archive(jobs[job]))
+            if entry is not None:
+                manifest_entries.append(entry)
+
+    if manifest_entries:
+        update_manifest(bucket, manifest_entries)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Re-parse archived match pages with the current parser')
+    parser.add_argument('--dry-run', action='store_true', help='report changed matches without writing them')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    bucket = backend_from_environment()
+    results = reparse_archive(bucket, dry_run=args.dry_run, max_workers=args.workers)
+    print('Re-parse statistics:')
+    print('   Unchanged: ', results['unchanged'])
+    print('   Changed: ', results['changed'])
+    print('   Invalid: ', results['invalid'])
+    print('   Failed: ', results['failed'])
+    print('   Elapsed: ', '%.1fs' % (time.perf_counter() - start))
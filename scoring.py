@@ -0,0 +1,106 @@
+# scoring.py
+
+# Fantasy points for the players in an analysis. Points are a weighted sum of
+# each player's stats plus clean sheet bonuses, so a rule set is just the
+# weights and bonuses; every player (and every keeper) in the analysis is
+# scored in one matrix product instead of one formula per row. Rule sets are
+# registered by name and the one used is chosen with SCORING_RULES
+import os
+
+import numpy as np
+
+rule_sets = {}
+
+def register_rule_set(name, rules):
+    rule_sets[name] = rules
+    return rules
+
+# DraftKings soccer classic scoring
+register_rule_set('draftkings', {
+    'Label': 'DK',
+    'PlayerWeights': {
+        'Gls': 10, 'Asts': 6, 'Sh': 1, 'SoT': 1, 'Crs': 0.7, 'AstShots': 1, 'pComp': 0.02,
+        'Fld': 1, 'Fls': -0.5, 'TklW': 1, 'Int': 0.5, 'CrdY': -1.5, 'CrdR': -3
+    },
+    # Outfield players listed at any of these positions get the clean sheet bonus
+    'CleanSheetPositions': ['LB', 'CB', 'RB'],
+    'PlayerCleanSheet': 3,
+    # Saves (SoTA - GA) are worth 2 and goals against cost 2
+    'KeeperWeights': {'SoTA': 2, 'GA': -4},
+    'KeeperCleanSheet': 5,
+    'KeeperCleanSheetWin': 5
+})
+
+default_rule_set = os.environ.get('SCORING_RULES', 'draftkings')
+
+# Helper function to build a (rows x stats) matrix from a list of stat
+# dictionaries. Missing stats count as 0
+def stat_matrix(rows, stats):
+    matrix = np.zeros((len(rows), len(stats)))
+    for row_index, row in enumerate(rows):
+        matrix[row_index] = [row.get(stat, 0) for stat in stats]
+    return matrix
+
+def weighted_points(rows, weights):
+    return stat_matrix(rows, list(weights)) @ np.array(list(weights.values()), dtype=float)
+
+# Score outfield players. conceded holds the goals each player's team
+# conceded. Returns the points and whether each player earned a clean sheet
+# (None for players at positions that can't)
+def score_players(players, conceded, rules):
+    points = weighted_points(players, rules['PlayerWeights'])
+    positions = set(rules['CleanSheetPositions'])
+    eligible = np.array([bool(positions.intersection(player['Pos'].split(','))) for player in players], dtype=bool)
+    clean_sheet = eligible & (np.asarray(conceded) == 0)
+    points += clean_sheet * rules['PlayerCleanSheet']
+    return points, [bool(clean) if can_keep else None for clean, can_keep in zip(clean_sheet, eligible)]
+
+# Score keepers. won holds whether each keeper's team won
+def score_keepers(keepers, won, rules):
+    points = weighted_points(keepers, rules['KeeperWeights'])
+    clean_sheet = np.array([keeper['GA'] == 0 for keeper in keepers], dtype=bool)
+    points += clean_sheet * rules['KeeperCleanSheet']
+    points += (clean_sheet & np.asarray(won, dtype=bool)) * rules['KeeperCleanSheetWin']
+    return points, [bool(clean) for clean in clean_sheet]
+
+# Add points to every past match in an analysis (the output of
+# get_matches_for_dates). Each player and keeper gets 'Pts' and 'Cln' (1, 0,
+# or None when the player can't earn a clean sheet) and each past match gets
+# the label of the rule set, all scored in one batch. With rescore=False,
+# past matches that were already scored are left alone
+def score_analysis(matches_by_date, rule_set=None, rescore=True):
+    rules = rule_sets[rule_set or default_rule_set]
+
+    # A stored match can be shared by several fixtures, so score each once
+    past_matches = {}
+    for matches in matches_by_date.values():
+        if isinstance(matches, str):
+            continue
+        for match in matches:
+            for side in ['HomeTeam', 'AwayTeam']:
+                for past_match in match[side]['PastMatches']:
+                    if past_match is not None and (rescore or 'Scoring' not in past_match):
+                        past_matches[id(past_match)] = past_match
+
+    players, conceded, keepers, won = [], [], [], []
+    for past_match in past_matches.values():
+        past_match['Scoring'] = rules['Label']
+        for player in past_match['Players']:
+            if player['Pos'] != 'GK':
+                players.append(player)
+                conceded.append(past_match['GlsAgainst'])
+        for keeper in past_match['Keepers']:
+            keepers.append(keeper)
+            won.append(past_match['Result'] == 'Win')
+
+    if players:
+        points, clean_sheets = score_players(players, conceded, rules)
+        for player, player_points, clean in zip(players, points.tolist(), clean_sheets):
+            player['Pts'] = player_points
+            player['Cln'] = None if clean is None else int(clean)
+    if keepers:
+        points, clean_sheets = score_keepers(keepers, won, rules)
+        for keeper, keeper_points, clean in zip(keepers, points.tolist(), clean_sheets):
+            keeper['Pts'] = keeper_points
+            keeper['Cln'] = int(clean)
+    return matches_by_date
@@ -0,0 +1,238 @@
+# season_store.py
+
+# Columnar store of every player and keeper appearance, so questions across
+# many matches (ex. a team's xG over the last month) don't need every match
+# file downloaded and walked. Each appearance is one row; player, team,
+# position and match names are dictionary encoded into integer columns and
+# every stat is a float column (NaN when a stat wasn't recorded). The store is
+# saved in the bucket as a single compressed .npz object and updated with
+# generation preconditions, like the match manifest.
+#
+# Usage: python season_store.py --rebuild
+import datetime
+import io
+import json
+import time
+
+import numpy as np
+
+from blob_download import download_blobs
+from match_manifest import load_manifest, refresh_stale_entries, retry_delay
+from storage_backend import PreconditionFailed, backend_from_environment
+
+season_store_file_name = 'season_store.npz'
+max_update_attempts = 10
+
+player_stats = ['Min', 'Gls', 'Asts', 'PK', 'PKatt', 'Sh', 'SoT', 'CrdY', 'CrdR', '2CrdY', 'Touches',
+                'Int', 'Blk', 'pComp', 'pAtt', 'xA', 'xG', 'Crs', 'TklW', 'Fls', 'Fld', 'AstShots']
+keeper_stats = ['SoTA', 'GA', 'PSxG']
+stat_columns = player_stats + keeper_stats
+
+aggregations = ['sum', 'mean', 'max', 'min']
+
+class SeasonStore:
+    def __init__(self):
+        self.tables = {'matches': [], 'players': [], 'teams': [], 'positions': []}
+        self._lookup = {name: {} for name in self.tables}
+        self.columns = {
+            'Match': np.zeros(0, dtype=np.int32),
+            'Date': np.zeros(0, dtype=np.int32),
+            'Player': np.zeros(0, dtype=np.int32),
+            'Team': np.zeros(0, dtype=np.int32),
+            'Opponent': np.zeros(0, dtype=np.int32),
+            'Position': np.zeros(0, dtype=np.int32),
+            'Home': np.zeros(0, dtype=bool),
+            'Keeper': np.zeros(0, dtype=bool),
+        }
+        for stat in stat_columns:
+            self.columns[stat] = np.zeros(0, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.columns['Match'])
+
+    def _encode(self, table, value):
+        lookup = self._lookup[table]
+        if value not in lookup:
+            lookup[value] = len(self.tables[table])
+            self.tables[table].append(value)
+        return lookup[value]
+
+    def has_match(self, file_name):
+        return file_name in self._lookup['matches']
+
+    # Add every appearance in a match, replacing the match's rows if it was
+    # already in the store
+    def add_match(self, file_name, match_json):
+        if self.has_match(file_name):
+            self._remove_match(self._lookup['matches'][file_name])
+        match_idx = self._encode('matches', file_name)
+        date = int(datetime.datetime.strptime(match_json['Date'], '%A %B %d, %Y').strftime('%Y%m%d'))
+
+        rows = []
+        sides = [('HomeStats', 'AwayStats', 'HomePlayers', 'HomeKeepers', True),
+                 ('AwayStats', 'HomeStats', 'AwayPlayers', 'AwayKeepers', False)]
+        for team_key, opp_key, players_key, keepers_key, home in sides:
+            team = self._encode('teams', match_json[team_key]['Team'])
+            opponent = self._encode('teams', match_json[opp_key]['Team'])
+            for player in match_json[players_key]:
+                rows.append((player, team, opponent, self._encode('positions', player.get('Pos', '')), home, False))
+            for keeper in match_json[keepers_key]:
+                rows.append((keeper, team, opponent, self._encode('positions', 'GK'), home, True))
+
+        new_columns = {
+            'Match': np.full(len(rows), match_idx, dtype=np.int32),
+            'Date': np.full(len(rows), date, dtype=np.int32),
+            'Player': np.array([self._encode('players', row[0]['Name']) for row in rows], dtype=np.int32),
+            'Team': np.array([row[1] for row in rows], dtype=np.int32),
+            'Opponent': np.array([row[2] for row in rows], dtype=np.int32),
+            'Position': np.array([row[3] for row in rows], dtype=np.int32),
+            'Home': np.array([row[4] for row in rows], dtype=bool),
+            'Keeper': np.array([row[5] for row in rows], dtype=bool),
+        }
+        for stat in stat_columns:
+            new_columns[stat] = np.array([row[0].get(stat, np.nan) for row in rows], dtype=np.float32)
+
+        for name, column in new_columns.items():
+            self.columns[name] = np.concatenate([self.columns[name], column])
+
+    def _remove_match(self, match_idx):
+        keep = self.columns['Match'] != match_idx
+        for name in self.columns:
+            self.columns[name] = self.columns[name][keep]
+
+    # Aggregate stats over the appearances that pass every filter. Dates are
+    # 'YYYY-MM-DD' strings (inclusive), position matches any of a player's
+    # listed positions (ex. 'CB' matches 'CB,RB'), keepers selects keeper rows
+    # (keeper stats) instead of outfield rows. Results are grouped by 'player',
+    # 'team' or None (everything in one group) and returned as a list of
+    # dictionaries, largest first by the first stat
+    def query(self, stats, team=None, player=None, position=None, start=None, end=None,
+              keepers=False, group_by='player', agg='sum'):
+        if agg not in aggregations:
+            raise ValueError('Unknown aggregation ' + str(agg))
+        for stat in stats:
+            if stat not in self.columns:
+                raise ValueError('Unknown stat ' + str(stat))
+
+        mask = self.columns['Keeper'] == keepers
+        for column, table, value in [('Team', 'teams', team), ('Player', 'players', player)]:
+            if value is not None:
+                mask &= self.columns[column] == self._lookup[table].get(value, -1)
+        if position is not None:
+            matching = [index for index, name in enumerate(self.tables['positions']) if position in name.split(',')]
+            mask &= np.isin(self.columns['Position'], matching)
+        if start is not None:
+            mask &= self.columns['Date'] >= int(start.replace('-', ''))
+        if end is not None:
+            mask &= self.columns['Date'] <= int(end.replace('-', ''))
+
+        if group_by == 'player':
+            group_column, table, label = self.columns['Player'][mask], self.tables['players'], 'Player'
+        elif group_by == 'team':
+            group_column, table, label = self.columns['Team'][mask], self.tables['teams'], 'Team'
+        elif group_by is None:
+            group_column, table, label = np.zeros(int(mask.sum()), dtype=np.int32), None, None
+        else:
+            raise ValueError('Unknown grouping ' + str(group_by))
+
+        groups, inverse = np.unique(group_column, return_inverse=True)
+        appearances = np.bincount(inverse, minlength=len(groups))
+        results = []
+        aggregated = {stat: aggregate(self.columns[stat][mask], inverse, len(groups), agg) for stat in stats}
+        for position_in_groups, group in enumerate(groups):
+            result = {}
+            if label is not None:
+                result[label] = table[group]
+            result['Appearances'] = int(appearances[position_in_groups])
+            for stat in stats:
+                value = aggregated[stat][position_in_groups]
+                result[stat] = None if np.isnan(value) else float(value)
+            results.append(result)
+
+        if stats:
+            results.sort(key=lambda result: -np.inf if result[stats[0]] is None else result[stats[0]], reverse=True)
+        return results
+
+    def to_bytes(self):
+        arrays = {'column_' + name: column for name, column in self.columns.items()}
+        arrays['tables'] = np.frombuffer(json.dumps(self.tables).encode(), dtype=np.uint8)
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        store = cls()
+        with np.load(io.BytesIO(data)) as arrays:
+            store.tables = json.loads(arrays['tables'].tobytes().decode())
+            for name in store.columns:
+                store.columns[name] = arrays['column_' + name]
+        store._lookup = {name: {value: index for index, value in enumerate(values)}
+                         for name, values in store.tables.items()}
+        return store
+
+# Helper function to aggregate a stat column by group, ignoring NaNs (stats
+# that weren't recorded for an appearance)
+def aggregate(values, inverse, num_groups, agg):
+    present = ~np.isnan(values)
+    counts = np.bincount(inverse[present], minlength=num_groups)
+    if agg in ['sum', 'mean']:
+        totals = np.bincount(inverse[present], weights=values[present], minlength=num_groups)
+        if agg == 'sum':
+            return np.where(counts > 0, totals, np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return totals / counts
+    result = np.full(num_groups, -np.inf if agg == 'max' else np.inf)
+    ufunc = np.maximum if agg == 'max' else np.minimum
+    ufunc.at(result, inverse[present], values[present])
+    return np.where(counts > 0, result, np.nan)
+
+# Read the store and the generation it was read at. Returns an empty store and
+# generation 0 if it doesn't exist yet
+def read_season_store(bucket):
+    data, stored = bucket.get_object(season_store_file_name)
+    if stored is None:
+        return SeasonStore(), 0
+    return SeasonStore.from_bytes(data), stored.generation
+
+def write_season_store(bucket, store, generation):
+    bucket.put(season_store_file_name, store.to_bytes(), 'application/octet-stream', if_generation_match=generation)
+
+# Add matches (a list of (file name, match JSON) pairs) to the stored season
+# store, retrying on top of the latest generation if someone else wrote first
+def update_season_store(bucket, matches):
+    for attempt in range(max_update_attempts):
+        try:
+            store, generation = read_season_store(bucket)
+            for file_name, match_json in matches:
+                store.add_match(file_name, match_json)
+            write_season_store(bucket, store, generation)
+            return store
+        except PreconditionFailed:
+            time.sleep(retry_delay(attempt))
+    raise NameError("Error updating season store")
+
+# Build the store from every match in the manifest and replace the stored one
+def rebuild_season_store(bucket, manifest, cache=None):
+    contents, latencies = download_blobs(
+        bucket, [(entry['Name'], entry['Generation']) for entry in manifest['Matches'].values()], cache=cache,
+        on_stale=lambda stale: refresh_stale_entries(bucket, stale))
+    store = SeasonStore()
+    for file_name in sorted(contents):
+        if contents[file_name] is not None:
+            store.add_match(file_name, contents[file_name])
+    stored = bucket.stat(season_store_file_name)
+    write_season_store(bucket, store, stored.generation if stored is not None else 0)
+    return store
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Maintain the columnar season store')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild the store from every stored match')
+    args = parser.parse_args()
+
+    if args.rebuild:
+        bucket = backend_from_environment()
+        store = rebuild_season_store(bucket, load_manifest(bucket))
+        print('Season store rebuilt with', len(store), 'appearances from', len(store.tables['matches']), 'matches')
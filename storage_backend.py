@@ -0,0 +1,372 @@
+# storage_backend.py
+
+# Where match files, archives, the manifest and analysis files are kept.
+# Everything that reads or writes stored objects goes through a backend:
+# GCSBackend for a Cloud Storage bucket, LocalBackend for a directory on local
+# disk (so the app, the tools and the benchmarks can run offline). Every object
+# has a generation that changes whenever it is rewritten, and writes can be
+# made conditional on it; a generation of 0 means the object doesn't exist.
+# The backend is chosen with STORAGE_BACKEND ('gcs' or 'local')
+import collections
+import concurrent.futures
+import fcntl
+import os
+import tempfile
+import threading
+import time
+
+import google.auth
+import requests
+from google.api_core import exceptions
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import storage
+
+StoredObject = collections.namedtuple('StoredObject', ['name', 'generation', 'size'])
+
+class StorageError(Exception):
+    pass
+
+# A conditional write or read found a different generation than expected
+class PreconditionFailed(StorageError):
+    pass
+
+class StorageBackend:
+    # Workers used by the default batch operations
+    batch_workers = 8
+
+    # Return a StoredObject describing the current object, or None
+    def stat(self, name):
+        raise NotImplementedError
+
+    # Return the bytes of an object, or None if it doesn't exist (with or
+    # without a generation). With a generation, raises PreconditionFailed if
+    # the object exists but has been rewritten
+    def get(self, name, generation=None):
+        raise NotImplementedError
+
+    # Return the bytes of an object and the StoredObject they were read from,
+    # or (None, None) if it doesn't exist
+    def get_object(self, name):
+        raise NotImplementedError
+
+    # Write an object and return its StoredObject. With if_generation_match,
+    # the write only happens if the object is still at that generation (0 for
+    # an object that mustn't exist yet); otherwise raises PreconditionFailed
+    def put(self, name, data, content_type=None, if_generation_match=None):
+        raise NotImplementedError
+
+    def put_if_absent(self, name, data, content_type=None):
+        return self.put(name, data, content_type, if_generation_match=0)
+
+    # Yield a StoredObject for every object whose name starts with prefix
+    def list(self, prefix=''):
+        raise NotImplementedError
+
+    # Delete an object. Returns False if it didn't exist
+    def delete(self, name):
+        raise NotImplementedError
+
+    # Batch operations. Each returns a dict keyed by object name; backends
+    # with native batching override them. GCS can't batch media uploads or
+    # downloads, so get_many and put_many always run the calls concurrently
+    def stat_many(self, names):
+        return self._run_many(self.stat, [(name,) for name in names])
+
+    def get_many(self, names):
+        return self._run_many(self.get, [(name,) for name in names])
+
+    # items is a list of (name, data, content_type) tuples
+    def put_many(self, items):
+        return self._run_many(self.put, items)
+
+    def delete_many(self, names):
+        return self._run_many(self.delete, [(name,) for name in names])
+
+    def _run_many(self, operation, calls):
+        results = {}
+        if not calls:
+            return results
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.batch_workers, len(calls))) as executor:
+            jobs = {executor.submit(operation, *call): call[0] for call in calls}
+            for job in concurrent.futures.as_completed(jobs):
+                results[jobs[job]] = job.result()
+        return results
+
+# HTTP connections kept open to Cloud Storage per process. requests keeps 10
+# by default, fewer than gunicorn's threads and the download workers they
+# start, so connections were being discarded and re-established (a TLS
+# handshake each) under load
+gcs_connection_pool_size = int(os.environ.get('GCS_CONNECTION_POOL_SIZE', 32))
+
+# Most calls one GCS batch request may carry
+gcs_batch_size = 100
+
+# Build Cloud Storage clients that share one authorized HTTP session and its
+# connection pool
+def make_gcs_clients(count=1, pool_size=None):
+    pool_size = pool_size or gcs_connection_pool_size
+    credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+    session = AuthorizedSession(credentials)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    return [storage.Client(project=project, credentials=credentials, _http=session) for i in range(count)]
+
+class GCSBackend(StorageBackend):
+    batch_workers = 16
+
+    # client and batch_client are created on first use when not given. They
+    # are given together, as two clients: one can't be shared with batches
+    # (see _batched)
+    def __init__(self, bucket_name, client=None, batch_client=None):
+        if (client is None) != (batch_client is None) or (client is not None and client is batch_client):
+            raise ValueError('GCSBackend needs client and batch_client together, as separate clients')
+        self.bucket_name = bucket_name
+        self._client = client
+        self._batch_client = batch_client
+        self._bucket = None
+        self._batch_bucket = None
+        self._lock = threading.Lock()
+        self._batch_lock = threading.Lock()
+
+    def _connect(self):
+        with self._lock:
+            if self._bucket is None:
+                if self._client is None:
+                    self._client, self._batch_client = make_gcs_clients(2)
+                self._bucket = self._client.bucket(self.bucket_name)
+                self._batch_bucket = self._batch_client.bucket(self.bucket_name)
+
+    # The client (and its HTTP connections) is created on first use and
+    # shared by every thread
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            self._connect()
+        return self._bucket
+
+    # While a batch is open, every request made through its client is
+    # deferred into the batch, whichever thread makes it. Batches therefore
+    # go through a second client (sharing the same connections) and only one
+    # is open at a time. Calls operation(blob) for every name inside batches
+    # and returns the name, blob and HTTP status of each call
+    def _batched(self, names, operation):
+        if self._bucket is None:
+            self._connect()
+        results = []
+        with self._batch_lock:
+            for start in range(0, len(names), gcs_batch_size):
+                chunk = names[start:start + gcs_batch_size]
+                blobs = [self._batch_bucket.blob(name) for name in chunk]
+                batch = self._batch_bucket.client.batch(raise_exception=False)
+                with batch:
+                    for blob in blobs:
+                        operation(blob)
+                for name, blob, response in zip(chunk, blobs, batch._responses):
+                    results.append((name, blob, response.status_code))
+        return results
+
+    def _check_batch_status(self, name, status):
+        if status == 412:
+            raise PreconditionFailed(name)
+        if not 200 <= status < 300 and status != 404:
+            raise StorageError('Batch request for %s failed with status %d' % (name, status))
+
+    # Metadata for many objects in as few requests as possible
+    def stat_many(self, names):
+        names = list(dict.fromkeys(names))
+        results = {}
+        for name, blob, status in self._batched(names, lambda blob: blob.reload()):
+            self._check_batch_status(name, status)
+            results[name] = StoredObject(name, blob.generation, blob.size) if status != 404 else None
+        return results
+
+    def delete_many(self, names):
+        names = list(dict.fromkeys(names))
+        results = {}
+        for name, blob, status in self._batched(names, lambda blob: blob.delete()):
+            self._check_batch_status(name, status)
+            results[name] = status != 404
+        return results
+
+    def stat(self, name):
+        blob = self.bucket.get_blob(name)
+        if blob is None:
+            return None
+        return StoredObject(name, blob.generation, blob.size)
+
+    def get(self, name, generation=None):
+        try:
+            return self.bucket.blob(name).download_as_bytes(if_generation_match=generation)
+        except exceptions.NotFound:
+            return None
+        except exceptions.PreconditionFailed:
+            raise PreconditionFailed(name)
+
+    def get_object(self, name):
+        # The download response carries the generation, so no separate
+        # metadata request is needed
+        blob = self.bucket.blob(name)
+        try:
+            data = blob.download_as_bytes()
+        except exceptions.NotFound:
+            return None, None
+        return data, StoredObject(name, blob.generation, len(data))
+
+    def put(self, name, data, content_type=None, if_generation_match=None):
+        blob = self.bucket.blob(name)
+        try:
+            blob.upload_from_string(
+                data=data,
+                content_type=content_type or 'application/octet-stream',
+                if_generation_match=if_generation_match
+            )
+        except exceptions.PreconditionFailed:
+            raise PreconditionFailed(name)
+        return StoredObject(name, blob.generation, blob.size)
+
+    def list(self, prefix=''):
+        for blob in self.bucket.list_blobs(prefix=prefix or None):
+            yield StoredObject(blob.name, blob.generation, blob.size)
+
+    def delete(self, name):
+        try:
+            self.bucket.blob(name).delete()
+        except exceptions.NotFound:
+            return False
+        return True
+
+# Objects are stored as plain files named after the object under a root
+# directory, so they can be read (or mmapped) directly. An object's generation
+# is its file's modification time in nanoseconds, set before the file is
+# renamed into place, so a reader always gets a matching body and generation
+# from one open file. Writes and deletes hold an exclusive lock on the root,
+# which makes conditional writes safe across threads and processes
+class LocalBackend(StorageBackend):
+    lock_file_name = '.lock'
+    temp_directory_name = '.tmp'
+
+    def __init__(self, root):
+        self.root = root
+        self._temp_directory = os.path.join(root, self.temp_directory_name)
+        os.makedirs(self._temp_directory, exist_ok=True)
+        self._thread_lock = threading.Lock()
+
+    def _path(self, name):
+        if not name or name.startswith('/') or '..' in name.split('/') or name.split('/')[0].startswith('.'):
+            raise StorageError('Invalid object name ' + repr(name))
+        return os.path.join(self.root, *name.split('/'))
+
+    def _locked(self):
+        return _DirectoryLock(os.path.join(self.root, self.lock_file_name), self._thread_lock)
+
+    def _current_generation(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def stat(self, name):
+        try:
+            stat = os.stat(self._path(name))
+        except FileNotFoundError:
+            return None
+        return StoredObject(name, stat.st_mtime_ns, stat.st_size)
+
+    def get(self, name, generation=None):
+        data, stored = self.get_object(name)
+        if stored is not None and generation is not None and stored.generation != generation:
+            raise PreconditionFailed(name)
+        return data
+
+    def get_object(self, name):
+        try:
+            with open(self._path(name), 'rb') as object_file:
+                stat = os.fstat(object_file.fileno())
+                data = object_file.read()
+        except FileNotFoundError:
+            return None, None
+        return data, StoredObject(name, stat.st_mtime_ns, len(data))
+
+    def put(self, name, data, content_type=None, if_generation_match=None):
+        path = self._path(name)
+        if isinstance(data, str):
+            data = data.encode()
+        with self._locked():
+            current = self._current_generation(path)
+            if if_generation_match is not None and if_generation_match != current:
+                raise PreconditionFailed(name)
+            generation = max(time.time_ns(), current + 1)
+
+            fd, temp_path = tempfile.mkstemp(dir=self._temp_directory)
+            try:
+                with os.fdopen(fd, 'wb') as temp_file:
+                    temp_file.write(data)
+                os.utime(temp_path, ns=(generation, generation))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+            except OSError:
+                try:
+                    os.unlink(temp_path)
+                except OSError:
+                    pass
+                raise
+        return StoredObject(name, generation, len(data))
+
+    def list(self, prefix=''):
+        names = []
+        for directory, subdirectories, file_names in os.walk(self.root):
+            relative = os.path.relpath(directory, self.root)
+            if relative == '.':
+                relative = ''
+                subdirectories[:] = [subdirectory for subdirectory in subdirectories if not subdirectory.startswith('.')]
+                file_names = [file_name for file_name in file_names if not file_name.startswith('.')]
+            for file_name in file_names:
+                name = '/'.join(relative.split(os.sep) + [file_name]) if relative else file_name
+                if name.startswith(prefix):
+                    names.append(name)
+        for name in sorted(names):
+            stored = self.stat(name)
+            if stored is not None:
+                yield stored
+
+    def delete(self, name):
+        with self._locked():
+            try:
+                os.unlink(self._path(name))
+            except FileNotFoundError:
+                return False
+        return True
+
+# Exclusive lock on a file, held by one thread of one process at a time
+class _DirectoryLock:
+    def __init__(self, path, thread_lock):
+        self.path = path
+        self.thread_lock = thread_lock
+        self.lock_file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            self.lock_file = open(self.path, 'a')
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        except:
+            self.thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+        finally:
+            self.thread_lock.release()
+
+# Build the backend configured in the environment. 'gcs' uses the bucket named
+# by CLOUD_STORAGE_BUCKET, 'local' the directory named by STORAGE_DIR
+def backend_from_environment():
+    backend = os.environ.get('STORAGE_BACKEND', 'gcs')
+    if backend == 'gcs':
+        return GCSBackend(os.environ.get('CLOUD_STORAGE_BUCKET'))
+    if backend == 'local':
+        return LocalBackend(os.environ.get('STORAGE_DIR', os.path.join(tempfile.gettempdir(), 'epl_storage')))
+    raise ValueError('Unknown storage backend ' + backend)
@@ -0,0 +1,80 @@
+# Note, run with -b flag to suppress output
+import json
+import unittest
+
+import main
+from analysis_cache import AnalysisCache
+from match_cache import MatchCache
+from test_match_manifest import FakeBucket
+from test_page_cache import FakeClock
+
+class TestAnalysisCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = AnalysisCache(60, clock=self.clock)
+
+    def test_fresh_entry_within_ttl(self):
+        """
+        Test that an entry is served without checking generations until its TTL runs out
+        """
+        self.cache.store((1, 2), {}, '<html>')
+        self.assertEqual(self.cache.fresh_entry()['HTML'], '<html>')
+        self.clock.now += 60
+        self.assertIsNone(self.cache.fresh_entry())
+        self.assertEqual(self.cache.stats()['hits'], 1)
+    def test_entry_for_generations(self):
+        """
+        Test that a stale entry is reused only for the generations it was built from
+        """
+        self.cache.store((1, 2), {}, '<html>')
+        self.clock.now += 120
+        self.assertIsNone(self.cache.entry_for((1, 3)))
+        self.assertEqual(self.cache.entry_for((1, 2))['HTML'], '<html>')
+        # Revalidating starts the TTL again
+        self.assertIsNotNone(self.cache.fresh_entry())
+        self.assertEqual(self.cache.stats(), {'hits': 2, 'misses': 1, 'revalidations': 1, 'invalidations': 0})
+    def test_invalidate(self):
+        """
+        Test that an invalidated entry is never served
+        """
+        self.cache.store((1, 2), {}, '<html>')
+        self.cache.invalidate()
+        self.assertIsNone(self.cache.fresh_entry())
+        self.assertIsNone(self.cache.entry_for((1, 2)))
+
+class TestViewAnalysis(unittest.TestCase):
+    def setUp(self):
+        self.bucket = FakeBucket()
+        for analysis_file_name in main.analysis_file_names:
+            self.bucket.put(analysis_file_name, json.dumps([]))
+        self.bucket.downloads = 0
+        self.clock = FakeClock()
+        self.saved = (main.storage_backend, main.analysis_cache, main.match_cache)
+        main.storage_backend = self.bucket
+        main.analysis_cache = AnalysisCache(60, clock=self.clock)
+        main.match_cache = MatchCache('', 0)
+        self.client = main.app.test_client()
+    def tearDown(self):
+        main.storage_backend, main.analysis_cache, main.match_cache = self.saved
+
+    def test_view_analysis_cached(self):
+        """
+        Test that repeated views are rendered once and re-rendered when a file changes
+        """
+        first = self.client.get('/view-analysis').data
+        self.assertEqual(self.client.get('/view-analysis').data, first)
+        self.assertEqual(self.bucket.downloads, 2)
+
+        # Unchanged files are revalidated without downloading them again
+        self.clock.now += 120
+        self.client.get('/view-analysis')
+        self.assertEqual(self.bucket.downloads, 2)
+
+        self.bucket.put(main.analysis_file_names[0], json.dumps([]))
+        self.clock.now += 120
+        self.client.get('/view-analysis')
+        self.assertEqual(self.bucket.downloads, 4)
+        self.assertEqual(main.analysis_cache.stats()['misses'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
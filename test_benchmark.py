@@ -0,0 +1,44 @@
+# Note, run with -b flag to suppress output
+import unittest
+
+from benchmark import calibrate, compare_to_baseline, load_corpus, run_benchmarks
+
+class TestBenchmark(unittest.TestCase):
+    def test_load_corpus(self):
+        """
+        Test that the saved pages are split into match reports and schedules
+        """
+        corpus = load_corpus()
+        self.assertEqual(len(corpus['match_report']), 2)
+        self.assertEqual(len(corpus['schedule']), 1)
+    def test_run_benchmarks(self):
+        """
+        Test that every entry point reports throughput, stage times and peak memory
+        """
+        results = run_benchmarks(load_corpus(), repeat=1)
+        self.assertEqual(set(results), {'match_report', 'schedule'})
+        self.assertEqual(list(results['match_report']['StageMs']),
+                         ['unwrap', 'make_soup', 'parse_header', 'parse_players', 'parse_keepers'])
+        for result in results.values():
+            self.assertGreater(result['PagesPerSecond'], 0)
+            self.assertGreater(result['PeakMB'], 0)
+    def test_compare_to_baseline(self):
+        """
+        Test that only slowdowns and memory growth beyond the tolerance are regressions
+        """
+        baseline = {'schedule': {'PagesPerSecond': 10.0, 'PeakMB': 2.0}}
+        self.assertEqual(compare_to_baseline({'schedule': {'PagesPerSecond': 8.0, 'PeakMB': 2.4}}, baseline), [])
+        self.assertEqual(len(compare_to_baseline({'schedule': {'PagesPerSecond': 7.0, 'PeakMB': 2.6}}, baseline)), 2)
+        self.assertEqual(compare_to_baseline({'match_report': {'PagesPerSecond': 1.0, 'PeakMB': 9.0}}, baseline), [])
+    def test_compare_to_baseline_scaled(self):
+        """
+        Test that baseline throughput is scaled by the machine's calibration rate
+        """
+        baseline = {'schedule': {'PagesPerSecond': 10.0, 'PeakMB': 2.0}, 'Calibration': {'RunsPerSecond': 100.0}}
+        # Half as fast a machine only has to reach half the throughput
+        self.assertEqual(compare_to_baseline({'schedule': {'PagesPerSecond': 5.0, 'PeakMB': 2.0}}, baseline, calibration=50.0), [])
+        self.assertEqual(len(compare_to_baseline({'schedule': {'PagesPerSecond': 5.0, 'PeakMB': 2.0}}, baseline, calibration=100.0)), 1)
+        self.assertGreater(calibrate(1), 0)
+
+if __name__ == '__main__':
+    unittest.main()
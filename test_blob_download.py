@@ -0,0 +1,78 @@
+# Note, run with -b flag to suppress output
+import shutil
+import tempfile
+import unittest
+
+from blob_download import download_blobs
+from match_cache import MatchCache
+from test_match_manifest import FakeBucket
+
+class TestDownloadBlobs(unittest.TestCase):
+    def setUp(self):
+        self.bucket = FakeBucket()
+        self.bucket.put('a.json', '{"a": 1}')
+        self.bucket.put('b.json', '[2]')
+    def test_download_blobs_decodes(self):
+        """
+        Test that every object is downloaded, decoded and timed
+        """
+        contents, latencies = download_blobs(self.bucket, [('a.json', 1), ('b.json', None)])
+        self.assertEqual(contents, {'a.json': {'a': 1}, 'b.json': [2]})
+        self.assertEqual(set(latencies), {'a.json', 'b.json'})
+    def test_download_blobs_once_per_object(self):
+        """
+        Test that an object requested several times is downloaded once
+        """
+        download_blobs(self.bucket, [('a.json', 1), ('a.json', 1), ('b.json', 2)])
+        self.assertEqual(self.bucket.downloads, 2)
+    def test_download_blobs_missing(self):
+        """
+        Test that a missing object without a generation comes back as None
+        """
+        contents, latencies = download_blobs(self.bucket, [('missing.json', None)])
+        self.assertEqual(contents, {'missing.json': None})
+    def test_download_blobs_empty(self):
+        """
+        Test that nothing to download returns empty results
+        """
+        self.assertEqual(download_blobs(self.bucket, []), ({}, {}))
+    def test_download_blobs_with_cache(self):
+        """
+        Test that cached generations aren't downloaded again
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            cache = MatchCache(directory, 1024 * 1024)
+            download_blobs(self.bucket, [('a.json', 1), ('b.json', None)], cache=cache)
+            contents, latencies = download_blobs(self.bucket, [('a.json', 1), ('b.json', None)], cache=cache)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(contents, {'a.json': {'a': 1}, 'b.json': [2]})
+        self.assertEqual(self.bucket.downloads, 2)
+    def test_download_blobs_stale_generation(self):
+        """
+        Test that an object rewritten since its generation was recorded is read at its latest generation
+        """
+        stale = []
+        self.bucket.put('a.json', '{"a": 3}')
+        contents, latencies = download_blobs(self.bucket, [('a.json', 1), ('b.json', 2)], on_stale=stale.append)
+        self.assertEqual(contents, {'a.json': {'a': 3}, 'b.json': [2]})
+        self.assertEqual(len(stale), 1)
+        self.assertEqual(stale[0]['a.json'][0].generation, 3)
+        self.assertEqual(stale[0]['a.json'][1], {'a': 3})
+    def test_download_blobs_stale_generation_deleted(self):
+        """
+        Test that an object deleted since its generation was recorded comes back as None
+        """
+        self.bucket.delete('a.json')
+        contents, latencies = download_blobs(self.bucket, [('a.json', 1)])
+        self.assertEqual(contents, {'a.json': None})
+        directory = tempfile.mkdtemp()
+        try:
+            contents, latencies = download_blobs(self.bucket, [('a.json', 1)], cache=MatchCache(directory, 1024 * 1024))
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(contents, {'a.json': None})
+
+if __name__ == '__main__':
+    unittest.main()
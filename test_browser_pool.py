@@ -0,0 +1,178 @@
+# Note, run with -b flag to suppress output
+import asyncio
+import os
+import unittest
+
+import browser_pool
+from browser_pool import BrowserPool, read_process_tree_rss_mb, should_recycle
+
+class TestShouldRecycle(unittest.TestCase):
+    def test_should_recycle_under_limits(self):
+        """
+        Test that a browser under both limits is kept
+        """
+        self.assertFalse(should_recycle(10, 100, 200, 1024))
+    def test_should_recycle_too_many_pages(self):
+        """
+        Test that a browser is recycled once it has served max_pages
+        """
+        self.assertTrue(should_recycle(200, 100, 200, 1024))
+    def test_should_recycle_too_much_memory(self):
+        """
+        Test that a browser is recycled once it passes the RSS limit
+        """
+        self.assertTrue(should_recycle(10, 2048, 200, 1024))
+    def test_should_recycle_limits_disabled(self):
+        """
+        Test that a limit of 0 disables that recycle condition
+        """
+        self.assertFalse(should_recycle(5000, 5000, 0, 0))
+
+class TestReadProcessTreeRss(unittest.TestCase):
+    def test_read_process_tree_rss_current_process(self):
+        """
+        Test that the RSS of a running process is read as a positive number
+        """
+        if not os.path.exists('/proc/self/status'):
+            self.skipTest('procfs not available')
+        self.assertGreater(read_process_tree_rss_mb(os.getpid()), 0)
+    def test_read_process_tree_rss_missing_process(self):
+        """
+        Test that a process that doesn't exist reports 0
+        """
+        self.assertEqual(read_process_tree_rss_mb(-1), 0)
+
+class TestBrowserPoolClose(unittest.TestCase):
+    def test_close_unused_pool(self):
+        """
+        Test that closing a pool that never launched a browser is a no-op
+        """
+        pool = BrowserPool()
+        pool.close()
+        pool.close()
+    def test_get_page_after_close(self):
+        """
+        Test that a closed pool refuses new work
+        """
+        pool = BrowserPool()
+        pool.close()
+        self.assertRaises(RuntimeError, lambda: pool.get_page('http://fbref.com'))
+
+class FakeProcess:
+    def __init__(self, pid):
+        self.pid = pid
+        self.exit_code = None
+    def poll(self):
+        return self.exit_code
+
+class FakeTab:
+    def __init__(self, browser):
+        self.browser = browser
+        self.closed = False
+        self.urls = []
+    async def goto(self, url, options):
+        self.urls.append(url)
+        self.browser.open_navigations += 1
+        self.browser.max_open_navigations = max(self.browser.max_open_navigations, self.browser.open_navigations)
+        await asyncio.sleep(0.01)
+        self.browser.open_navigations -= 1
+    async def content(self):
+        return '<html>' + self.urls[-1] + '</html>'
+    def isClosed(self):
+        return self.closed
+    async def close(self):
+        self.closed = True
+
+class FakeBrowser:
+    def __init__(self, pid):
+        self.process = FakeProcess(pid)
+        self.tabs = []
+        self.closed = False
+        self.open_navigations = 0
+        self.max_open_navigations = 0
+    async def newPage(self):
+        tab = FakeTab(self)
+        self.tabs.append(tab)
+        return tab
+    async def version(self):
+        return 'HeadlessChrome'
+    async def close(self):
+        self.closed = True
+
+class TestBrowserPoolFetch(unittest.TestCase):
+    def setUp(self):
+        self.browsers = []
+        self.rss_mb = {}
+        async def fake_launch(options):
+            browser = FakeBrowser(len(self.browsers) + 1)
+            self.browsers.append(browser)
+            return browser
+        self.saved = (browser_pool.pyppeteer.launch, browser_pool.read_process_tree_rss_mb)
+        browser_pool.pyppeteer.launch = fake_launch
+        browser_pool.read_process_tree_rss_mb = lambda pid: self.rss_mb.get(pid, 100)
+    def tearDown(self):
+        browser_pool.pyppeteer.launch, browser_pool.read_process_tree_rss_mb = self.saved
+
+    def test_tabs_reused(self):
+        """
+        Test that one browser serves every page and at most max_tabs are open at once
+        """
+        pool = BrowserPool(max_tabs=2, max_pages=0, max_rss_mb=0)
+        try:
+            urls = ['http://fbref.com/%d' % i for i in range(6)]
+            async def fetch_all():
+                return await asyncio.gather(*[pool.fetch(url) for url in urls])
+            pages = pool.event_loop.run(fetch_all())
+            self.assertEqual(pages, ['<html>' + url + '</html>' for url in urls])
+            self.assertEqual(len(self.browsers), 1)
+            self.assertEqual(len(self.browsers[0].tabs), 2)
+            self.assertEqual(self.browsers[0].max_open_navigations, 2)
+            self.assertEqual(pool.pages_served, 6)
+        finally:
+            pool.close()
+        self.assertTrue(self.browsers[0].closed)
+    def test_recycled_after_max_pages(self):
+        """
+        Test that a browser is replaced once it has served max_pages
+        """
+        pool = BrowserPool(max_tabs=1, max_pages=2, max_rss_mb=0)
+        try:
+            for i in range(5):
+                pool.get_page('http://fbref.com/%d' % i)
+            self.assertEqual(len(self.browsers), 3)
+            self.assertEqual(pool.recycles, 2)
+            self.assertTrue(self.browsers[0].closed)
+            self.assertFalse(self.browsers[2].closed)
+        finally:
+            pool.close()
+    def test_recycled_over_rss_limit(self):
+        """
+        Test that a browser is replaced once its memory passes max_rss_mb
+        """
+        pool = BrowserPool(max_tabs=1, max_pages=0, max_rss_mb=1024)
+        try:
+            pool.get_page('http://fbref.com/a')
+            self.rss_mb[1] = 2048
+            pool.get_page('http://fbref.com/b')
+            self.assertEqual(len(self.browsers), 2)
+            self.assertEqual(pool.recycles, 1)
+            self.assertTrue(self.browsers[0].closed)
+        finally:
+            pool.close()
+    def test_unhealthy_browser_replaced(self):
+        """
+        Test that a browser whose process has exited is relaunched without counting as a recycle
+        """
+        pool = BrowserPool(max_tabs=1, max_pages=0, max_rss_mb=0)
+        try:
+            pool.get_page('http://fbref.com/a')
+            self.browsers[0].process.exit_code = 1
+            self.assertEqual(pool.get_page('http://fbref.com/b'), '<html>http://fbref.com/b</html>')
+            self.assertEqual(len(self.browsers), 2)
+            self.assertEqual(pool.launches, 2)
+            self.assertEqual(pool.recycles, 0)
+        finally:
+            pool.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,31 @@
 # Note, run with -b flag to suppress output
+import json
+import os
 import unittest
 
+from bs4 import BeautifulSoup
+
 import main
 from main import (ASSIGN_OR_RAISE, get_match_filename, match_is_valid,
-                print_run_statistics, extract_one_match_team)
+                print_run_statistics, extract_one_match_team,
+                unwrap_commented_tables, page_has_tables, match_report_tables,
+                parse_page_to_json, build_row_extractor, make_soup,
+                extract_team_names_from_links, parse_schedule,
+                team_name_from_squad_link,
+                store_match_json, get_matches_for_dates)
+from match_cache import MatchCache
+from match_manifest import build_manifest_entry, load_manifest, update_manifest
+from test_match_manifest import FakeBucket
+
+test_data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data')
+
+def load_test_page(name):
+    with open(os.path.join(test_data_dir, name)) as page_file:
+        return unwrap_commented_tables(page_file.read())
+
+def load_test_json(name):
+    with open(os.path.join(test_data_dir, name)) as json_file:
+        return json.load(json_file)
 
 class TestAssignOrRaise(unittest.TestCase):
     def test_assign_or_raise_with_none(self):
@@ -273,5 +295,256 @@ class TestExtractOneMatchTeam(unittest.TestCase):
         new_json = extract_one_match_team(self.match, self.match['AwayStats']['Team'])
         self.assertIsNone(new_json)
 
+class TestUnwrapCommentedTables(unittest.TestCase):
+    def test_unwrap_commented_table(self):
+        """
+        Test that a table hidden in an HTML comment is uncommented
+        """
+        page = '<div><!--\n<table id="stats_a_misc"></table>\n--></div>'
+        self.assertEqual(unwrap_commented_tables(page), '<div>\n<table id="stats_a_misc"></table>\n</div>')
+    def test_unwrap_leaves_other_comments(self):
+        """
+        Test that comments without tables are left alone
+        """
+        page = '<div><!-- ad slot --><table id="x"></table></div>'
+        self.assertEqual(unwrap_commented_tables(page), page)
+
+class TestPageHasTables(unittest.TestCase):
+    def setUp(self):
+        self.page = ('<table class="stats" id="stats_18bb7c10_summary"></table>'
+                     '<table id="stats_18bb7c10_misc"></table>'
+                     '<table id="stats_18bb7c10_passing"></table>'
+                     '<table id="stats_18bb7c10_passing_types"></table>'
+                     '<table id="keeper_stats_18bb7c10"></table>')
+    def test_page_has_tables_with_all_tables(self):
+        """
+        Test that a page with every match report table is accepted
+        """
+        self.assertTrue(page_has_tables(self.page, match_report_tables))
+    def test_page_has_tables_with_missing_table(self):
+        """
+        Test that a page missing the keeper table is rejected
+        """
+        page = self.page.replace('keeper_stats_18bb7c10', 'other')
+        self.assertFalse(page_has_tables(page, match_report_tables))
+    def test_page_has_tables_only_passing_types(self):
+        """
+        Test that the passing_types table doesn't count as the passing table
+        """
+        page = self.page.replace('"stats_18bb7c10_passing"', '"other"')
+        self.assertFalse(page_has_tables(page, match_report_tables))
+
+class TestParsePageToJson(unittest.TestCase):
+    def test_parse_page_to_json_match_report(self):
+        """
+        Test that a saved match report parses to the expected match JSON
+        """
+        soup = BeautifulSoup(load_test_page('match_report.html'), 'html.parser')
+        self.assertEqual(parse_page_to_json(soup), load_test_json('match_report.json'))
+    def test_parse_page_to_json_draw(self):
+        """
+        Test that a saved match report for a draw parses to the expected JSON
+        """
+        soup = BeautifulSoup(load_test_page('match_report_draw.html'), 'html.parser')
+        match = parse_page_to_json(soup)
+        self.assertEqual(match, load_test_json('match_report_draw.json'))
+        self.assertTrue(match_is_valid(match))
+
+class TestBuildRowExtractor(unittest.TestCase):
+    def setUp(self):
+        self.extract = build_row_extractor([
+            ('summary', 'goals', 'Gls', int),
+            ('misc', 'fouls', 'Fls', int),
+            ('summary', 'xg', 'xG', float)
+        ])
+    def test_row_extractor_converts_types(self):
+        """
+        Test that each column is read from its source and converted
+        """
+        player = self.extract({'summary': {'goals': '2', 'xg': '0.7'}, 'misc': {'fouls': '1'}}, {})
+        self.assertEqual(player, {'Gls': 2, 'Fls': 1, 'xG': 0.7})
+    def test_row_extractor_skips_missing(self):
+        """
+        Test that stats missing from a row are left out of the player
+        """
+        player = self.extract({'summary': {'goals': '1'}, 'misc': {}}, {'Name': 'A'})
+        self.assertEqual(player, {'Name': 'A', 'Gls': 1})
+    def test_row_extractor_bad_value(self):
+        """
+        Test that a stat that can't be converted raises, like the old parser
+        """
+        self.assertRaises(ValueError, lambda: self.extract({'summary': {'goals': ''}, 'misc': {}}, {}))
+
+class TestParserBackendParity(unittest.TestCase):
+    backends = ['html.parser', 'lxml', 'html5lib']
+
+    def setUp(self):
+        self.default_backend = main.html_parser
+    def tearDown(self):
+        main.html_parser = self.default_backend
+
+    def available_backends(self):
+        for backend in self.backends:
+            try:
+                BeautifulSoup('<p></p>', backend)
+            except Exception:
+                continue
+            yield backend
+
+    def test_match_json_identical_across_backends(self):
+        """
+        Test that every installed parser backend produces the same match JSON
+        """
+        for name in ['match_report', 'match_report_draw']:
+            page = load_test_page(name + '.html')
+            expected = load_test_json(name + '.json')
+            for backend in self.available_backends():
+                with self.subTest(page=name, backend=backend):
+                    main.html_parser = backend
+                    self.assertEqual(json.dumps(parse_page_to_json(make_soup(page))), json.dumps(expected))
+    def test_schedule_teams_identical_across_backends(self):
+        """
+        Test that every installed parser backend finds the same fixtures
+        """
+        page = load_test_page('schedule.html')
+        results = {}
+        for backend in self.available_backends():
+            main.html_parser = backend
+            soup = make_soup(page)
+            results[backend] = [extract_team_names_from_links(td.parent) for td in soup.find_all('td', {'data-stat': 'squad_a'})]
+        self.assertEqual(len(results['html.parser']), 380)
+        for backend, fixtures in results.items():
+            with self.subTest(backend=backend):
+                self.assertEqual(fixtures, results['html.parser'])
+    def test_make_soup_missing_backend(self):
+        """
+        Test that an unavailable backend falls back to html.parser
+        """
+        main.html_parser = 'not-a-parser'
+        soup = make_soup('<p>text</p>')
+        self.assertEqual(soup.find('p').text, 'text')
+
+class TestParseSchedule(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.page = load_test_page('schedule.html')
+        cls.fixtures = parse_schedule(cls.page)
+    def test_parse_schedule_all_fixtures(self):
+        """
+        Test that every match row is returned and spacer rows are skipped
+        """
+        self.assertEqual(len(self.fixtures), 380)
+    def test_parse_schedule_first_fixture(self):
+        """
+        Test that a fixture record holds the date, csk, teams and report link
+        """
+        self.assertEqual(self.fixtures[0], {
+            'Date': '2020-09-12',
+            'Csk': '20200912',
+            'HomeTeam': 'Sheffield United',
+            'AwayTeam': 'Chelsea',
+            'ReportUrl': 'http://fbref.com/en/matches/e74c00f4/Sheffield-United-Chelsea-September-12-2020-Premier-League'
+        })
+    def test_parse_schedule_unplayed_fixture(self):
+        """
+        Test that fixtures without a match report have no report URL
+        """
+        self.assertIsNone(self.fixtures[-1]['ReportUrl'])
+        self.assertEqual(len([f for f in self.fixtures if f['ReportUrl'] is not None]), 180)
+    def test_parse_schedule_matches_soup(self):
+        """
+        Test that the streaming scan finds the same teams as the soup parser
+        """
+        soup = make_soup(self.page)
+        rows = soup.find('caption').parent.find('tbody').find_all('tr', {'class': None})
+        expected = [extract_team_names_from_links(row) for row in rows]
+        self.assertEqual([[f['HomeTeam'], f['AwayTeam']] for f in self.fixtures], expected)
+    def test_parse_schedule_no_table(self):
+        """
+        Test that a page without a fixtures table raises
+        """
+        self.assertRaises(ValueError, lambda: parse_schedule('<html><body><p>Blocked</p></body></html>'))
+
+class TestTeamNameFromSquadLink(unittest.TestCase):
+    def test_team_name_with_and(self):
+        """
+        Test that squad links are converted to stored team names
+        """
+        self.assertEqual(team_name_from_squad_link('/en/squads/cd051869/Brighton-and-Hove-Albion-Stats'), 'Brighton & Hove Albion')
+    def test_team_name_bad_link(self):
+        """
+        Test that a link that isn't a squad link raises
+        """
+        self.assertRaises(ValueError, lambda: team_name_from_squad_link('/en/players/1234/Someone'))
+
+class TestStoreMatchJson(unittest.TestCase):
+    def test_store_match_json_already_known(self):
+        """
+        Test that a match already in the known set isn't uploaded again
+        """
+        match = load_test_json('match_report.json')
+        known = {'05Jan2021_Arsenal_vs_Chelsea.json'}
+        self.assertRaises(NameError, lambda: store_match_json(match, known))
+
+class TestCollectMatchJson(unittest.TestCase):
+    def setUp(self):
+        async def fake_get_page_content(url, required_tables, cache_counts=None):
+            return '<html><body><p>Blocked</p></body></html>'
+        self.saved = main.get_page_content
+        main.get_page_content = fake_get_page_content
+    def tearDown(self):
+        main.get_page_content = self.saved
+
+    def test_collect_match_json_bad_page(self):
+        """
+        Test that a match page that can't be parsed fails the match instead of raising
+        """
+        url = 'http://fbref.com/en/matches/abc/Arsenal-Chelsea-January-5-2021-Premier-League'
+        self.assertEqual(main.event_loop.run(main.collect_match_json(url)), 'Error parsing match content from URL')
+
+class TestGetMatchesForDates(unittest.TestCase):
+    def setUp(self):
+        self.bucket = FakeBucket()
+        match = load_test_json('match_report.json')
+        file_name = get_match_filename(match['Date'], match['HomeStats']['Team'], match['AwayStats']['Team'])
+        stored = self.bucket.put(file_name, json.dumps(match))
+        update_manifest(self.bucket, [build_manifest_entry(file_name, match, stored.generation, stored.size)])
+
+        self.bucket.downloads = 0
+        self.page_requests = []
+        async def fake_get_page_content(url, required_tables, cache_counts=None):
+            self.page_requests.append(url)
+            return load_test_page('schedule.html')
+        self.saved = (main.get_page_content, main.match_cache)
+        main.get_page_content = fake_get_page_content
+        main.match_cache = MatchCache('', 0)
+    def tearDown(self):
+        main.get_page_content, main.match_cache = self.saved
+
+    def test_get_matches_for_dates(self):
+        """
+        Test that matchups for several dates come from one fixtures page fetch
+        """
+        matches_by_date = main.event_loop.run(get_matches_for_dates(['20200912', '20200913', '20200101'], self.bucket))
+        self.assertEqual(len(self.page_requests), 1)
+        self.assertEqual([len(matches_by_date[date]) for date in ['20200912', '20200913', '20200101']], [4, 3, 0])
+        first = matches_by_date['20200912'][0]
+        self.assertEqual(first['HomeTeam']['Name'], 'Sheffield United')
+        self.assertEqual(first['HomeTeam']['PastMatches'], [])
+        self.assertEqual(len(first['AwayTeam']['PastMatches']), 1)
+        self.assertEqual(first['AwayTeam']['PastMatches'][0]['Opponent'], 'Arsenal')
+        self.assertEqual(first['AwayTeam']['PastMatches'][0]['Result'], 'Loss')
+        # The manifest and the one stored match
+        self.assertEqual(self.bucket.downloads, 2)
+    def test_get_matches_for_dates_stale_manifest(self):
+        """
+        Test that a match rewritten without updating the manifest is still read, and its entry refreshed
+        """
+        file_name = '05Jan2021_Arsenal_vs_Chelsea.json'
+        stored = self.bucket.put(file_name, self.bucket.get(file_name))
+        matches_by_date = main.event_loop.run(get_matches_for_dates(['20200912'], self.bucket))
+        self.assertEqual(len(matches_by_date['20200912'][0]['AwayTeam']['PastMatches']), 1)
+        self.assertEqual(load_manifest(self.bucket)['Matches'][file_name]['Generation'], stored.generation)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
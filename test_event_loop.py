@@ -0,0 +1,50 @@
+# Note, run with -b flag to suppress output
+import asyncio
+import threading
+import unittest
+
+from event_loop import EventLoop
+
+class TestEventLoop(unittest.TestCase):
+    def setUp(self):
+        self.event_loop = EventLoop('test-event-loop', blocking_workers=2)
+    def tearDown(self):
+        self.event_loop.close()
+
+    def test_run_coroutine(self):
+        """
+        Test that coroutines from different calls run on the same loop thread
+        """
+        async def current_thread():
+            return threading.current_thread().name
+        self.assertEqual(self.event_loop.run(current_thread()), 'test-event-loop')
+        self.assertEqual(self.event_loop.submit(current_thread()).result(), 'test-event-loop')
+    def test_blocking_calls_use_executor(self):
+        """
+        Test that blocking calls awaited with to_thread run on the loop's executor
+        """
+        async def blocking_thread():
+            return await asyncio.to_thread(lambda: threading.current_thread().name)
+        self.assertTrue(self.event_loop.run(blocking_thread()).startswith('test-event-loop-blocking'))
+    def test_run_from_loop_thread(self):
+        """
+        Test that waiting on the loop from its own thread is refused
+        """
+        async def nested():
+            async def inner():
+                return 1
+            self.event_loop.run(inner())
+        self.assertRaises(RuntimeError, lambda: self.event_loop.run(nested()))
+    def test_run_after_close(self):
+        """
+        Test that a closed loop refuses new work
+        """
+        async def noop():
+            pass
+        self.event_loop.run(noop())
+        self.event_loop.close()
+        self.assertFalse(self.event_loop._thread.is_alive())
+        self.assertRaises(RuntimeError, lambda: self.event_loop.run(noop()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,252 @@
+# Note, run with -b flag to suppress output
+import asyncio
+import concurrent.futures
+import threading
+import unittest
+
+import main
+from event_loop import EventLoop
+from jobs import JobQueue, to_thread
+from test_epl_parser import load_test_page
+from test_match_manifest import FakeBucket
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.event_loop = EventLoop('test-jobs')
+        self.queue = JobQueue(self.event_loop, finished_jobs_kept=2)
+    def tearDown(self):
+        self.event_loop.close()
+
+    def test_job_succeeds(self):
+        """
+        Test that a job's progress and result are recorded
+        """
+        async def run(job):
+            job.progress['done'] = 1
+            return 'result'
+        job, created = self.queue.submit('test', run)
+        self.assertTrue(created)
+        job.future.result(5)
+        self.assertEqual(job.describe()['Status'], 'succeeded')
+        self.assertEqual(job.describe()['Progress'], {'done': 1})
+        self.assertEqual(job.result, 'result')
+        self.assertIs(self.queue.get(job.id), job)
+    def test_job_fails(self):
+        """
+        Test that an exception fails the job with its message
+        """
+        async def run(job):
+            raise ValueError('Error parsing page')
+        job, created = self.queue.submit('test', run)
+        self.assertRaises(ValueError, lambda: job.future.result(5))
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.error, 'Error parsing page')
+    def test_duplicate_key(self):
+        """
+        Test that a job with the key of a running job returns the running job
+        """
+        async def make_event():
+            return asyncio.Event()
+        release = self.event_loop.run(make_event())
+        async def run(job):
+            await release.wait()
+        first, created = self.queue.submit('test', run, key='crawl')
+        second, second_created = self.queue.submit('test', run, key='crawl')
+        self.assertIs(second, first)
+        self.assertFalse(second_created)
+        async def set_event():
+            release.set()
+        self.event_loop.run(set_event())
+        first.future.result(5)
+        third, third_created = self.queue.submit('test', run, key='crawl')
+        self.assertTrue(third_created)
+        third.future.result(5)
+    def test_cancel(self):
+        """
+        Test that a running job can be cancelled, and lets another job with its key start
+        """
+        started = []
+        async def run(job):
+            started.append(job.id)
+            await asyncio.sleep(60)
+        job, created = self.queue.submit('test', run, key='crawl')
+        while not started:
+            self.event_loop.run(asyncio.sleep(0.01))
+        self.assertTrue(self.queue.cancel(job.id))
+        self.assertFalse(self.queue.cancel(job.id))
+        self.assertRaises(concurrent.futures.CancelledError, lambda: job.future.result(5))
+        self.assertEqual(job.status, 'cancelled')
+        self.assertFalse(self.queue.cancel(job.id))
+        self.assertFalse(self.queue.cancel('missing'))
+        self.assertTrue(self.queue.submit('test', run, key='crawl')[1])
+    def test_cancel_waits_for_threads(self):
+        """
+        Test that a cancelled job keeps its key until its blocking calls have returned
+        """
+        started = threading.Event()
+        release = threading.Event()
+        def write():
+            started.set()
+            release.wait(5)
+            return 'written'
+        async def run(job):
+            return await to_thread(write)
+        job, created = self.queue.submit('test', run, key='crawl')
+        self.assertTrue(started.wait(5))
+        self.assertTrue(self.queue.cancel(job.id))
+        self.event_loop.run(asyncio.sleep(0.05))
+        self.assertEqual(job.status, 'cancelling')
+        self.assertIs(self.queue.submit('test', run, key='crawl')[0], job)
+        release.set()
+        self.assertRaises(concurrent.futures.CancelledError, lambda: job.future.result(5))
+        self.assertEqual(job.status, 'cancelled')
+        self.assertTrue(self.queue.submit('test', run, key='crawl')[1])
+    def test_cancel_before_start(self):
+        """
+        Test that a job cancelled before it starts never runs
+        """
+        started = []
+        async def run(job):
+            started.append(job.id)
+        # Hold the loop so the job can't start before it is cancelled
+        blocked = threading.Event()
+        self.event_loop.call_soon(blocked.wait, 5)
+        job, created = self.queue.submit('test', run, key='crawl')
+        self.assertTrue(self.queue.cancel(job.id))
+        blocked.set()
+        self.assertRaises(concurrent.futures.CancelledError, lambda: job.future.result(5))
+        self.assertEqual(job.status, 'cancelled')
+        self.assertEqual(started, [])
+    def test_submit_fails(self):
+        """
+        Test that a job that can't be scheduled fails and frees its key
+        """
+        async def run(job):
+            pass
+        self.event_loop.close()
+        self.assertRaises(RuntimeError, lambda: self.queue.submit('test', run, key='crawl'))
+        self.assertEqual(self.queue._active, {})
+    def test_finished_jobs_pruned(self):
+        """
+        Test that only the newest finished jobs are kept
+        """
+        async def run(job):
+            pass
+        jobs = []
+        for i in range(4):
+            job, created = self.queue.submit('test', run)
+            job.future.result(5)
+            jobs.append(job)
+        self.assertIsNone(self.queue.get(jobs[0].id))
+        self.assertIsNotNone(self.queue.get(jobs[3].id))
+
+class TestFindMatchesJob(unittest.TestCase):
+    def setUp(self):
+        self.collected = []
+        async def fake_get_page_content(url, required_tables, cache_counts=None):
+            return load_test_page('schedule.html')
+        async def fake_collect_match_json(url, known_match_files=None, cache_counts=None, stored_matches=None):
+            self.collected.append(url)
+            stored_matches.append((url, {}))
+            return {}
+        self.season_store_updates = []
+        def fake_update_season_store(bucket, matches):
+            self.season_store_updates.append(list(matches))
+        self.saved = (main.get_page_content, main.collect_match_json, main.storage_backend, main.job_queue,
+                      main.update_season_store)
+        main.get_page_content = fake_get_page_content
+        main.collect_match_json = fake_collect_match_json
+        main.storage_backend = FakeBucket()
+        main.job_queue = JobQueue(main.event_loop)
+        main.update_season_store = fake_update_season_store
+    def tearDown(self):
+        (main.get_page_content, main.collect_match_json, main.storage_backend, main.job_queue,
+         main.update_season_store) = self.saved
+
+    def test_find_matches_job(self):
+        """
+        Test that /findmatches starts a crawl in the background and /jobs reports it
+        """
+        client = main.app.test_client()
+        response = client.get('/forcefindmatches')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()['Id']
+        main.job_queue.get(job_id).future.result(5)
+
+        status = client.get(response.get_json()['Url']).get_json()
+        self.assertEqual(status['Status'], 'succeeded')
+        self.assertGreater(len(self.collected), 0)
+        self.assertEqual(status['Progress']['new'], len(self.collected))
+        self.assertEqual(status['Progress']['collected'], len(self.collected))
+        self.assertEqual(status['Progress']['total'], status['Progress']['new'] + status['Progress']['skipped'])
+        self.assertEqual(client.get('/jobs/missing').status_code, 404)
+        # Every stored match goes into the season store in one update
+        self.assertEqual(self.season_store_updates, [[(url, {}) for url in self.collected]])
+    def slow_collection(self, failing_url=None):
+        async def fake_collect_match_json(url, known_match_files=None, cache_counts=None, stored_matches=None):
+            if url == failing_url:
+                raise ValueError('Error parsing page')
+            await asyncio.sleep(0.02)
+            # The fetch and store, in a thread like the real ones
+            await main.run_stage('store', lambda: (self.collected.append(url), stored_matches.append((url, {}))))
+            return {}
+        main.collect_match_json = fake_collect_match_json
+    def test_find_matches_job_page_fails(self):
+        """
+        Test that a match failing unexpectedly counts as failed, and nothing runs after the crawl ends
+        """
+        fixtures = main.parse_schedule(load_test_page('schedule.html'))
+        self.slow_collection(next(fixture['ReportUrl'] for fixture in fixtures if fixture['ReportUrl'] is not None))
+        job, created = main.job_queue.submit('findmatches', lambda job: main.run_find_matches_job(True, job.progress), key='findmatches')
+        job.future.result(5)
+        collected = len(self.collected)
+        self.event_loop_sleep(0.1)
+        self.assertEqual(len(self.collected), collected)
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(job.progress['failed'], 1)
+        self.assertEqual(job.progress['collected'], job.progress['new'] - 1)
+        self.assertEqual(self.season_store_updates, [[(url, {}) for url in self.collected]])
+    def test_find_matches_job_cancelled(self):
+        """
+        Test that a cancelled crawl stops every collection before it ends, and saves what it stored
+        """
+        self.slow_collection()
+        job, created = main.job_queue.submit('findmatches', lambda job: main.run_find_matches_job(True, job.progress), key='findmatches')
+        while not self.collected:
+            self.event_loop_sleep(0.01)
+        main.job_queue.cancel(job.id)
+        self.assertRaises(concurrent.futures.CancelledError, lambda: job.future.result(5))
+        collected = len(self.collected)
+        self.event_loop_sleep(0.1)
+        self.assertEqual(len(self.collected), collected)
+        self.assertLess(collected, job.progress['new'])
+        self.assertEqual(self.season_store_updates, [[(url, {}) for url in self.collected]])
+    def event_loop_sleep(self, seconds):
+        main.event_loop.run(asyncio.sleep(seconds))
+
+class TestRunAnalysisJob(unittest.TestCase):
+    def setUp(self):
+        self.requested_dates = []
+        async def fake_get_matches_for_dates(dates, bucket):
+            self.requested_dates.extend(dates)
+            return {date: [] for date in dates}
+        self.saved = (main.get_matches_for_dates, main.storage_backend, main.job_queue)
+        main.get_matches_for_dates = fake_get_matches_for_dates
+        main.storage_backend = FakeBucket()
+        main.job_queue = JobQueue(main.event_loop)
+    def tearDown(self):
+        main.get_matches_for_dates, main.storage_backend, main.job_queue = self.saved
+
+    def test_days_clamped(self):
+        """
+        Test that the analysis horizon is kept between 2 days and max_analysis_days
+        """
+        client = main.app.test_client()
+        for days, expected in [('100000', main.max_analysis_days), ('0', 2)]:
+            response = client.get('/run-analysis?days=' + days)
+            job = main.job_queue.get(response.get_json()['Id'])
+            self.assertEqual(job.future.result(5), 'Success running analysis')
+            self.assertEqual(job.progress['days'], expected)
+
+if __name__ == '__main__':
+    unittest.main()
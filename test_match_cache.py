@@ -0,0 +1,68 @@
+# Note, run with -b flag to suppress output
+import os
+import shutil
+import tempfile
+import unittest
+
+from match_cache import MatchCache
+
+class TestMatchCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = MatchCache(self.directory, 1024)
+        self.loads = []
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def loader(self, data):
+        def load():
+            self.loads.append(data)
+            return data
+        return load
+
+    def test_cache_read_through(self):
+        """
+        Test that an object generation is only loaded once
+        """
+        self.assertEqual(self.cache.get_or_load('a.json', 1, self.loader(b'{"a": 1}')), b'{"a": 1}')
+        self.assertEqual(self.cache.get_or_load('a.json', 1, self.loader(b'{"a": 1}')), b'{"a": 1}')
+        self.assertEqual(len(self.loads), 1)
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1, 'evictions': 0})
+    def test_cache_new_generation(self):
+        """
+        Test that a new generation of an object isn't served from the old entry
+        """
+        self.cache.get_or_load('a.json', 1, self.loader(b'old'))
+        self.assertEqual(self.cache.get_or_load('a.json', 2, self.loader(b'new')), b'new')
+    def test_cache_no_generation(self):
+        """
+        Test that objects without a known generation are never cached
+        """
+        self.cache.get_or_load('a.json', None, self.loader(b'x'))
+        self.cache.get_or_load('a.json', None, self.loader(b'x'))
+        self.assertEqual(len(self.loads), 2)
+    def test_cache_evicts_least_recently_used(self):
+        """
+        Test that the oldest entries are evicted once the cache is over its size
+        """
+        for generation in range(1, 3):
+            self.cache.put('a.json', generation, b'x' * 400)
+            path = self.cache._path('a.json', generation)
+            os.utime(path, (generation, generation))
+        self.cache.get('a.json', 1)
+        self.cache.put('a.json', 3, b'x' * 400)
+        self.assertIsNotNone(self.cache.get('a.json', 1))
+        self.assertIsNone(self.cache.get('a.json', 2))
+        self.assertIsNotNone(self.cache.get('a.json', 3))
+        self.assertLessEqual(sum(os.path.getsize(os.path.join(self.directory, name)) for name in os.listdir(self.directory)), 1024)
+    def test_cache_disabled(self):
+        """
+        Test that a cache with no space always loads
+        """
+        cache = MatchCache(self.directory, 0)
+        cache.get_or_load('a.json', 1, self.loader(b'x'))
+        cache.get_or_load('a.json', 1, self.loader(b'x'))
+        self.assertEqual(len(self.loads), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+# Note, run with -b flag to suppress output
+import json
+import unittest
+
+import match_manifest
+from match_manifest import (build_manifest_entry, build_team_index, load_manifest, manifest_file_name,
+                            parse_match_filename, sorted_entries, update_manifest)
+from storage_backend import PreconditionFailed, StorageBackend, StoredObject
+
+# In-memory storage backend with generations like GCS, counting uploads and
+# downloads
+class FakeBucket(StorageBackend):
+    def __init__(self):
+        self.objects = {}
+        self.next_generation = 1
+        self.uploads = 0
+        self.downloads = 0
+
+    def stat(self, name):
+        if name not in self.objects:
+            return None
+        data, generation = self.objects[name]
+        return StoredObject(name, generation, len(data))
+
+    def get(self, name, generation=None):
+        data, stored = self.get_object(name)
+        if stored is not None and generation is not None and stored.generation != generation:
+            raise PreconditionFailed(name)
+        return data
+
+    def get_object(self, name):
+        if name not in self.objects:
+            return None, None
+        self.downloads += 1
+        data, generation = self.objects[name]
+        return data, StoredObject(name, generation, len(data))
+
+    def put(self, name, data, content_type=None, if_generation_match=None):
+        current = self.objects.get(name, (None, 0))[1]
+        if if_generation_match is not None and if_generation_match != current:
+            raise PreconditionFailed(name)
+        if isinstance(data, str):
+            data = data.encode()
+        generation = self.next_generation
+        self.next_generation += 1
+        self.objects[name] = (data, generation)
+        self.uploads += 1
+        return StoredObject(name, generation, len(data))
+
+    def list(self, prefix=''):
+        return [self.stat(name) for name in sorted(self.objects) if name.startswith(prefix)]
+
+    def delete(self, name):
+        return self.objects.pop(name, None) is not None
+
+class TestParseMatchFilename(unittest.TestCase):
+    def test_parse_match_filename(self):
+        """
+        Test that a match filename is split into date and team names
+        """
+        self.assertEqual(parse_match_filename('05Jan2021_Brighton_&_Hove_Albion_vs_Chelsea.json'),
+                         ['2021-01-05', 'Brighton & Hove Albion', 'Chelsea'])
+    def test_parse_match_filename_not_a_match(self):
+        """
+        Test that analysis files and other objects aren't treated as matches
+        """
+        self.assertIsNone(parse_match_filename('todays_analysis.json'))
+        self.assertIsNone(parse_match_filename(manifest_file_name))
+        self.assertIsNone(parse_match_filename('05Jan2021_Arsenal_vs_Chelsea.html.gz'))
+
+class TestMatchManifest(unittest.TestCase):
+    def setUp(self):
+        self.bucket = FakeBucket()
+        self.match = {
+            'Date': 'Tuesday January 05, 2021',
+            'HomeStats': {'Team': 'Arsenal', 'Goals': 2},
+            'AwayStats': {'Team': 'Chelsea', 'Goals': 1}
+        }
+
+    def test_load_manifest_rebuilds_from_listing(self):
+        """
+        Test that a missing manifest is built from the bucket listing and stored
+        """
+        self.bucket.put('03Jan2021_TeamA_vs_TeamB.json', '{}')
+        self.bucket.put('todays_analysis.json', '[]')
+        manifest = load_manifest(self.bucket)
+        self.assertEqual(list(manifest['Matches']), ['03Jan2021_TeamA_vs_TeamB.json'])
+        self.assertEqual(manifest['Matches']['03Jan2021_TeamA_vs_TeamB.json']['Generation'], 1)
+        self.assertIsNotNone(self.bucket.stat(manifest_file_name))
+    def test_update_manifest_adds_entry(self):
+        """
+        Test that stored matches are added to the manifest with their score
+        """
+        entry = build_manifest_entry('05Jan2021_Arsenal_vs_Chelsea.json', self.match, 7, 1234)
+        update_manifest(self.bucket, [entry])
+        manifest = load_manifest(self.bucket)
+        self.assertEqual(manifest['Matches']['05Jan2021_Arsenal_vs_Chelsea.json'], {
+            'Name': '05Jan2021_Arsenal_vs_Chelsea.json', 'Date': '2021-01-05',
+            'HomeTeam': 'Arsenal', 'AwayTeam': 'Chelsea', 'HomeGoals': 2, 'AwayGoals': 1,
+            'Generation': 7, 'Size': 1234
+        })
+    def test_update_manifest_retries_on_conflict(self):
+        """
+        Test that an update racing another writer is retried, keeping both entries
+        """
+        update_manifest(self.bucket, [])
+        original_write = match_manifest.write_manifest
+        calls = []
+        def racing_write(bucket, manifest, generation):
+            if not calls:
+                calls.append(1)
+                other = json.loads(bucket.objects[manifest_file_name][0])
+                other['Matches']['other.json'] = {'Name': 'other.json', 'Date': '2021-01-01'}
+                bucket.put(manifest_file_name, json.dumps(other))
+            return original_write(bucket, manifest, generation)
+        match_manifest.write_manifest = racing_write
+        original_delay = match_manifest.retry_delay
+        match_manifest.retry_delay = lambda attempt: 0
+        try:
+            entry = build_manifest_entry('05Jan2021_Arsenal_vs_Chelsea.json', self.match)
+            update_manifest(self.bucket, [entry])
+        finally:
+            match_manifest.write_manifest = original_write
+            match_manifest.retry_delay = original_delay
+        self.assertEqual(set(load_manifest(self.bucket)['Matches']), {'other.json', '05Jan2021_Arsenal_vs_Chelsea.json'})
+    def test_sorted_entries(self):
+        """
+        Test that entries are returned most recent first
+        """
+        manifest = {'Matches': {
+            'a': {'Name': 'a', 'Date': '2021-01-05'},
+            'b': {'Name': 'b', 'Date': '2021-03-01'},
+            'c': {'Name': 'c', 'Date': '2020-12-26'}
+        }}
+        self.assertEqual([entry['Name'] for entry in sorted_entries(manifest)], ['b', 'a', 'c'])
+
+class TestBuildTeamIndex(unittest.TestCase):
+    def test_build_team_index(self):
+        """
+        Test that each team maps to its own matches, most recent first
+        """
+        manifest = {'Matches': {
+            'a': {'Name': 'a', 'Date': '2021-01-05', 'HomeTeam': 'Arsenal', 'AwayTeam': 'Chelsea'},
+            'b': {'Name': 'b', 'Date': '2021-03-01', 'HomeTeam': 'Chelsea', 'AwayTeam': 'Everton'},
+            'c': {'Name': 'c', 'Date': '2020-12-26', 'HomeTeam': 'Everton', 'AwayTeam': 'Arsenal'}
+        }}
+        team_index = build_team_index(manifest)
+        self.assertEqual([entry['Name'] for entry in team_index['Arsenal']], ['a', 'c'])
+        self.assertEqual([entry['Name'] for entry in team_index['Chelsea']], ['b', 'a'])
+        self.assertEqual([entry['Name'] for entry in team_index['Everton']], ['b', 'c'])
+        self.assertNotIn('Fulham', team_index)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# Note, run with -b flag to suppress output
+import unittest
+
+import main
+from metrics import Registry, stage_errors, stage_seconds, timed_stage
+from test_epl_parser import load_test_page
+
+class TestMetrics(unittest.TestCase):
+    def test_counter_render(self):
+        """
+        Test that counters render one sample per label set
+        """
+        registry = Registry()
+        counter = registry.counter('test_events_total', 'Events', ['kind'])
+        counter.inc(kind='a')
+        counter.inc(2, kind='b"c')
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP test_events_total Events',
+            '# TYPE test_events_total counter',
+            'test_events_total{kind="a"} 1',
+            'test_events_total{kind="b\\"c"} 2',
+        ]) + '\n')
+    def test_histogram_buckets_are_cumulative(self):
+        """
+        Test that histogram buckets count every observation at or below their bound
+        """
+        registry = Registry()
+        histogram = registry.histogram('test_seconds', 'Latency', buckets=(0.1, 1))
+        for value in [0.05, 0.1, 0.5, 3]:
+            histogram.observe(value)
+        lines = registry.render().splitlines()
+        self.assertEqual(lines[2:], [
+            'test_seconds_bucket{le="0.1"} 2',
+            'test_seconds_bucket{le="1"} 3',
+            'test_seconds_bucket{le="+Inf"} 4',
+            'test_seconds_sum 3.65',
+            'test_seconds_count 4',
+        ])
+    def test_timed_stage_counts_errors(self):
+        """
+        Test that a stage is timed whether or not it raises, and failures are counted
+        """
+        count = stage_seconds.count(stage='test_stage')
+        errors = stage_errors.value(stage='test_stage')
+        with timed_stage('test_stage'):
+            pass
+        with self.assertRaises(ValueError):
+            with timed_stage('test_stage'):
+                raise ValueError('failed')
+        self.assertEqual(stage_seconds.count(stage='test_stage'), count + 2)
+        self.assertEqual(stage_errors.value(stage='test_stage'), errors + 1)
+
+class TestMetricsEndpoint(unittest.TestCase):
+    def test_metrics_endpoint(self):
+        """
+        Test that parse stages and endpoint latencies are exposed at /metrics
+        """
+        main.parse_page_to_json(main.make_soup(load_test_page('match_report.html')))
+        client = main.app.test_client()
+        client.get('/')
+        response = client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        body = response.get_data(as_text=True)
+        for stage in ['parse_header', 'parse_players', 'parse_keepers']:
+            self.assertIn('epl_stage_seconds_count{stage="%s"}' % stage, body)
+        self.assertIn('epl_request_seconds_count{endpoint="/",method="GET",status="200"}', body)
+
+if __name__ == '__main__':
+    unittest.main()
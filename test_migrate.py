@@ -0,0 +1,136 @@
+# Note, run with -b flag to suppress output
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from migrate import apply_transforms, fix_away_goals, register_transform, run_migration, transforms
+from match_manifest import load_manifest
+from test_epl_parser import load_test_json
+from test_match_manifest import FakeBucket
+
+class TestTransforms(unittest.TestCase):
+    def setUp(self):
+        self.match = load_test_json('match_report.json')
+    def test_fix_away_goals(self):
+        """
+        Test that the away score and result are recounted from player goals
+        """
+        self.match['AwayStats']['Goals'] = 3
+        self.match['Result'] = 'Away'
+        fixed = apply_transforms(self.match, ['fix-away-goals'])
+        self.assertEqual(fixed['AwayStats']['Goals'], 1)
+        self.assertEqual(fixed['Result'], 'Home')
+        self.assertEqual(self.match['AwayStats']['Goals'], 3)
+    def test_convert_stat_types(self):
+        """
+        Test that stats stored as strings are converted to numbers
+        """
+        self.match['HomePlayers'][0]['Gls'] = '1'
+        self.match['HomeKeepers'][0]['PSxG'] = '0.4'
+        converted = apply_transforms(self.match, ['convert-stat-types'])
+        self.assertEqual(converted['HomePlayers'][0]['Gls'], 1)
+        self.assertEqual(converted['HomeKeepers'][0]['PSxG'], 0.4)
+
+class TestRunMigration(unittest.TestCase):
+    def setUp(self):
+        self.bucket = FakeBucket()
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.directory, 'migration.checkpoint')
+        match = load_test_json('match_report.json')
+        bad_match = json.loads(json.dumps(match))
+        bad_match['AwayStats']['Goals'] = 0
+        bad_match['Result'] = 'Home'
+        self.bucket.put('05Jan2021_Arsenal_vs_Chelsea.json', json.dumps(bad_match))
+        self.bucket.put('06Jan2021_Everton_vs_Fulham.json', json.dumps(match))
+        self.bucket.put('todays_analysis.json', '[]')
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def stored(self, name):
+        return json.loads(self.bucket.objects[name][0])
+
+    def test_run_migration_rewrites_changed_files(self):
+        """
+        Test that only files changed by the transforms are rewritten
+        """
+        results = run_migration(self.bucket, ['fix-away-goals'], checkpoint_path=self.checkpoint)
+        self.assertEqual(results['changed'], 1)
+        self.assertEqual(results['unchanged'], 1)
+        self.assertEqual(self.stored('05Jan2021_Arsenal_vs_Chelsea.json')['AwayStats']['Goals'], 1)
+        self.assertEqual(self.stored('todays_analysis.json'), [])
+        self.assertEqual(load_manifest(self.bucket)['Matches']['05Jan2021_Arsenal_vs_Chelsea.json']['AwayGoals'], 1)
+    def test_run_migration_dry_run(self):
+        """
+        Test that a dry run doesn't write files or checkpoints
+        """
+        results = run_migration(self.bucket, ['fix-away-goals'], dry_run=True, checkpoint_path=self.checkpoint)
+        self.assertEqual(results['changed'], 1)
+        self.assertEqual(self.stored('05Jan2021_Arsenal_vs_Chelsea.json')['AwayStats']['Goals'], 0)
+        self.assertFalse(os.path.exists(self.checkpoint))
+    def test_run_migration_resumes_from_checkpoint(self):
+        """
+        Test that files recorded in the checkpoint are skipped
+        """
+        with open(self.checkpoint, 'w') as checkpoint_file:
+            checkpoint_file.write('fix-away-goals\t05Jan2021_Arsenal_vs_Chelsea.json\n')
+        results = run_migration(self.bucket, ['fix-away-goals'], checkpoint_path=self.checkpoint)
+        self.assertEqual(results['skipped'], 1)
+        self.assertEqual(results['changed'], 0)
+        self.assertEqual(self.stored('05Jan2021_Arsenal_vs_Chelsea.json')['AwayStats']['Goals'], 0)
+        # The run finished every file, so its checkpoint is removed
+        self.assertFalse(os.path.exists(self.checkpoint))
+    def test_run_migration_checkpoint_per_transforms(self):
+        """
+        Test that files checkpointed by other transforms aren't skipped
+        """
+        with open(self.checkpoint, 'w') as checkpoint_file:
+            checkpoint_file.write('convert-stat-types\t05Jan2021_Arsenal_vs_Chelsea.json\n')
+        results = run_migration(self.bucket, ['fix-away-goals'], checkpoint_path=self.checkpoint)
+        self.assertEqual(results['skipped'], 0)
+        self.assertEqual(results['changed'], 1)
+    def test_run_migration_interrupted(self):
+        """
+        Test that files rewritten before an interruption have their manifest entries and checkpoints written
+        """
+        calls = []
+        @register_transform('test-interrupt')
+        def interrupt(match_json):
+            calls.append(match_json)
+            if len(calls) > 1:
+                raise KeyboardInterrupt
+            return fix_away_goals(match_json)
+        try:
+            self.assertRaises(KeyboardInterrupt, lambda: run_migration(
+                self.bucket, ['test-interrupt'], checkpoint_path=self.checkpoint, max_workers=1))
+        finally:
+            del transforms['test-interrupt']
+        entry = load_manifest(self.bucket)['Matches']['05Jan2021_Arsenal_vs_Chelsea.json']
+        self.assertEqual(entry['Generation'], self.bucket.stat('05Jan2021_Arsenal_vs_Chelsea.json').generation)
+        with open(self.checkpoint) as checkpoint_file:
+            self.assertEqual(checkpoint_file.read(), 'test-interrupt\t05Jan2021_Arsenal_vs_Chelsea.json\n')
+    def test_run_migration_conflict(self):
+        """
+        Test that a file changed during the migration isn't overwritten
+        """
+        bucket = self.bucket
+        @register_transform('test-concurrent-change')
+        def concurrent_change(match_json):
+            bucket.put('05Jan2021_Arsenal_vs_Chelsea.json', '{"changed": true}')
+            match_json['Result'] = 'Draw'
+            return match_json
+        try:
+            results = run_migration(self.bucket, ['test-concurrent-change'], max_workers=1)
+        finally:
+            del transforms['test-concurrent-change']
+        self.assertGreaterEqual(results['conflict'], 1)
+        self.assertEqual(self.stored('05Jan2021_Arsenal_vs_Chelsea.json'), {'changed': True})
+    def test_run_migration_unknown_transform(self):
+        """
+        Test that unknown transforms are rejected before anything runs
+        """
+        self.assertRaises(ValueError, lambda: run_migration(self.bucket, ['not-a-transform']))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+# Note, run with -b flag to suppress output
+import os
+import shutil
+import tempfile
+import unittest
+
+import main
+from page_cache import PageCache, content_hash
+
+match_url = 'http://fbref.com/en/matches/e74c00f4/Sheffield-United-Chelsea-September-12-2020-Premier-League'
+schedule_url = 'http://fbref.com/en/comps/9/schedule/Premier-League-Scores-and-Fixtures'
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+class TestPageCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = FakeClock()
+        self.cache = PageCache(self.directory, clock=self.clock)
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_ttl_for_urls(self):
+        """
+        Test that match reports never expire and the schedule expires quickly
+        """
+        self.assertIsNone(self.cache.ttl_for(match_url))
+        self.assertEqual(self.cache.ttl_for(schedule_url), 600)
+        self.assertEqual(self.cache.ttl_for('http://example.com/'), 300)
+    def test_store_and_lookup(self):
+        """
+        Test that a stored page is read back with its validators and hash
+        """
+        self.cache.store(schedule_url, '<html></html>', '"abc"', 'Tue, 05 Jan 2021 20:00:00 GMT')
+        entry = self.cache.lookup(schedule_url)
+        self.assertEqual(entry['Body'], '<html></html>')
+        self.assertEqual(entry['Hash'], content_hash('<html></html>'))
+        self.assertEqual(self.cache.conditional_headers(entry), {
+            'If-None-Match': '"abc"',
+            'If-Modified-Since': 'Tue, 05 Jan 2021 20:00:00 GMT'
+        })
+    def test_freshness(self):
+        """
+        Test that entries go stale after their TTL, unless they never expire
+        """
+        schedule_entry = self.cache.store(schedule_url, 'a')
+        match_entry = self.cache.store(match_url, 'b')
+        self.assertTrue(self.cache.is_fresh(schedule_entry))
+        self.clock.now += 601
+        self.assertFalse(self.cache.is_fresh(schedule_entry))
+        self.assertTrue(self.cache.is_fresh(match_entry))
+        self.cache.revalidated(schedule_url, schedule_entry)
+        self.assertTrue(self.cache.is_fresh(self.cache.lookup(schedule_url)))
+    def test_lookup_missing(self):
+        """
+        Test that an unknown URL has no entry and no conditional headers
+        """
+        self.assertIsNone(self.cache.lookup(match_url))
+        self.assertEqual(self.cache.conditional_headers(None), {})
+
+    def test_eviction(self):
+        """
+        Test that the least recently used pages are evicted once the cache is over its size
+        """
+        cache = PageCache(self.directory, clock=self.clock, max_bytes=2000)
+        cache.store(match_url + '1', 'a' * 500)
+        cache.store(match_url + '2', 'b' * 500)
+        os.utime(cache._path(match_url + '1'), (1, 1))
+        cache.store(match_url + '3', 'c' * 500)
+        self.assertIsNone(cache.lookup(match_url + '1'))
+        self.assertIsNotNone(cache.lookup(match_url + '3'))
+        self.assertGreater(cache.stats()['evictions'], 0)
+
+class FakeResponse:
+    def __init__(self, status_code, text='', headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+class TestGetPageContentCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = FakeClock()
+        self.requests = []
+        self.responses = []
+        def fake_fetch_static_page(url, headers=None):
+            self.requests.append(headers)
+            return self.responses.pop(0)
+        self.saved = (main.page_cache, main.fetch_static_page, main.fetch_mode, main.host_rate_limiter)
+        main.page_cache = PageCache(self.directory, clock=self.clock)
+        main.fetch_static_page = fake_fetch_static_page
+        main.fetch_mode = 'static'
+        main.host_rate_limiter = main.HostRateLimiter()
+        self.page = '<table id="sched_2020-2021_9_1"></table>'
+    def tearDown(self):
+        main.page_cache, main.fetch_static_page, main.fetch_mode, main.host_rate_limiter = self.saved
+        shutil.rmtree(self.directory)
+
+    def test_fresh_page_skips_network(self):
+        """
+        Test that a fresh cached page is returned without a request
+        """
+        self.responses = [FakeResponse(200, self.page, {'ETag': '"v1"'})]
+        self.assertEqual(main.event_loop.run(main.get_page_content(schedule_url, main.schedule_tables)), self.page)
+        self.assertEqual(main.event_loop.run(main.get_page_content(schedule_url, main.schedule_tables)), self.page)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(main.page_cache.stats(), {'hits': 1, 'misses': 1, 'revalidations': 0, 'evictions': 0})
+    def test_counts_per_call(self):
+        """
+        Test that hits and misses are also counted in the counts passed in
+        """
+        self.responses = [FakeResponse(200, self.page)]
+        main.page_cache.record('hits')
+        cache_counts = {}
+        main.event_loop.run(main.get_page_content(schedule_url, main.schedule_tables, cache_counts))
+        main.event_loop.run(main.get_page_content(schedule_url, main.schedule_tables, cache_counts))
+        self.assertEqual(cache_counts, {'hits': 1, 'misses': 1})
+    def test_stale_page_revalidated(self):
+        """
+        Test that a stale page is revalidated with a conditional request
+        """
+        self.responses = [FakeResponse(200, self.page, {'ETag': '"v1"'}), FakeResponse(304)]
+        main.event_loop.run(main.get_page_content(schedule_url, main.schedule_tables))
+        self.clock.now += 601
+        self.assertEqual(main.event_loop.run(main.get_page_content(schedule_url, main.schedule_tables)), self.page)
+        self.assertEqual(self.requests[1], {'If-None-Match': '"v1"'})
+        self.assertEqual(main.page_cache.stats(), {'hits': 1, 'misses': 1, 'revalidations': 1, 'evictions': 0})
+
+if __name__ == '__main__':
+    unittest.main()
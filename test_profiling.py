@@ -0,0 +1,131 @@
+# Note, run with -b flag to suppress output
+import marshal
+import os
+import pstats
+import shutil
+import tempfile
+import time
+import unittest
+
+import main
+from jobs import JobQueue
+from profiling import RequestProfiler, collapsed_stacks, sign_profile_request, verify_profile_request
+from test_match_manifest import FakeBucket
+
+class TestProfileSignature(unittest.TestCase):
+    def test_verify_profile_request(self):
+        """
+        Test that a signature is only accepted for its path, secret and lifetime
+        """
+        value = sign_profile_request('secret', '/run-analysis', 2000)
+        self.assertTrue(verify_profile_request('secret', '/run-analysis', value, now=1000))
+        self.assertFalse(verify_profile_request('secret', '/view-analysis', value, now=1000))
+        self.assertFalse(verify_profile_request('other', '/run-analysis', value, now=1000))
+        self.assertFalse(verify_profile_request('secret', '/run-analysis', value, now=3000))
+        self.assertFalse(verify_profile_request(None, '/run-analysis', value, now=1000))
+        self.assertFalse(verify_profile_request('secret', '/run-analysis', 'garbage', now=1000))
+
+class TestRequestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_sampling(self):
+        """
+        Test that unsigned requests are profiled at the sample rate only when enabled
+        """
+        self.assertFalse(RequestProfiler(enabled=False, sample_rate=1.0).should_profile('/'))
+        self.assertTrue(RequestProfiler(enabled=True, sample_rate=0.5, rng=lambda: 0.4).should_profile('/'))
+        self.assertFalse(RequestProfiler(enabled=True, sample_rate=0.5, rng=lambda: 0.6).should_profile('/'))
+    def test_profile_written(self):
+        """
+        Test that a profile is written in pstats and collapsed stack formats
+        """
+        profiler = RequestProfiler(enabled=True, sample_rate=1.0, directory=self.directory, sample_interval=0.001)
+        session = profiler.start('/view-analysis')
+        # Only one request is profiled at a time
+        self.assertIsNone(profiler.start('/view-analysis'))
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            sum(range(1000))
+        name = profiler.finish(session)
+        self.assertIn('view-analysis', name)
+        with open(os.path.join(self.directory, name + '.pstats'), 'rb') as pstats_file:
+            self.assertIsInstance(marshal.load(pstats_file), dict)
+        with open(os.path.join(self.directory, name + '.collapsed')) as collapsed_file:
+            lines = collapsed_file.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+        # Finishing frees the profiler for the next request
+        session = profiler.start('/view-analysis')
+        self.assertIsNotNone(session)
+        profiler.finish(session)
+    def test_profile_to_storage(self):
+        """
+        Test that profiles can be written to the storage backend
+        """
+        bucket = FakeBucket()
+        profiler = RequestProfiler(enabled=True, sample_rate=1.0, output='storage', storage=bucket)
+        name = profiler.finish(profiler.start('/'))
+        self.assertEqual(sorted(bucket.objects), ['profiles/' + name + '.collapsed', 'profiles/' + name + '.pstats'])
+    def test_collapsed_stacks(self):
+        """
+        Test the collapsed stack format
+        """
+        self.assertEqual(collapsed_stacks({'a;b': 3, 'a': 1}), 'a 1\na;b 3\n')
+
+class TestProfiledRequest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.saved = main.request_profiler
+        main.request_profiler = RequestProfiler(secret='secret', directory=self.directory)
+    def tearDown(self):
+        main.request_profiler = self.saved
+        shutil.rmtree(self.directory)
+
+    def test_signed_request_profiled(self):
+        """
+        Test that only requests with a valid signature are profiled
+        """
+        client = main.app.test_client()
+        self.assertNotIn('X-Profile', client.get('/?profile=1.abc').headers)
+        response = client.get('/?profile=' + sign_profile_request('secret', '/', int(time.time()) + 60))
+        self.assertIn('X-Profile', response.headers)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, response.headers['X-Profile'] + '.pstats')))
+
+class TestProfiledJob(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        async def fake_get_matches_for_dates(dates, bucket):
+            return {date: [] for date in dates}
+        self.saved = (main.request_profiler, main.job_queue, main.get_matches_for_dates, main.storage_backend)
+        main.request_profiler = RequestProfiler(secret='secret', directory=self.directory)
+        main.job_queue = JobQueue(main.event_loop, profiler=main.request_profiler)
+        main.get_matches_for_dates = fake_get_matches_for_dates
+        main.storage_backend = FakeBucket()
+    def tearDown(self):
+        main.request_profiler, main.job_queue, main.get_matches_for_dates, main.storage_backend = self.saved
+        shutil.rmtree(self.directory)
+
+    def test_profiled_request_profiles_job(self):
+        """
+        Test that a profiled request starting a job hands its profile to the job
+        """
+        client = main.app.test_client()
+        response = client.get('/run-analysis?profile=' + sign_profile_request('secret', '/run-analysis', int(time.time()) + 60))
+        self.assertEqual(response.status_code, 202)
+        self.assertNotIn('X-Profile', response.headers)
+        job = main.job_queue.get(response.get_json()['Id'])
+        self.assertEqual(job.future.result(5), 'Success running analysis')
+        name = job.describe()['Profile']
+        self.assertIn('run-analysis', name)
+        # The blocking calls the job made are in the profile
+        functions = [function for file_name, line, function in pstats.Stats(os.path.join(self.directory, name + '.pstats')).stats]
+        self.assertIn('score_analysis', functions)
+        self.assertIn('put_many', functions)
+        # The profiler is free for the next request
+        self.assertIn('X-Profile', client.get('/?profile=' + sign_profile_request('secret', '/', int(time.time()) + 60)).headers)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# Note, run with -b flag to suppress output
+import unittest
+
+from rate_limit import HostRateLimiter, TokenBucket, url_host
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+    def __call__(self):
+        return self.now
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+class TestTokenBucket(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = TokenBucket(0.5, 2, clock=self.clock, sleep=self.clock.sleep)
+    def test_token_bucket_burst(self):
+        """
+        Test that a full bucket serves its capacity without waiting
+        """
+        self.assertEqual(self.bucket.acquire(), 0)
+        self.assertEqual(self.bucket.acquire(), 0)
+        self.assertEqual(self.clock.slept, [])
+    def test_token_bucket_waits_when_empty(self):
+        """
+        Test that an empty bucket makes callers wait for the next token
+        """
+        self.bucket.acquire()
+        self.bucket.acquire()
+        self.assertEqual(self.bucket.acquire(), 2.0)
+    def test_token_bucket_reservations_queue(self):
+        """
+        Test that callers reserving at the same time wait in turn
+        """
+        self.bucket.reserve()
+        self.bucket.reserve()
+        self.assertEqual(self.bucket.reserve(), 2.0)
+        self.assertEqual(self.bucket.reserve(), 4.0)
+    def test_token_bucket_refills(self):
+        """
+        Test that tokens refill over time, up to the capacity
+        """
+        self.bucket.acquire()
+        self.bucket.acquire()
+        self.clock.now += 60
+        self.assertEqual(self.bucket.acquire(), 0)
+        self.assertEqual(self.bucket.acquire(), 0)
+        self.assertGreater(self.bucket.acquire(), 0)
+    def test_token_bucket_bad_rate(self):
+        """
+        Test that a bucket needs a positive rate
+        """
+        self.assertRaises(ValueError, lambda: TokenBucket(0))
+
+class TestHostRateLimiter(unittest.TestCase):
+    def test_url_host(self):
+        """
+        Test that the host is read from a URL without www.
+        """
+        self.assertEqual(url_host('https://www.fbref.com/en/matches/abc'), 'fbref.com')
+        self.assertEqual(url_host('http://fbref.com/en/comps/9/schedule'), 'fbref.com')
+    def test_host_rate_limiter_limits_host(self):
+        """
+        Test that only hosts with a bucket are limited
+        """
+        clock = FakeClock()
+        limiter = HostRateLimiter({'fbref.com': TokenBucket(1, 1, clock=clock, sleep=clock.sleep)})
+        limiter.acquire('http://fbref.com/a')
+        self.assertEqual(limiter.acquire('http://www.fbref.com/b'), 1)
+        self.assertEqual(limiter.acquire('http://example.com/c'), 0)
+    def test_host_rate_limiter_reserve(self):
+        """
+        Test that reserve returns the wait without sleeping
+        """
+        clock = FakeClock()
+        limiter = HostRateLimiter({'fbref.com': TokenBucket(1, 1, clock=clock, sleep=clock.sleep)})
+        self.assertEqual(limiter.reserve('http://fbref.com/a'), 0)
+        self.assertEqual(limiter.reserve('http://fbref.com/b'), 1)
+        self.assertEqual(limiter.reserve('http://example.com/c'), 0)
+        self.assertEqual(clock.slept, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+# Note, run with -b flag to suppress output
+import gzip
+import json
+import unittest
+
+from match_manifest import load_manifest
+from reparse import reparse_archive
+from test_epl_parser import load_test_json, load_test_page
+from test_match_manifest import FakeBucket
+
+class TestReparseArchive(unittest.TestCase):
+    def setUp(self):
+        self.bucket = FakeBucket()
+        self.file_name = '05Jan2021_Arsenal_vs_Chelsea.json'
+        self.match = load_test_json('match_report.json')
+        self.bucket.put('05Jan2021_Arsenal_vs_Chelsea.html.gz',
+            gzip.compress(load_test_page('match_report.html').encode()))
+
+    def stored_match(self):
+        return json.loads(self.bucket.objects[self.file_name][0])
+
+    def test_reparse_unchanged(self):
+        """
+        Test that a match whose JSON already matches the parser isn't rewritten
+        """
+        self.bucket.put(self.file_name, json.dumps(self.match))
+        generation = self.bucket.objects[self.file_name][1]
+        results = reparse_archive(self.bucket)
+        self.assertEqual(results['unchanged'], 1)
+        self.assertEqual(self.bucket.objects[self.file_name][1], generation)
+    def test_reparse_changed(self):
+        """
+        Test that a match with wrong JSON is regenerated and added to the manifest
+        """
+        bad_match = json.loads(json.dumps(self.match))
+        bad_match['AwayStats']['Goals'] = 0
+        self.bucket.put(self.file_name, json.dumps(bad_match))
+        results = reparse_archive(self.bucket)
+        self.assertEqual(results['changed'], 1)
+        self.assertEqual(self.stored_match(), self.match)
+        self.assertEqual(load_manifest(self.bucket)['Matches'][self.file_name]['AwayGoals'], 1)
+    def test_reparse_dry_run(self):
+        """
+        Test that a dry run reports changes without writing them
+        """
+        bad_match = json.loads(json.dumps(self.match))
+        bad_match['Result'] = 'Draw'
+        self.bucket.put(self.file_name, json.dumps(bad_match))
+        results = reparse_archive(self.bucket, dry_run=True)
+        self.assertEqual(results['changed'], 1)
+        self.assertEqual(self.stored_match()['Result'], 'Draw')
+
+if __name__ == '__main__':
+    unittest.main()
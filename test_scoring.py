@@ -0,0 +1,88 @@
+# Note, run with -b flag to suppress output
+import unittest
+
+from main import extract_one_match_team
+from scoring import score_analysis, score_keepers, score_players, rule_sets
+from test_epl_parser import load_test_json
+
+# The formulas the analysis page used before points were computed in Python
+def expected_player_points(player, gls_against):
+    points = (10*player['Gls'] + 6*player['Asts'] + player['Sh'] + player['SoT'] + 0.7*player['Crs'] + player['AstShots'] +
+              0.02*player['pComp'] + player['Fld'] - 0.5*player['Fls'] + player['TklW'] + 0.5*player['Int'] -
+              1.5*player['CrdY'] - 3*player['CrdR'])
+    if ('LB' in player['Pos'] or 'CB' in player['Pos'] or 'RB' in player['Pos']) and gls_against == 0:
+        points += 3
+    return points
+
+def expected_keeper_points(keeper, result):
+    points = 2*(keeper['SoTA'] - keeper['GA']) - 2*keeper['GA']
+    if keeper['GA'] == 0:
+        points += 5
+        if result == 'Win':
+            points += 5
+    return points
+
+class TestScoring(unittest.TestCase):
+    def setUp(self):
+        self.rules = rule_sets['draftkings']
+
+    def test_score_players(self):
+        """
+        Test that player points match the DraftKings formula
+        """
+        match = load_test_json('match_report.json')
+        players = [player for player in match['HomePlayers'] if player['Pos'] != 'GK']
+        for conceded in [0, 1]:
+            points, clean_sheets = score_players(players, [conceded] * len(players), self.rules)
+            for player, player_points in zip(players, points):
+                self.assertAlmostEqual(player_points, expected_player_points(player, conceded))
+    def test_clean_sheet_eligibility(self):
+        """
+        Test that only defenders can earn the outfield clean sheet
+        """
+        players = [{'Pos': 'CB'}, {'Pos': 'FW,LB'}, {'Pos': 'FW'}, {'Pos': 'RB'}]
+        points, clean_sheets = score_players(players, [0, 0, 0, 2], self.rules)
+        self.assertEqual(clean_sheets, [True, True, None, False])
+        self.assertEqual(points.tolist(), [3, 3, 0, 0])
+    def test_score_keepers(self):
+        """
+        Test the keeper clean sheet and clean sheet win bonuses
+        """
+        keepers = [{'SoTA': 4, 'GA': 0}, {'SoTA': 4, 'GA': 0}, {'SoTA': 5, 'GA': 2}]
+        points, clean_sheets = score_keepers(keepers, [True, False, True], self.rules)
+        self.assertEqual(points.tolist(), [18, 13, 2])
+        self.assertEqual(clean_sheets, [True, True, False])
+
+class TestScoreAnalysis(unittest.TestCase):
+    def test_score_analysis(self):
+        """
+        Test that every past match in an analysis is scored in place
+        """
+        match_json = load_test_json('match_report_draw.json')
+        home = extract_one_match_team(match_json, match_json['HomeStats']['Team'])
+        away = extract_one_match_team(match_json, match_json['AwayStats']['Team'])
+        analysis = {'20210214': [{'HomeTeam': {'PastMatches': [home, None]}, 'AwayTeam': {'PastMatches': [away]}}],
+                    '20210215': "Error retrieving fixture content from URL"}
+        score_analysis(analysis)
+        for past_match in [home, away]:
+            self.assertEqual(past_match['Scoring'], 'DK')
+            for player in past_match['Players']:
+                if player['Pos'] != 'GK':
+                    self.assertAlmostEqual(player['Pts'], expected_player_points(player, past_match['GlsAgainst']))
+            for keeper in past_match['Keepers']:
+                self.assertEqual(keeper['Pts'], expected_keeper_points(keeper, past_match['Result']))
+                self.assertEqual(keeper['Cln'], 1)
+    def test_score_analysis_keeps_scored(self):
+        """
+        Test that already scored matches are skipped unless rescoring
+        """
+        match_json = load_test_json('match_report.json')
+        home = extract_one_match_team(match_json, match_json['HomeStats']['Team'])
+        analysis = {'20210106': [{'HomeTeam': {'PastMatches': [home]}, 'AwayTeam': {'PastMatches': []}}]}
+        score_analysis(analysis)
+        home['Keepers'][0]['Pts'] = -1
+        score_analysis(analysis, rescore=False)
+        self.assertEqual(home['Keepers'][0]['Pts'], -1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# Note, run with -b flag to suppress output
+import unittest
+
+from season_store import SeasonStore, season_store_file_name, update_season_store
+from test_epl_parser import load_test_json
+from test_match_manifest import FakeBucket
+
+class TestSeasonStore(unittest.TestCase):
+    def setUp(self):
+        self.match = load_test_json('match_report.json')
+        self.draw = load_test_json('match_report_draw.json')
+        self.store = SeasonStore()
+        self.store.add_match('05Jan2021_Arsenal_vs_Chelsea.json', self.match)
+        self.store.add_match('13Feb2021_Brighton_&_Hove_Albion_vs_Sheffield_United.json', self.draw)
+
+    def test_team_totals_match_stored_goals(self):
+        """
+        Test that goals summed by team match each team's score
+        """
+        results = self.store.query(['Gls'], start='2021-01-05', end='2021-01-05', group_by='team')
+        goals = {result['Team']: result['Gls'] for result in results}
+        self.assertEqual(goals, {'Arsenal': 2, 'Chelsea': 1})
+    def test_player_filter_and_mean(self):
+        """
+        Test filtering by player and averaging over their appearances
+        """
+        player = self.match['HomePlayers'][1]
+        results = self.store.query(['Min', 'xG'], player=player['Name'], end='2021-01-31', agg='mean')
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['Appearances'], 1)
+        self.assertAlmostEqual(results[0]['xG'], player['xG'], places=5)
+    def test_position_filter(self):
+        """
+        Test that a position matches players listed with several positions
+        """
+        expected = set(player['Name'] for player in self.match['HomePlayers'] + self.match['AwayPlayers']
+                       if 'CB' in player['Pos'].split(','))
+        results = self.store.query(['Min'], position='CB', end='2021-01-31')
+        self.assertEqual(set(result['Player'] for result in results), expected)
+    def test_keeper_stats(self):
+        """
+        Test that keeper rows carry keeper stats and are kept apart from outfield rows
+        """
+        results = self.store.query(['GA', 'SoTA'], keepers=True, group_by=None)
+        keepers = self.match['HomeKeepers'] + self.match['AwayKeepers'] + self.draw['HomeKeepers'] + self.draw['AwayKeepers']
+        self.assertEqual(results[0]['Appearances'], len(keepers))
+        self.assertEqual(results[0]['GA'], sum(keeper['GA'] for keeper in keepers))
+        self.assertEqual(self.store.query(['Gls'], keepers=True, group_by=None)[0]['Gls'], None)
+    def test_add_match_replaces_rows(self):
+        """
+        Test that storing a match again replaces its rows instead of duplicating them
+        """
+        rows = len(self.store)
+        self.store.add_match('05Jan2021_Arsenal_vs_Chelsea.json', self.match)
+        self.assertEqual(len(self.store), rows)
+    def test_round_trip(self):
+        """
+        Test that a store reads back the same as it was written
+        """
+        copy = SeasonStore.from_bytes(self.store.to_bytes())
+        self.assertEqual(copy.query(['Gls', 'xG'], group_by='team'), self.store.query(['Gls', 'xG'], group_by='team'))
+        copy.add_match('05Jan2021_Arsenal_vs_Chelsea.json', self.match)
+        self.assertEqual(len(copy), len(self.store))
+    def test_unknown_stat(self):
+        """
+        Test that querying an unknown stat raises an error
+        """
+        self.assertRaises(ValueError, lambda: self.store.query(['Nope']))
+
+class TestUpdateSeasonStore(unittest.TestCase):
+    def test_update_season_store(self):
+        """
+        Test that updates are written with a generation precondition and accumulate
+        """
+        bucket = FakeBucket()
+        update_season_store(bucket, [('05Jan2021_Arsenal_vs_Chelsea.json', load_test_json('match_report.json'))])
+        store = update_season_store(bucket, [('13Feb2021_Brighton_&_Hove_Albion_vs_Sheffield_United.json', load_test_json('match_report_draw.json'))])
+        self.assertEqual(len(store.tables['matches']), 2)
+        self.assertEqual(bucket.objects[season_store_file_name][1], 2)
+
+if __name__ == '__main__':
+    unittest.main()
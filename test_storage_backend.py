@@ -0,0 +1,172 @@
+# Note, run with -b flag to suppress output
+import concurrent.futures
+import shutil
+import tempfile
+import unittest
+
+from storage_backend import GCSBackend, LocalBackend, PreconditionFailed, StorageError
+
+# Stand-ins for the Cloud Storage client, bucket and batch. Calls made while a
+# batch is open are answered when it closes, like the real client
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+class FakeGCSBatch:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+        self._responses = []
+    def __enter__(self):
+        self.client.current_batch = self
+        return self
+    def __exit__(self, *exc_info):
+        self.client.current_batch = None
+        self.client.batches.append(len(self.calls))
+        for call in self.calls:
+            self._responses.append(FakeResponse(call()))
+
+class FakeGCSClient:
+    def __init__(self, objects):
+        self.objects = objects
+        self.current_batch = None
+        self.batches = []
+    def bucket(self, name):
+        return FakeGCSBucket(self)
+    def batch(self, raise_exception=True):
+        return FakeGCSBatch(self)
+
+class FakeGCSBucket:
+    def __init__(self, client):
+        self.client = client
+    def blob(self, name):
+        return FakeGCSBlob(self.client, name)
+
+class FakeGCSBlob:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.generation = None
+        self.size = None
+    def reload(self):
+        def call():
+            if self.name not in self.client.objects:
+                return 404
+            self.generation, self.size = self.client.objects[self.name]
+            return 200
+        self.client.current_batch.calls.append(call)
+    def delete(self):
+        def call():
+            return 204 if self.client.objects.pop(self.name, None) is not None else 404
+        self.client.current_batch.calls.append(call)
+
+class TestLocalBackend(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.backend = LocalBackend(self.directory)
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_and_get(self):
+        """
+        Test that an object reads back with the generation it was written at
+        """
+        stored = self.backend.put('a.json', '{"a": 1}', 'application/json')
+        data, read = self.backend.get_object('a.json')
+        self.assertEqual(data, b'{"a": 1}')
+        self.assertEqual(read, stored)
+        self.assertEqual(self.backend.stat('a.json'), stored)
+        self.assertEqual(self.backend.get('a.json', stored.generation), b'{"a": 1}')
+    def test_missing_object(self):
+        """
+        Test that a missing object reads as None
+        """
+        self.assertIsNone(self.backend.get('missing.json'))
+        self.assertIsNone(self.backend.get('missing.json', 1))
+        self.assertEqual(self.backend.get_object('missing.json'), (None, None))
+        self.assertIsNone(self.backend.stat('missing.json'))
+        self.assertFalse(self.backend.delete('missing.json'))
+    def test_generations_change(self):
+        """
+        Test that rewriting an object gives it a new generation and conditions apply
+        """
+        first = self.backend.put_if_absent('a.json', '1')
+        self.assertRaises(PreconditionFailed, lambda: self.backend.put_if_absent('a.json', '2'))
+        second = self.backend.put('a.json', '2', if_generation_match=first.generation)
+        self.assertGreater(second.generation, first.generation)
+        self.assertRaises(PreconditionFailed, lambda: self.backend.put('a.json', '3', if_generation_match=first.generation))
+        self.assertRaises(PreconditionFailed, lambda: self.backend.get('a.json', first.generation))
+        self.assertEqual(self.backend.get('a.json'), b'2')
+    def test_list_with_prefix(self):
+        """
+        Test that listing returns stored objects (including nested names) by prefix
+        """
+        for name in ['b.json', 'a.json', 'archive/a.html.gz']:
+            self.backend.put(name, 'x')
+        self.assertEqual([stored.name for stored in self.backend.list()], ['a.json', 'archive/a.html.gz', 'b.json'])
+        self.assertEqual([stored.name for stored in self.backend.list('archive/')], ['archive/a.html.gz'])
+    def test_batch_operations(self):
+        """
+        Test the batch stat, get, put and delete operations
+        """
+        self.backend.put_many([('a.json', '1', None), ('b.json', '2', None)])
+        self.assertEqual(self.backend.get_many(['a.json', 'b.json', 'c.json']), {'a.json': b'1', 'b.json': b'2', 'c.json': None})
+        stats = self.backend.stat_many(['a.json', 'c.json'])
+        self.assertEqual(stats['a.json'].size, 1)
+        self.assertIsNone(stats['c.json'])
+        self.assertEqual(self.backend.delete_many(['a.json', 'c.json']), {'a.json': True, 'c.json': False})
+        self.assertEqual([stored.name for stored in self.backend.list()], ['b.json'])
+    def test_concurrent_put_if_absent(self):
+        """
+        Test that only one of many racing creates succeeds
+        """
+        def create(value):
+            try:
+                self.backend.put_if_absent('a.json', str(value))
+                return True
+            except PreconditionFailed:
+                return False
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(create, range(16)))
+        self.assertEqual(results.count(True), 1)
+    def test_invalid_names(self):
+        """
+        Test that names outside the root or reserved for the backend are rejected
+        """
+        for name in ['', '/etc/passwd', '../a.json', '.lock', 'a/../../b']:
+            self.assertRaises(StorageError, lambda: self.backend.put(name, 'x'))
+
+class TestGCSBatches(unittest.TestCase):
+    def setUp(self):
+        self.objects = {'object%d.json' % index: (index + 1, 10) for index in range(150)}
+        self.batch_client = FakeGCSClient(self.objects)
+        self.backend = GCSBackend('bucket', client=FakeGCSClient(self.objects), batch_client=self.batch_client)
+
+    def test_stat_many(self):
+        """
+        Test that metadata for many objects is fetched in batches of at most 100
+        """
+        names = sorted(self.objects) + ['missing.json']
+        stats = self.backend.stat_many(names)
+        self.assertEqual(self.batch_client.batches, [100, 51])
+        self.assertEqual(stats['object3.json'].generation, 4)
+        self.assertIsNone(stats['missing.json'])
+    def test_delete_many(self):
+        """
+        Test that deletes are batched and report which objects existed
+        """
+        results = self.backend.delete_many(['object1.json', 'object2.json', 'missing.json'])
+        self.assertEqual(results, {'object1.json': True, 'object2.json': True, 'missing.json': False})
+        self.assertEqual(self.batch_client.batches, [3])
+        self.assertNotIn('object1.json', self.objects)
+    def test_batch_client_required(self):
+        """
+        Test that an injected client isn't shared with batches
+        """
+        client = FakeGCSClient(self.objects)
+        self.assertRaises(ValueError, lambda: GCSBackend('bucket', client=client))
+        self.assertRaises(ValueError, lambda: GCSBackend('bucket', batch_client=client))
+        self.assertRaises(ValueError, lambda: GCSBackend('bucket', client=client, batch_client=client))
+
+if __name__ == '__main__':
+    unittest.main()